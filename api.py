@@ -0,0 +1,486 @@
+import hashlib
+import io
+import sqlite3
+
+from flask import (
+    Blueprint, Response, abort, current_app, jsonify, request,
+    stream_with_context,
+)
+from werkzeug.exceptions import HTTPException
+
+from flask_db import get_db
+from flask_idempotency import idempotent
+from python_warehouse.alerts import alert_count, low_stock
+from python_warehouse.db import immediate, table_version
+from python_warehouse.history import parse_as_of, stock_as_of
+from python_warehouse.logistics import MovementError, product_stock, rehome
+from python_warehouse.order_numbers import allocate_order_ids
+from python_warehouse.ordering import (
+    InsufficientStock, UnknownProduct, place_order, reserve_order,
+)
+from python_warehouse.pagination import cached_count, keyset_page
+from python_warehouse.product_cache import get_product_cache
+from python_warehouse.search import search_products
+from python_warehouse.transfer import (
+    FORMATS, export_products, import_products, read_rows,
+)
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+class Resource:
+    """How one table is exposed: its columns, which of them a client must
+    send on create, which column bulk upserts match on, and which columns
+    the database maintains itself (readable, never written by clients)."""
+
+    def __init__(self, table, columns, required, conflict, id_type, defaults,
+                 computed=()):
+        self.table = table
+        self.columns = columns
+        self.required = required
+        self.conflict = conflict
+        self.id_type = id_type
+        self.defaults = defaults
+        self.computed = computed
+
+    @property
+    def writable(self):
+        return tuple(
+            c for c in self.columns if c != "id" and c not in self.computed
+        )
+
+    def to_dict(self, row):
+        return dict(zip(self.columns, row))
+
+
+RESOURCES = {
+    "products": Resource(
+        "products", ("id", "name", "quantity", "warehouse_id", "reorder_point"),
+        required=("name", "quantity"), conflict="name", id_type=int,
+        defaults={"warehouse_id": 1},
+    ),
+    "warehouses": Resource(
+        "warehouse", ("id", "location_name", "max_capacity", "used_capacity"),
+        required=("location_name",), conflict="location_name", id_type=int,
+        defaults={"max_capacity": 1000},
+        # the sum of the warehouse's stock, kept by trigger (migration 18)
+        computed=("used_capacity",),
+    ),
+    "orders": Resource(
+        "orders", ("id", "product", "quantity", "email", "status"),
+        required=("product", "quantity", "email"), conflict="id", id_type=str,
+        defaults={"status": "queued"},
+    ),
+}
+
+
+@api.errorhandler(HTTPException)
+def json_error(exc):
+    return jsonify(error=exc.description), exc.code
+
+
+@api.errorhandler(sqlite3.IntegrityError)
+def integrity_error(exc):
+    return jsonify(error=str(exc)), 409
+
+
+def json_body(kind):
+    body = request.get_json(silent=True)
+    if not isinstance(body, kind):
+        abort(400, f"Expected a JSON {kind.__name__} body")
+    return body
+
+
+# Columns that hold amounts of stock or space
+COUNT_FIELDS = {"quantity", "max_capacity", "reorder_point"}
+
+
+def integer(value):
+    """int(value) for JSON numbers and numeric strings, refusing booleans
+    and fractions rather than truncating them."""
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"Not an integer: {value!r}")
+    return int(value)
+
+
+def clean_row(resource, data, partial=False):
+    """Validate one incoming object and fill in defaults.
+
+    Counts must be non-negative integers, and a products warehouse_id an
+    integer, as changing it moves the product's stock (see rehome).
+    """
+    unknown = set(data) - set(resource.columns)
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    computed = set(data) & set(resource.computed)
+    if computed:
+        abort(400, f"Read-only fields: {', '.join(sorted(computed))}")
+    if not partial:
+        missing = [c for c in resource.required if data.get(c) in (None, "")]
+        if missing:
+            abort(400, f"Missing fields: {', '.join(missing)}")
+        data = {**resource.defaults, **data}
+    if resource.table == "products" and "warehouse_id" in data:
+        try:
+            data["warehouse_id"] = integer(data["warehouse_id"])
+        except (TypeError, ValueError):
+            abort(400, "warehouse_id must be an integer")
+    for field in sorted(COUNT_FIELDS.intersection(data)):
+        try:
+            data[field] = integer(data[field])
+            if data[field] < 0:
+                raise ValueError(data[field])
+        except (TypeError, ValueError):
+            abort(400, f"{field} must be a non-negative integer")
+    return data
+
+
+def rehome_products(conn, moves):
+    """Move each (product id, warehouse id)'s stock to its new home warehouse,
+    in the caller's transaction; 409 if a warehouse cannot take it."""
+    try:
+        for product_id, warehouse_id in moves:
+            rehome(conn, product_id, warehouse_id)
+    except MovementError as exc:
+        abort(409, str(exc))
+
+
+def conditional(resource, build):
+    """Answer with 304 when the client's ETag still matches.
+
+    The ETag is derived from the table's write counter and the request URL,
+    so a repeat poll costs one primary-key lookup and no row reads.
+    """
+    version = table_version(get_db(), resource.table)
+    etag = hashlib.sha1(f"{request.full_path}:{version}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    return response
+
+
+def list_items(resource):
+    limit = request.args.get("per_page", current_app.config["PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, current_app.config["MAX_PAGE_SIZE"]))
+
+    def build():
+        conn = get_db()
+        page = keyset_page(
+            conn, resource.table, ", ".join(resource.columns),
+            after=request.args.get("after", type=resource.id_type),
+            before=request.args.get("before", type=resource.id_type),
+            limit=limit,
+        )
+        return {
+            "items": [resource.to_dict(row) for row in page.rows],
+            "next_after": page.next_after,
+            "prev_before": page.prev_before,
+            "total": cached_count(conn, resource.table),
+        }
+
+    return conditional(resource, build)
+
+
+def fetch_one(resource, item_id):
+    row = get_db().execute(
+        f"SELECT {', '.join(resource.columns)} FROM {resource.table} WHERE id = ?",
+        (item_id,),
+    ).fetchone()
+    if row is None:
+        abort(404, f"No {resource.table} row with id {item_id}")
+    return resource.to_dict(row)
+
+
+def get_item(resource, item_id):
+    return conditional(resource, lambda: fetch_one(resource, item_id))
+
+
+def create_order(resource):
+    """Place an order, reserving its stock atomically.
+
+    Answers 404 for an unknown product and 409 when there is not enough
+    stock; in both cases nothing is written.
+    """
+    data = clean_row(resource, json_body(dict))
+    try:
+        order_id = place_order(
+            data["product"], data["quantity"], data["email"],
+            order_id=data.get("id"), conn=get_db(),
+        )
+    except ValueError as exc:
+        abort(400, str(exc))
+    except UnknownProduct:
+        abort(404, f"Unknown product {data['product']!r}")
+    except InsufficientStock:
+        abort(409, f"Not enough stock of {data['product']!r}")
+    return jsonify(fetch_one(resource, order_id)), 201
+
+
+def create_item(resource):
+    if resource.table == "orders":
+        return create_order(resource)
+    data = clean_row(resource, json_body(dict))
+    columns = [c for c in resource.columns if c in data]
+    with get_db() as conn:
+        cursor = conn.execute(
+            f"INSERT INTO {resource.table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})",
+            [data[c] for c in columns],
+        )
+    item_id = data.get("id", cursor.lastrowid)
+    return jsonify(fetch_one(resource, item_id)), 201
+
+
+def update_item(resource, item_id):
+    data = clean_row(resource, json_body(dict), partial=True)
+    data.pop("id", None)
+    if data:
+        conn = get_db()
+        with immediate(conn):
+            if resource.table == "products" and "warehouse_id" in data:
+                rehome_products(conn, [(item_id, data["warehouse_id"])])
+            conn.execute(
+                f"UPDATE {resource.table} SET "
+                f"{', '.join(f'{c} = ?' for c in data)} WHERE id = ?",
+                [*data.values(), item_id],
+            )
+    return jsonify(fetch_one(resource, item_id))
+
+
+def delete_item(resource, item_id):
+    with get_db() as conn:
+        cursor = conn.execute(
+            f"DELETE FROM {resource.table} WHERE id = ?", (item_id,)
+        )
+    if cursor.rowcount == 0:
+        abort(404, f"No {resource.table} row with id {item_id}")
+    return "", 204
+
+
+def bulk_upsert(resource):
+    """Insert or overwrite many rows in one transaction.
+
+    Rows are matched on the resource's conflict column (product name or
+    warehouse name) and written with a single executemany. Defaults only
+    fill in new rows: an existing row has just the fields the client sent
+    overwritten. Orders are placed instead (see bulk_orders).
+    """
+    sent = json_body(list)
+    rows = [clean_row(resource, row) for row in sent]
+    if not rows:
+        return jsonify(written=0)
+    if resource.table == "orders":
+        return bulk_orders(rows)
+
+    columns = [c for c in resource.writable if c in rows[0]]
+    if resource.conflict == "id":
+        columns.insert(0, "id")
+    fields = set(sent[0]) - {resource.conflict}
+    if any(set(columns) - set(row) for row in rows) or any(
+        set(row) - {resource.conflict} != fields for row in sent
+    ):
+        abort(400, "All rows in a bulk request must have the same fields")
+    updates = [c for c in columns if c in fields]
+    action = (
+        "DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in updates)
+        if updates else "DO NOTHING"
+    )
+    conn = get_db()
+    with immediate(conn):
+        if resource.table == "products" and "warehouse_id" in sent[0]:
+            moves = []
+            for row in rows:
+                existing = conn.execute(
+                    "SELECT id FROM products WHERE name = ?", (row["name"],)
+                ).fetchone()
+                if existing is not None:
+                    moves.append((existing[0], row["warehouse_id"]))
+            rehome_products(conn, moves)
+        conn.executemany(
+            f"INSERT INTO {resource.table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT ({resource.conflict}) {action}",
+            ([row[c] for c in columns] for row in rows),
+        )
+    return jsonify(written=len(rows))
+
+
+def bulk_orders(rows):
+    """Place many orders in one transaction.
+
+    Each goes through reserve_order, so it takes its stock exactly as a
+    single order does. If any row cannot be filled, or its id is taken,
+    none are placed.
+    """
+    missing = [row for row in rows if not row.get("id")]
+    for row, order_id in zip(missing, allocate_order_ids(len(missing))):
+        row["id"] = order_id
+    conn = get_db()
+    with immediate(conn):
+        for n, row in enumerate(rows):
+            try:
+                reserve_order(conn, row["product"], row["quantity"],
+                              row["email"], row["id"])
+            except ValueError as exc:
+                abort(400, f"Row {n}: {exc}")
+            except UnknownProduct:
+                abort(404, f"Row {n}: unknown product {row['product']!r}")
+            except InsufficientStock:
+                abort(409, f"Row {n}: not enough stock of {row['product']!r}")
+    return jsonify(written=len(rows))
+
+
+def bulk_delete(resource):
+    ids = json_body(list)
+    conn = get_db()
+    with immediate(conn):
+        cursor = conn.executemany(
+            f"DELETE FROM {resource.table} WHERE id = ?",
+            ((item_id,) for item_id in ids),
+        )
+    return jsonify(deleted=cursor.rowcount)
+
+
+@api.route("/products/lookup", methods=["GET"])
+def product_lookup():
+    """Look a product up by name through the per-worker read-through cache."""
+    name = request.args.get("name", "").strip()
+    if not name:
+        abort(400, "name is required")
+    row = get_product_cache().get(name)
+    if row is None:
+        abort(404, f"Unknown product {name!r}")
+    return jsonify(id=row[0], name=name, quantity=row[1], warehouse_id=row[2])
+
+
+@api.route("/search", methods=["GET"])
+def search():
+    """Autocomplete products by name: ?q= words are matched as prefixes."""
+    limit = max(1, min(request.args.get("limit", 10, type=int), 50))
+    rows = search_products(get_db(), request.args.get("q", ""), limit)
+    return jsonify(items=[
+        {"id": row[0], "name": row[1], "quantity": row[2]} for row in rows
+    ])
+
+
+@api.route("/products/<int:item_id>/stock", methods=["GET"])
+def products_stock(item_id):
+    """A product's balance in each warehouse, for the movement form."""
+    conn = get_db()
+    fetch_one(RESOURCES["products"], item_id)
+    return jsonify(stock=dict(product_stock(conn, item_id)))
+
+
+@api.route("/stock", methods=["GET"])
+def stock_history():
+    """A product's balance per warehouse at a past time.
+
+    ?product_id= is required; ?warehouse_id= narrows it to one warehouse
+    and ?as_of= is an ISO 8601 date (end of day) or time, UTC by default.
+    """
+    product_id = request.args.get("product_id", type=int)
+    if product_id is None:
+        abort(400, "product_id is required")
+    warehouse_id = request.args.get("warehouse_id", type=int)
+    try:
+        as_of = parse_as_of(request.args.get("as_of", ""))
+    except ValueError as exc:
+        abort(400, str(exc))
+    balances = stock_as_of(get_db(), product_id, as_of, warehouse_id)
+    if balances is None:
+        abort(404, f"No stock history before {as_of}")
+    return jsonify(
+        product_id=product_id, as_of=as_of,
+        stock=[{"warehouse_id": w, "quantity": q} for w, q in balances.items()],
+    )
+
+
+@api.route("/alerts", methods=["GET"])
+def alerts():
+    """Products at or below their reorder point, with how much to reorder.
+
+    Set a product's threshold with PATCH /products/<id> {"reorder_point": n}.
+    """
+    limit = max(1, min(request.args.get("limit", 100, type=int), 1000))
+    conn = get_db()
+    return jsonify(
+        total=alert_count(conn),
+        items=[alert._asdict() for alert in low_stock(conn, limit)],
+    )
+
+
+@api.route("/cache", methods=["GET"])
+def cache_stats():
+    return jsonify(products=get_product_cache().stats())
+
+
+EXPORT_MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def transfer_format():
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        abort(400, f"format must be one of {', '.join(FORMATS)}")
+    return fmt
+
+
+@api.route("/products/import", methods=["POST"])
+def products_import():
+    """Upsert products from a CSV or NDJSON request body.
+
+    The body is parsed as it arrives and committed in batches of
+    ?batch_size= rows. Pass ?source= (a name for this upload) with
+    ?resume=1 to continue an upload that was cut off.
+    """
+    fmt = transfer_format()
+    source = request.args.get("source")
+    resume = request.args.get("resume") == "1"
+    if resume and not source:
+        abort(400, "resume needs a source name")
+    batch_size = max(1, request.args.get("batch_size", 1000, type=int))
+
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        stats = import_products(
+            read_rows(stream, fmt), source=source or f"api:{request.remote_addr}",
+            batch_size=batch_size, resume=resume,
+        )
+    except ValueError as exc:
+        abort(400, str(exc))
+    return jsonify(stats)
+
+
+@api.route("/products/export", methods=["GET"])
+def products_export():
+    fmt = transfer_format()
+    return Response(
+        stream_with_context(export_products(fmt)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=products.{fmt}"},
+    )
+
+
+def register(name, resource):
+    converter = "int" if resource.id_type is int else "string"
+    item = f"/{name}/<{converter}:item_id>"
+
+    def route(rule, view, methods):
+        # Writes can be retried safely with an Idempotency-Key header
+        api.add_url_rule(
+            rule, f"{name}_{view.__name__}",
+            idempotent(lambda **kw: view(resource, **kw)), methods=methods,
+        )
+
+    route(f"/{name}", list_items, ["GET"])
+    route(f"/{name}", create_item, ["POST"])
+    route(f"/{name}/bulk", bulk_upsert, ["POST"])
+    route(f"/{name}/bulk", bulk_delete, ["DELETE"])
+    route(item, get_item, ["GET"])
+    route(item, update_item, ["PUT", "PATCH"])
+    route(item, delete_item, ["DELETE"])
+
+
+for _name, _resource in RESOURCES.items():
+    register(_name, _resource)
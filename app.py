@@ -1,19 +1,109 @@
 import os
-import json
+import stat
 from pathlib import Path
 
-from flask import Flask, redirect, render_template, request
-from python_warehouse.db import connect_db, init_db
+from flask import (
+    Flask, current_app, jsonify, redirect, render_template, request, url_for,
+)
+from jinja2 import FileSystemBytecodeCache
+from api import api
+from flask_db import get_db, init_app as init_db_app
+from flask_events import init_app as init_events_app
+from flask_idempotency import idempotent
+from flask_metrics import init_app as init_metrics_app
+from flask_profiling import init_app as init_profiling_app
+from render_cache import cached_page
+from python_warehouse.alerts import alert_count, low_stock
+from python_warehouse.db import init_db
+from python_warehouse.logistics import (
+    MovementError, history_page, move_stock, stock_by_warehouse,
+)
+from python_warehouse.pagination import Page, cached_count, keyset_page
+from python_warehouse.search import search_products
+from python_warehouse.write_batcher import RESTOCK, get_write_batcher
 
 
-app = Flask(__name__)
-
 # Database path and initialization
 _DATABASE_PATH = Path(__file__).parent / "inventory.db"
 os.environ.setdefault("DATABASE_NAME", str(_DATABASE_PATH.resolve()))
-if os.environ.get("FLASK_DEBUG") == "1":
-    app.config["TEMPLATES_AUTO_RELOAD"] = True
-init_db()
+
+# (rule, view, options) collected by @route and added by create_app()
+ROUTES = []
+
+
+def route(rule, **options):
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+def jinja_bytecode_cache(directory=None):
+    """A bytecode cache for compiled templates.
+
+    Workers load and run whatever bytecode is in the cache directory, so it
+    must not be writable by anyone else. Without a directory, Jinja picks a
+    per-user 0700 one under the temp dir and checks its owner; a given
+    directory is created 0700 and refused unless this user owns it and
+    no one else can write to it.
+    """
+    if not directory:
+        return FileSystemBytecodeCache()
+    path = Path(directory)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if os.name == "posix":
+        info = path.stat()
+        if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise RuntimeError(
+                f"JINJA_CACHE_DIR {path} must be owned by this user and not "
+                "writable by group or others"
+            )
+    return FileSystemBytecodeCache(str(path))
+
+
+def create_app():
+    """Build the Flask app.
+
+    Importing this module does no work; Gunicorn can load either
+    ``app:create_app()`` or ``app:app`` (built on first access). Under
+    --preload the app is built once in the master, and connection pools are
+    reset in each worker after the fork (see gunicorn.conf.py).
+    """
+    app = Flask(__name__)
+    if os.environ.get("FLASK_DEBUG") == "1":
+        app.config["TEMPLATES_AUTO_RELOAD"] = True
+    else:
+        # Templates only change on deploy; skip the per-render mtime check
+        app.config["TEMPLATES_AUTO_RELOAD"] = False
+    # Compiled templates are shared between workers and restarts
+    app.jinja_options = {
+        **app.jinja_options,
+        "bytecode_cache": jinja_bytecode_cache(os.environ.get("JINJA_CACHE_DIR")),
+    }
+    # Rows per listing page; ?per_page= may ask for fewer or more up to the max
+    app.config["PAGE_SIZE"] = int(os.environ.get("PAGE_SIZE", "50"))
+    app.config["MAX_PAGE_SIZE"] = int(os.environ.get("MAX_PAGE_SIZE", "500"))
+
+    # A PRAGMA read when the schema is already current
+    init_db()
+    init_db_app(app)
+    init_events_app(app)
+    init_metrics_app(app)
+    init_profiling_app(app)
+    app.register_blueprint(api)
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    return app
+
+
+def __getattr__(name):
+    # `app:app` and `from app import app` keep working, built lazily
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Navigation links used by templates
 VIEWS = {
@@ -25,33 +115,60 @@ VIEWS = {
 
 EMPTY_SYMBOLS = {None, ""}
 
+# Low-stock alerts listed under the Summary badge; the rest are in
+# /api/v1/alerts
+SUMMARY_ALERTS = 10
+
+
+def page_args():
+    """Read the keyset cursor and page size from the query string."""
+    limit = request.args.get("per_page", current_app.config["PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, current_app.config["MAX_PAGE_SIZE"]))
+    return {
+        "after": request.args.get("after", type=int),
+        "before": request.args.get("before", type=int),
+        "limit": limit,
+    }
+
 
-@app.route("/", methods=["GET"])
+@route("/", methods=["GET"])
+# stock_alerts only changes with products; orders feed the suggestions
+@cached_page("products", "warehouse", "orders")
 def summary():
     # Use our python_warehouse schema
-    with connect_db() as conn:
-        warehouses = conn.execute(
-            "SELECT id, location_name FROM warehouse ORDER BY id"
-        ).fetchall()
-        products = conn.execute(
-            "SELECT id, name, quantity FROM products ORDER BY id"
-        ).fetchall()
-        # Basic summary: name, unallocated (same as quantity), total (quantity)
-        q_data = [(row[1], row[2], row[2]) for row in products]
+    with get_db() as conn:
+        # Only the first page of warehouses; the full list lives on /location
+        warehouses = keyset_page(
+            conn, "warehouse", "id, location_name",
+            limit=current_app.config["PAGE_SIZE"],
+        ).rows
+        page = keyset_page(conn, "products", "id, name, quantity", **page_args())
+        total = cached_count(conn, "products")
+        # Basic summary: name, unallocated (same as quantity), total
+        # (quantity), and the id the live updates are matched on
+        q_data = [(row[1], row[2], row[2], row[0]) for row in page.rows]
+        low = alert_count(conn)
+        alerts = low_stock(conn, SUMMARY_ALERTS) if low else []
 
     return render_template(
         "index.jinja",
         link=VIEWS,
         title="Summary",
         warehouses=warehouses,
-        products=products,
+        products=page.rows,
         summary=q_data,
+        page=page,
+        total=total,
+        low_stock=low,
+        alerts=alerts,
     )
 
 
-@app.route("/product", methods=["POST", "GET"])
+@route("/product", methods=["POST", "GET"])
+@cached_page("products")
+@idempotent
 def product():
-    with connect_db() as conn:
+    with get_db() as conn:
         if request.method == "POST":
             prod_name = request.form.get("prod_name", "").strip()
             quantity = request.form.get("prod_quantity", "").strip()
@@ -64,98 +181,135 @@ def product():
                 except ValueError:
                     qty = 0
                 if qty > 0:
-                    # Insert new or increase existing quantity
-                    existing = conn.execute(
-                        "SELECT id FROM products WHERE name = ?",
-                        (prod_name,),
-                    ).fetchone()
-                    if existing:
-                        conn.execute(
-                            (
-                                "UPDATE products SET quantity = quantity + ? "
-                                "WHERE id = ?"
-                            ),
-                            (qty, existing[0]),
-                        )
+                    # Insert new or increase existing quantity in one
+                    # statement, so concurrent restocks cannot lose updates
+                    batcher = get_write_batcher()
+                    if batcher is not None:
+                        # Restocks arriving together share one commit
+                        batcher.restock(prod_name, qty).result()
                     else:
-                        conn.execute(
-                            (
-                                "INSERT INTO products (name, quantity, warehouse_id) "
-                                "VALUES (?, ?, 1)"
-                            ),
-                            (prod_name, qty),
-                        )
+                        conn.execute(RESTOCK, (prod_name, qty))
                     return redirect(VIEWS["Stock"])
 
-        products = conn.execute(
-            "SELECT id, name, quantity FROM products ORDER BY id"
-        ).fetchall()
+        query = request.args.get("q", "").strip()
+        if query:
+            # Search results are a single page of the best matches
+            limit = page_args()["limit"]
+            page = Page(search_products(conn, query, limit), None, None, limit)
+        else:
+            page = keyset_page(
+                conn, "products", "id, name, quantity", **page_args()
+            )
+        total = cached_count(conn, "products")
 
     return render_template(
         "product.jinja",
         link=VIEWS,
-        products=products,
+        products=page.rows,
+        page=page,
+        total=total,
+        query=query,
         title="Stock",
     )
 
 
-@app.route("/location", methods=["POST", "GET"])
+@route("/location", methods=["POST", "GET"])
+@cached_page("warehouse")
+@idempotent
 def location():
-    with connect_db() as conn:
+    with get_db() as conn:
         if request.method == "POST":
             warehouse_name = request.form.get("warehouse_name", "").strip()
-            if warehouse_name not in EMPTY_SYMBOLS:
+            try:
+                max_capacity = int(request.form.get("max_capacity") or 1000)
+            except ValueError:
+                max_capacity = 1000
+            if warehouse_name not in EMPTY_SYMBOLS and max_capacity > 0:
                 conn.execute(
                     (
                         "INSERT OR IGNORE INTO warehouse (location_name, max_capacity, "
-                        "used_capacity) VALUES (?, 1000, 0)"
+                        "used_capacity) VALUES (?, ?, 0)"
                     ),
-                    (warehouse_name,),
+                    (warehouse_name, max_capacity),
                 )
                 return redirect(VIEWS["Warehouses"])
 
-        warehouse_data = conn.execute(
-            "SELECT id, location_name FROM warehouse ORDER BY id"
-        ).fetchall()
+        page = keyset_page(
+            conn, "warehouse", "id, location_name, max_capacity, used_capacity",
+            **page_args(),
+        )
+        total = cached_count(conn, "warehouse")
 
     return render_template(
         "location.jinja",
         link=VIEWS,
-        warehouses=warehouse_data,
+        warehouses=page.rows,
+        page=page,
+        total=total,
         title="Warehouses",
     )
 
 
-@app.route("/movement", methods=["POST", "GET"])
+@route("/movement", methods=["POST", "GET"])
+@cached_page("products", "warehouse", "stock", "movements")
+@idempotent
 def movement():
-    # Stub view since logistics tables are not part of python_warehouse schema
     if request.method == "POST":
+        try:
+            move_stock(
+                request.form.get("prod_name", "").strip(),
+                request.form.get("from_loc", "").strip() or None,
+                request.form.get("to_loc", "").strip() or None,
+                int(request.form.get("quantity") or 0),
+                conn=get_db(),
+            )
+        except (MovementError, ValueError) as exc:
+            return redirect(url_for("movement", error=str(exc)))
         return redirect(VIEWS["Logistics"])
 
-    products = []
-    locations = []
-    logistics_data = []
-    item_location_qty_map = json.dumps({})
-    warehouse_summary = []
+    conn = get_db()
+    locations = conn.execute(
+        "SELECT id, location_name FROM warehouse ORDER BY id"
+    ).fetchall()
+    # Product names and per-location balances for the form are fetched
+    # from /api/v1/search as the user types rather than embedded here
+    warehouse_summary = stock_by_warehouse(conn)
+    args = page_args()
+    history = history_page(
+        conn, before=args["before"], after=args["after"], limit=args["limit"]
+    )
 
     return render_template(
         "movement.jinja",
         title="Logistics",
         link=VIEWS,
-        products=products,
         locations=locations,
-        allocated=item_location_qty_map,
-        logistics=logistics_data,
+        logistics=history.rows,
+        history=history,
         summary=warehouse_summary,
+        error=request.args.get("error"),
     )
 
 
-@app.route("/delete")
+@route("/reports", methods=["GET"])
+def reports():
+    # pandas is only loaded by the workers that actually serve a report
+    from python_warehouse.analytics import WINDOW_DAYS, report_json, space_report
+
+    window = request.args.get("days", WINDOW_DAYS, type=int)
+    report = space_report(get_db(), window_days=max(1, window))
+    return jsonify(window_days=max(1, window), **report_json(report))
+
+
+# Deletes are POSTed from a form; a GET (a prefetch, a crawler, a retried
+# link) must not change anything
+@route("/delete", methods=["POST"])
+@idempotent
 def delete():
     delete_record_type = request.args.get("type")
-    with connect_db() as conn:
+    with get_db() as conn:
         if delete_record_type == "product":
-            product_id = request.args.get("prod_id")
+            product_id = request.form.get("prod_id")
             if product_id:
                 conn.execute(
                     "DELETE FROM products WHERE id = ?",
@@ -163,7 +317,7 @@ def delete():
                 )
             return redirect(VIEWS["Stock"])
         elif delete_record_type == "location":
-            location_id = request.args.get("loc_id")
+            location_id = request.form.get("loc_id")
             if location_id:
                 conn.execute(
                     "DELETE FROM warehouse WHERE id = ?",
@@ -174,10 +328,11 @@ def delete():
             return redirect(VIEWS["Summary"])
 
 
-@app.route("/edit", methods=["POST"])
+@route("/edit", methods=["POST"])
+@idempotent
 def edit():
     edit_record_type = request.args.get("type")
-    with connect_db() as conn:
+    with get_db() as conn:
         if edit_record_type == "location":
             loc_id = request.form.get("loc_id")
             loc_name = request.form.get("loc_name", "").strip()
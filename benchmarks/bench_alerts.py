@@ -0,0 +1,77 @@
+"""Cost of reading low-stock alerts versus scanning the catalog.
+
+    python benchmarks/bench_alerts.py --products 1000000 --low 200
+
+Seeds a catalog in which --low products sit below a reorder point of 10,
+plus orders for them, then compares low_stock() (trigger-maintained
+stock_alerts) with the full scan it replaces, and times the order updates
+that keep crossing the threshold, which is what the triggers add to writes.
+"""
+import argparse
+import random
+import statistics
+import time
+from contextlib import closing
+
+from common import seed_orders, seed_products, temp_database
+
+ROUNDS = 50
+
+
+def timed(fn, rounds=ROUNDS):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--low", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=20_000)
+    args = parser.parse_args()
+
+    temp_database("bench-alerts-")
+    seed_products(args.products, quantity=1000)
+    seed_orders(args.orders, args.low)
+
+    from python_warehouse.alerts import low_stock
+    from python_warehouse.db import connect_db
+
+    rng = random.Random(0)
+    low_ids = rng.sample(range(1, args.low * 10 + 1), args.low)
+    with closing(connect_db()) as conn:
+        with conn:
+            conn.execute("UPDATE products SET reorder_point = 10")
+            conn.executemany(
+                "UPDATE products SET quantity = 5 WHERE id = ?",
+                ((i,) for i in low_ids),
+            )
+
+        alerts, alerts_ms = timed(lambda: low_stock(conn))
+        scanned, scan_ms = timed(lambda: conn.execute(
+            "SELECT id, name, quantity, reorder_point FROM products "
+            "WHERE quantity <= reorder_point"
+        ).fetchall(), rounds=5)
+        assert len(alerts) == len(scanned) == args.low
+
+        def churn():
+            # Each update moves one product across the threshold and back
+            product_id = rng.choice(low_ids)
+            with conn:
+                conn.execute("UPDATE products SET quantity = 50 WHERE id = ?",
+                             (product_id,))
+                conn.execute("UPDATE products SET quantity = 5 WHERE id = ?",
+                             (product_id,))
+        _, churn_ms = timed(churn, rounds=500)
+
+    print(f"{'low_stock() over stock_alerts':<34}{alerts_ms:>10.3f}ms")
+    print(f"{'full catalog scan':<34}{scan_ms:>10.3f}ms")
+    print(f"{'raise + clear (2 updates)':<34}{churn_ms:>10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Space/turnover report on a synthetic dataset.
+
+    python benchmarks/bench_analytics.py --orders 1000000 --products 50000
+
+Seeds warehouses, products and orders spread over the last 90 days, then
+times analytics.space_report() and reports the process's peak RSS.
+"""
+import argparse
+import random
+import resource
+from contextlib import closing
+
+from common import Timer, seed_products, temp_database
+
+
+def seed_orders(conn, count, products):
+    rng = random.Random(3)
+    with conn:
+        conn.executemany(
+            "INSERT INTO orders (id, product, quantity, email, status, created_at) "
+            "VALUES (?, ?, ?, ?, 'processed', datetime('now', ?))",
+            ((f"{i:019d}", f"product-{rng.randrange(products):07d}",
+              rng.randint(1, 5), f"c{i % 1000}@example.com",
+              f"-{rng.randint(0, 90 * 24 * 60)} minutes")
+             for i in range(count)),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--warehouses", type=int, default=100)
+    parser.add_argument("--chunk", type=int, default=50000)
+    args = parser.parse_args()
+
+    temp_database()
+    seed_products(args.products, warehouses=args.warehouses)
+    from python_warehouse.analytics import space_report
+    from python_warehouse.db import connect_db
+
+    with closing(connect_db()) as conn:
+        with Timer() as seed:
+            seed_orders(conn, args.orders, args.products)
+        print(f"seeded {args.orders:,} orders in {seed.elapsed:.1f}s")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with Timer() as t:
+            report = space_report(conn, chunksize=args.chunk)
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(report["warehouses"].head().to_string(index=False))
+    print(f"space_report: {t.elapsed:.2f}s, peak RSS {rss_after / 1024:.0f} MiB "
+          f"(+{(rss_after - rss_before) / 1024:.0f} MiB during the report)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Destination picking: capacity engine vs a full warehouse scan.
+
+    python benchmarks/bench_capacity.py --warehouses 5000 --picks 5000
+
+Both sides pick the best-fit warehouse for a random quantity and store
+the stock there, one transaction per pick; the stock triggers book the
+capacity. The scan re-reads the warehouse table for every pick, which is
+what a query without a capacity index does. The engine applies the stock
+event each write leaves behind.
+"""
+import argparse
+import random
+from contextlib import closing
+
+from common import Timer, temp_database
+
+SCAN_PICK = (
+    "SELECT id FROM warehouse WHERE max_capacity - used_capacity >= ? "
+    "ORDER BY max_capacity - used_capacity, id LIMIT 1"
+)
+STORE = "INSERT INTO stock (product_id, warehouse_id, quantity) VALUES (?, ?, ?)"
+
+
+def seed(conn, count):
+    rng = random.Random(1)
+    with conn:
+        conn.executemany(
+            "INSERT INTO warehouse (location_name, max_capacity, used_capacity) "
+            "VALUES (?, ?, ?)",
+            ((f"wh-{i}", cap, rng.randint(0, cap))
+             for i, cap in ((i, rng.randint(500, 50000)) for i in range(count))),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--warehouses", type=int, default=5000)
+    parser.add_argument("--picks", type=int, default=5000)
+    args = parser.parse_args()
+
+    from python_warehouse.capacity import CapacityEngine
+    from python_warehouse.db import connect_db
+
+    rng = random.Random(2)
+    quantities = [rng.randint(1, 200) for _ in range(args.picks)]
+    results = {}
+    for name in ("scan", "engine"):
+        temp_database(prefix=f"bench-capacity-{name}-")
+        with closing(connect_db()) as conn:
+            seed(conn, args.warehouses)
+            engine = CapacityEngine()
+            with Timer() as t:
+                for product_id, qty in enumerate(quantities, 1):
+                    if name == "scan":
+                        row = conn.execute(SCAN_PICK, (qty,)).fetchone()
+                        wid = row[0] if row else None
+                    else:
+                        wid = engine.pick(qty, conn)
+                    if wid is not None:
+                        with conn:
+                            conn.execute(STORE, (product_id, wid, qty))
+        results[name] = args.picks / t.elapsed
+        print(f"{name:<7}{results[name]:>12,.0f} picks/sec")
+    print(f"speedup {results['engine'] / results['scan']:.1f}x "
+          f"over {args.warehouses} warehouses")
+
+
+if __name__ == "__main__":
+    main()
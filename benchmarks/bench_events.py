@@ -0,0 +1,111 @@
+"""Fan-out latency of /events with many open streams.
+
+    python benchmarks/bench_events.py --clients 300 --workers 1 --updates 50
+
+Starts Gunicorn with gunicorn.conf.py (the gevent worker when gevent is
+installed), opens --clients event streams, then changes a product's
+quantity --updates times and reports how long each change took to reach
+every client (p50/p99 over all deliveries) and how many were missed.
+"""
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+from contextlib import closing
+
+from common import percentiles, report, seed_products, temp_database
+from load import free_port, start_gunicorn
+
+
+class Client(threading.Thread):
+    def __init__(self, port, ready):
+        super().__init__(daemon=True)
+        self.port = port
+        self.ready = ready
+        self.received = {}
+
+    def run(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        conn.request("GET", "/events")
+        response = conn.getresponse()
+        self.ready.release()
+        event = None
+        while True:
+            line = response.fp.readline()
+            if not line:
+                return
+            line = line.decode().rstrip("\n")
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "product":
+                quantity = json.loads(line[6:]).get("quantity")
+                self.received.setdefault(quantity, time.perf_counter())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.1,
+                        help="seconds between updates")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    temp_database("bench-events-")
+    seed_products(1000)
+    os.environ.setdefault("GUNICORN_THREADS", str(args.clients + 8))
+    port = free_port()
+    server = start_gunicorn(args.workers, port)
+    try:
+        ready = threading.Semaphore(0)
+        clients = [Client(port, ready) for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for _ in clients:
+            if not ready.acquire(timeout=60):
+                raise SystemExit("not every client connected")
+        time.sleep(1)
+
+        from python_warehouse.db import connect_db
+
+        sent = {}
+        with closing(connect_db()) as conn:
+            for n in range(args.updates):
+                quantity = 10_000 + n
+                sent[quantity] = time.perf_counter()
+                with conn:
+                    conn.execute(
+                        "UPDATE products SET quantity = ? WHERE id = 1",
+                        (quantity,),
+                    )
+                time.sleep(args.interval)
+        time.sleep(2)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies, missed = [], 0
+    for client in clients:
+        for quantity, at in sent.items():
+            received = client.received.get(quantity)
+            if received is None:
+                missed += 1
+            else:
+                latencies.append((received - at) * 1000)
+    metrics = {"deliveries": len(latencies), "missed": missed}
+    for name, value in percentiles(latencies).items():
+        metrics[f"{name}_ms"] = round(value, 3) if value is not None else None
+
+    result = report("events", vars(args), metrics)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
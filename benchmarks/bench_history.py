@@ -0,0 +1,116 @@
+"""As-of stock queries over a year of synthetic history.
+
+    python benchmarks/bench_history.py --products 2000 --events-per-day 5000
+
+Writes a year of random stock deltas straight into stock_events, with a
+snapshot run at the end of every day, then times stock_as_of() for random
+products and moments against a naive replay of every event up to that
+moment, checking that both agree.
+"""
+import argparse
+import random
+import statistics
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+from common import percentiles, temp_database
+
+QUERIES = 500
+
+
+def seed_history(conn, start, days, products, warehouses, per_day, rng):
+    from python_warehouse.history import format_time, take_snapshot
+
+    conn.execute("UPDATE snapshot_runs SET taken_at = ? WHERE id = 1",
+                 (format_time(start),))
+    conn.commit()
+    event_id = 0
+    started = time.perf_counter()
+    snapshot_seconds = 0.0
+    for day in range(days):
+        midnight = start + timedelta(days=day)
+        offsets = sorted(rng.random() * 86400 for _ in range(per_day))
+        rows = []
+        for offset in offsets:
+            event_id += 1
+            rows.append((
+                event_id, rng.randrange(1, products + 1),
+                rng.randrange(1, warehouses + 1), rng.randint(-20, 30),
+                format_time(midnight + timedelta(seconds=offset)),
+            ))
+        with conn:
+            conn.executemany(
+                "INSERT INTO stock_events (id, product_id, warehouse_id, delta, at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        before = time.perf_counter()
+        take_snapshot(conn, format_time(midnight + timedelta(days=1)), event_id)
+        snapshot_seconds += time.perf_counter() - before
+    return time.perf_counter() - started, snapshot_seconds / days
+
+
+def naive_as_of(conn, product_id, as_of):
+    return {
+        w: q for w, q in conn.execute(
+            "SELECT warehouse_id, SUM(delta) FROM stock_events "
+            "WHERE product_id = ? AND at <= ? GROUP BY warehouse_id "
+            "ORDER BY warehouse_id",
+            (product_id, as_of),
+        ) if q
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--warehouses", type=int, default=10)
+    parser.add_argument("--events-per-day", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    temp_database("bench-history-")
+    from python_warehouse.db import connect_db
+    from python_warehouse.history import format_time, stock_as_of
+
+    rng = random.Random(7)
+    start = datetime.now(timezone.utc) - timedelta(days=args.days + 1)
+    with closing(connect_db()) as conn:
+        seeded, per_snapshot = seed_history(
+            conn, start, args.days, args.products, args.warehouses,
+            args.events_per_day, rng,
+        )
+        events, snapshot_rows = (
+            conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("stock_events", "stock_snapshots")
+        )
+        print(f"{events} events, {snapshot_rows} snapshot rows, "
+              f"{args.days} runs; seeded in {seeded:.1f}s, "
+              f"{per_snapshot * 1000:.1f}ms per daily snapshot")
+
+        queries = [
+            (rng.randrange(1, args.products + 1),
+             format_time(start + timedelta(seconds=rng.random() * args.days * 86400)))
+            for _ in range(QUERIES)
+        ]
+        timings = {"snapshot + replay": [], "full replay": []}
+        for product_id, as_of in queries:
+            before = time.perf_counter()
+            fast = stock_as_of(conn, product_id, as_of)
+            middle = time.perf_counter()
+            slow = naive_as_of(conn, product_id, as_of)
+            after = time.perf_counter()
+            assert fast == slow, (product_id, as_of, fast, slow)
+            timings["snapshot + replay"].append((middle - before) * 1000)
+            timings["full replay"].append((after - middle) * 1000)
+
+    print(f"{'as-of query':<20}{'p50':>10}{'p90':>10}{'p99':>10}{'mean':>10}")
+    for name, samples in timings.items():
+        points = percentiles(samples)
+        print(f"{name:<20}" + "".join(f"{points[p]:>8.3f}ms" for p in points)
+              + f"{statistics.mean(samples):>8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
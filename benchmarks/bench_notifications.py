@@ -0,0 +1,78 @@
+"""Invoice delivery through the notification pipeline against a local
+aiosmtpd server.
+
+    pip install aiosmtpd
+    python benchmarks/bench_notifications.py --orders 2000 --rate 0
+
+Reports how long notify() blocks the caller, end-to-end delivery time and
+the per-batch metrics the notifier keeps.
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+
+from aiosmtpd.controller import Controller
+
+import common  # noqa: F401  (puts the repository root on sys.path)
+
+
+class Counter:
+    def __init__(self):
+        self.received = 0
+        self.done = threading.Event()
+        self.expected = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        if self.received >= self.expected:
+            self.done.set()
+        return "250 OK"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=0,
+                        help="messages per second, 0 for no limit")
+    args = parser.parse_args()
+
+    handler = Counter()
+    handler.expected = args.orders
+    controller = Controller(handler, hostname="127.0.0.1", port=0)
+    controller.start()
+    os.environ.update(
+        SMTP_HOST="127.0.0.1",
+        SMTP_PORT=str(controller.server.sockets[0].getsockname()[1]),
+        NOTIFY_BATCH_SIZE=str(args.batch_size),
+        NOTIFY_RATE=str(args.rate),
+    )
+    from python_warehouse.notifications import get_notifier
+
+    notifier = get_notifier()
+    enqueue = []
+    start = time.perf_counter()
+    for i in range(args.orders):
+        t = time.perf_counter()
+        notifier.notify(f"{i:019d}", "widget", 1, f"customer{i}@example.com")
+        enqueue.append((time.perf_counter() - t) * 1e6)
+    handler.done.wait(timeout=600)
+    elapsed = time.perf_counter() - start
+    notifier.stop()
+    controller.stop()
+
+    stats = notifier.stats()
+    print(f"delivered        {handler.received}/{args.orders} in {elapsed:.2f}s "
+          f"({handler.received / elapsed:.0f}/s)")
+    print(f"notify() p50/max {statistics.median(enqueue):.1f}us / "
+          f"{max(enqueue):.1f}us")
+    print(f"batches          {stats['batches']} "
+          f"(avg {stats.get('avg_batch_size', 0):.1f} messages, "
+          f"{stats.get('avg_batch_seconds', 0) * 1000:.1f}ms)")
+    print(f"failed/retried   {stats['failed']}/{stats['retried']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Order id throughput and cross-process uniqueness.
+
+    python benchmarks/bench_order_ids.py --procs 8 --ids 200000
+
+Measures ids/sec for single ids and for blocks, then has several processes
+generate ids at once. Exits non-zero if any id repeats or a process ever
+saw its ids go backwards.
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+
+from common import temp_database
+
+
+def generate(count, block, results):
+    from python_warehouse.order_numbers import allocate_order_ids, next_order_id
+
+    if block == 1:
+        ids = [next_order_id() for _ in range(count)]
+    else:
+        ids = []
+        while len(ids) < count:
+            ids.extend(allocate_order_ids(min(block, count - len(ids))))
+    results.put(ids)
+
+
+def throughput(count, block):
+    from python_warehouse.order_numbers import allocate_order_ids, next_order_id
+
+    start = time.perf_counter()
+    if block == 1:
+        for _ in range(count):
+            next_order_id()
+    else:
+        for _ in range(count // block):
+            allocate_order_ids(block)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procs", type=int, default=8)
+    parser.add_argument("--ids", type=int, default=200000)
+    parser.add_argument("--block", type=int, default=1000)
+    args = parser.parse_args()
+
+    temp_database()
+    for block in (1, args.block):
+        print(f"block {block:>5}: {throughput(args.ids, block):,.0f} ids/sec")
+
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(
+            target=generate,
+            args=(args.ids // args.procs, 1 if p % 2 else args.block, results),
+        )
+        for p in range(args.procs)
+    ]
+    for p in procs:
+        p.start()
+    batches = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    everything = [i for batch in batches for i in batch]
+    duplicates = len(everything) - len(set(everything))
+    backwards = sum(batch != sorted(batch) for batch in batches)
+    print(f"{args.procs} processes, {len(everything)} ids: "
+          f"{duplicates} duplicates, {backwards} non-monotonic streams")
+    return 1 if duplicates or backwards else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
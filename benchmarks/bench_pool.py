@@ -0,0 +1,85 @@
+"""Requests/sec on /product reads and writes, before and after pooling.
+
+    python benchmarks/bench_pool.py --threads 8 --seconds 5
+
+"before" opens an unpooled connection per request on the rollback journal
+(the old connect_db behaviour); "after" uses the pooled WAL defaults.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import run_modes, seed_products, temp_database
+
+MODES = {
+    "before": {
+        "DB_POOL_SIZE": "0",
+        "DB_JOURNAL_MODE": "DELETE",
+        "DB_SYNCHRONOUS": "FULL",
+    },
+    "after": {},
+}
+
+
+def hammer(app, seconds, threads, request_fn):
+    deadline = time.perf_counter() + seconds
+    counter = itertools.count()
+    done = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        n = 0
+        while time.perf_counter() < deadline:
+            request_fn(client, next(counter))
+            n += 1
+        with lock:
+            done.append(n)
+
+    with ThreadPoolExecutor(threads) as pool:
+        for _ in range(threads):
+            pool.submit(worker)
+    return sum(done) / seconds
+
+
+def run(args):
+    temp_database()
+    seed_products(args.products)
+    from app import app
+
+    reads = hammer(app, args.seconds, args.threads,
+                   lambda c, i: c.get("/product"))
+    writes = hammer(app, args.seconds, args.threads,
+                    lambda c, i: c.post("/product", data={
+                        "prod_name": f"product-{i % args.products:07d}",
+                        "prod_quantity": "1",
+                    }))
+    print(json.dumps({"read_rps": round(reads, 1),
+                      "write_rps": round(writes, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--run-mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run(args)
+        return
+
+    forwarded = ["--threads", str(args.threads), "--seconds", str(args.seconds),
+                 "--products", str(args.products)]
+    results = run_modes(__file__, MODES, forwarded)
+    print(f"{'mode':<8}{'GET /product':>16}{'POST /product':>16}")
+    for mode, r in results.items():
+        print(f"{mode:<8}{r['read_rps']:>14.1f}/s{r['write_rps']:>14.1f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Autocomplete latency over a large catalog.
+
+    python benchmarks/bench_search.py --products 1000000
+
+Seeds products named from a random vocabulary, then times search_products
+for typical keystroke prefixes and reports p50/p99 per query length.
+"""
+import argparse
+import random
+import statistics
+import string
+import time
+from contextlib import closing
+
+from common import temp_database
+
+QUERIES_PER_LENGTH = 200
+
+
+def seed(count, rng):
+    from python_warehouse.db import connect_db
+
+    vocabulary = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+        for _ in range(5000)
+    ]
+    with closing(connect_db()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO products (name, quantity, warehouse_id) VALUES (?, ?, 1)",
+            ((f"{rng.choice(vocabulary)} {rng.choice(vocabulary)} {i}",
+              rng.randint(1, 100)) for i in range(count)),
+        )
+    return vocabulary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    temp_database("bench-search-")
+    vocabulary = seed(args.products, rng)
+
+    from python_warehouse.db import connect_db
+    from python_warehouse.search import search_products
+
+    print(f"{'query':<24}{'p50':>10}{'p99':>10}")
+    with closing(connect_db()) as conn:
+        for label, make in (
+            ("1 letter", lambda w: w[:1]),
+            ("3 letters", lambda w: w[:3]),
+            ("whole word", lambda w: w),
+            ("two prefixes", lambda w: f"{w[:3]} {rng.choice(vocabulary)[:2]}"),
+            ("typo fallback", lambda w: f"{w} qqqq"),
+        ):
+            samples = []
+            for _ in range(QUERIES_PER_LENGTH):
+                query = make(rng.choice(vocabulary))
+                start = time.perf_counter()
+                search_products(conn, query, args.limit)
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            p99 = samples[int(len(samples) * 0.99) - 1]
+            print(f"{label:<24}{statistics.median(samples):>8.2f}ms{p99:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cold-start cost of the web app: import, create_app() and first request.
+
+    python benchmarks/bench_startup.py --repeat 5
+
+Every sample is a fresh interpreter. "fresh" starts from an empty database
+file, so create_app() applies every migration; "current" starts from an
+already migrated one, which is what every Gunicorn worker after the first
+(or every worker, with the pre-fork bootstrap) sees. The heavy-modules
+column lists analytics dependencies that ended up imported, which should be
+none until /reports is requested.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from common import run_modes, temp_database
+
+HEAVY_MODULES = ("pandas", "numpy")
+
+
+def run(args):
+    start = time.perf_counter()
+    import app as module
+    imported = time.perf_counter()
+    app = module.create_app()
+    created = time.perf_counter()
+    client = app.test_client()
+    first = client.get("/")
+    first_done = time.perf_counter()
+    second = client.get("/product")
+    second_done = time.perf_counter()
+    assert first.status_code == second.status_code == 200
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "create_app_ms": (created - imported) * 1000,
+        "first_request_ms": (first_done - created) * 1000,
+        "second_request_ms": (second_done - first_done) * 1000,
+        "heavy": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--run-mode", choices=("fresh", "current"))
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run(args)
+        return
+
+    current = temp_database()
+    samples = {"fresh": [], "current": []}
+    for _ in range(args.repeat):
+        fresh = os.path.join(tempfile.mkdtemp(prefix="bench-"), "inventory.db")
+        modes = {
+            "fresh": {"DATABASE_NAME": fresh},
+            "current": {"DATABASE_NAME": current},
+        }
+        for mode, result in run_modes(__file__, modes, []).items():
+            samples[mode].append(result)
+
+    columns = ("import_ms", "create_app_ms", "first_request_ms",
+               "second_request_ms")
+    print(f"{'mode':<10}" + "".join(f"{c[:-3]:>18}" for c in columns)
+          + "  heavy modules")
+    for mode, results in samples.items():
+        medians = [statistics.median(r[c] for r in results) for c in columns]
+        heavy = sorted({name for r in results for name in r["heavy"]})
+        print(f"{mode:<10}" + "".join(f"{m:>16.1f}ms" for m in medians)
+              + f"  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Memory and speed of StockIndex against the old HashTable layout.
+
+    python benchmarks/bench_stock_index.py --products 1000000
+
+"legacy" rebuilds what Inventory held before: a defaultdict of quantities
+plus a second name -> id dict, loaded with fetchall(). Memory is measured
+with tracemalloc: "retained" is what the loaded structure keeps, "peak"
+includes the transient rows of the load.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import closing
+
+from common import seed_products, temp_database
+
+
+def legacy_load(conn):
+    product_list = {}
+    quantities = defaultdict(int)
+    cursor = conn.execute("SELECT name, id, quantity FROM products")
+    for name, pid, qty in cursor.fetchall():
+        name = name.lower()
+        product_list[name] = pid
+        quantities[name] = qty
+    return product_list, quantities
+
+
+def index_load(conn):
+    from python_warehouse.stock_index import StockIndex
+
+    index = StockIndex()
+    index.reload(conn)
+    return index
+
+
+def measure_load(load, conn):
+    # Timed untraced, as tracemalloc slows allocation-heavy code a lot
+    start = time.perf_counter()
+    load(conn)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    loaded = load(conn)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, elapsed, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--updates", type=int, default=200_000)
+    args = parser.parse_args()
+
+    temp_database("bench-stock-index-")
+    seed_products(args.products)
+    from python_warehouse.db import connect_db
+
+    rng = random.Random(0)
+    keys = [f"product-{rng.randrange(args.products):07d}"
+            for _ in range(args.updates)]
+    amounts = [rng.randint(1, 10) for _ in keys]
+
+    print(f"{'layout':<8}{'load':>10}{'retained':>12}{'peak':>12}"
+          f"{'increment':>12}{'bulk':>10}")
+    with closing(connect_db()) as conn:
+        (product_list, quantities), elapsed, retained, peak = measure_load(
+            legacy_load, conn)
+        start = time.perf_counter()
+        for key, amount in zip(keys, amounts):
+            quantities[key] += amount
+        loop = time.perf_counter() - start
+        print(f"{'legacy':<8}{elapsed:>9.2f}s{retained / 2**20:>10.1f}MB"
+              f"{peak / 2**20:>10.1f}MB{loop * 1000:>10.1f}ms{'-':>10}")
+        del product_list, quantities
+
+        index, elapsed, retained, peak = measure_load(index_load, conn)
+        start = time.perf_counter()
+        for key, amount in zip(keys, amounts):
+            index.increment(key, amount)
+        loop = time.perf_counter() - start
+        start = time.perf_counter()
+        index.bulk_increment(keys, amounts)
+        bulk = time.perf_counter() - start
+        print(f"{'index':<8}{elapsed:>9.2f}s{retained / 2**20:>10.1f}MB"
+              f"{peak / 2**20:>10.1f}MB{loop * 1000:>10.1f}ms"
+              f"{bulk * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""p50/p99 latency of the Summary page with and without the render cache.
+
+    python benchmarks/bench_summary.py --products 50000 --requests 500
+
+"before" renders every request (RENDER_CACHE_SIZE=0); "after" serves
+repeat views from the render cache, and "revalidate" sends the ETag back
+so the page is answered with 304 without rendering.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from common import run_modes, seed_products, temp_database
+
+MODES = {
+    "before": {"RENDER_CACHE_SIZE": "0"},
+    "after": {},
+    "revalidate": {},
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(args):
+    temp_database()
+    seed_products(args.products, warehouses=20)
+    from app import app
+
+    client = app.test_client()
+    first = client.get("/")
+    headers = {}
+    if args.run_mode == "revalidate":
+        headers["If-None-Match"] = first.headers["ETag"]
+
+    samples = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        response = client.get("/", headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code in (200, 304)
+    print(json.dumps({
+        "p50_ms": round(statistics.median(samples), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "status": response.status_code,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--run-mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run(args)
+        return
+
+    forwarded = ["--products", str(args.products),
+                 "--requests", str(args.requests)]
+    results = run_modes(__file__, MODES, forwarded)
+    print(f"{'mode':<12}{'status':>8}{'p50':>12}{'p99':>12}")
+    for mode, r in results.items():
+        print(f"{mode:<12}{r['status']:>8}{r['p50_ms']:>10.3f}ms"
+              f"{r['p99_ms']:>10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
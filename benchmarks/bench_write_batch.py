@@ -0,0 +1,84 @@
+"""Orders/sec through the queue with and without group commit.
+
+    python benchmarks/bench_write_batch.py --orders 5000 --threads 8
+
+Every order is enqueued by one of --threads threads and then processed by
+a WorkerPool with a no-op handler, so each order costs three status
+writes (queue, claim, complete). "direct" commits each write on its own
+(WRITE_BATCHING=0); "batched" lets concurrent writes share commits and
+"linger-2ms" also holds each batch open for 2ms. Direct and batched are
+also run with synchronous=FULL.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from common import run_modes, temp_database
+
+MODES = {
+    "direct": {"WRITE_BATCHING": "0"},
+    "batched": {},
+    "linger-2ms": {"WRITE_BATCH_MS": "2"},
+    "direct-full": {"WRITE_BATCHING": "0", "DB_SYNCHRONOUS": "FULL"},
+    "batched-full": {"DB_SYNCHRONOUS": "FULL"},
+}
+
+
+def run(args):
+    temp_database("bench-write-batch-")
+    from python_warehouse.db import connect_db
+    from python_warehouse.order_queue import WorkerPool, depth, enqueue
+
+    ids = [f"{i:019d}" for i in range(args.orders)]
+    with closing(connect_db()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO orders (id, product, quantity, email, status) "
+            "VALUES (?, 'widget', 1, 'bench@example.com', 'pending')",
+            ((order_id,) for order_id in ids),
+        )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(enqueue, ids))
+    queued = time.perf_counter() - start
+
+    workers = WorkerPool(lambda job: None, workers=args.threads,
+                         batch_size=args.batch_size, poll_interval=0.01).start()
+    while True:
+        counts = depth()
+        if not counts["queued"] and not counts["processing"]:
+            break
+        time.sleep(0.01)
+    workers.stop()
+    total = time.perf_counter() - start
+
+    print(json.dumps({
+        "enqueue_per_sec": round(args.orders / queued),
+        "orders_per_sec": round(args.orders / total),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--run-mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run(args)
+        return
+
+    forwarded = ["--orders", str(args.orders), "--threads", str(args.threads),
+                 "--batch-size", str(args.batch_size)]
+    results = run_modes(__file__, MODES, forwarded)
+    print(f"{'mode':<14}{'enqueue/s':>12}{'orders/s':>12}")
+    for mode, r in results.items():
+        print(f"{mode:<14}{r['enqueue_per_sec']:>12}{r['orders_per_sec']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Every path that changes stock must keep warehouse capacity in step.
+
+    python benchmarks/check_capacity.py
+
+Restocks, edits and ships stock through the web forms, the JSON API
+(single, bulk and import) and an order, and after each step checks that
+every warehouse's used_capacity equals the sum of its stock balances, that
+the capacity engine reports the same, and that the totals are what the
+step should have left. Exits 1 on the first failure.
+"""
+from contextlib import closing
+
+from common import seed_products, temp_database
+
+
+def check(condition, message):
+    if not condition:
+        raise SystemExit(f"FAIL: {message}")
+
+
+def main():
+    temp_database("check-capacity-")
+    seed_products(4, quantity=100, warehouses=2)
+    from app import app
+    from python_warehouse.capacity import get_capacity_engine
+    from python_warehouse.db import connect_db
+
+    client = app.test_client()
+    engine = get_capacity_engine()
+
+    with closing(connect_db()) as conn:
+        def product_id(name):
+            return conn.execute(
+                "SELECT id FROM products WHERE name = ?", (name,)
+            ).fetchone()[0]
+
+        def expect(step, total):
+            used = dict(conn.execute("SELECT id, used_capacity FROM warehouse"))
+            stored = dict(conn.execute(
+                "SELECT w.id, COALESCE(SUM(s.quantity), 0) FROM warehouse w "
+                "LEFT JOIN stock s ON s.warehouse_id = w.id GROUP BY w.id"
+            ))
+            check(used == stored, f"{step}: used_capacity {used} != stock {stored}")
+            tracked = {wid: u for wid, _, u in engine.utilization(conn)}
+            check(tracked == used, f"{step}: engine {tracked} != table {used}")
+            check(sum(used.values()) == total,
+                  f"{step}: {sum(used.values())} used, expected {total}")
+            print(f"ok  {step:<28}{used}")
+            return used
+
+        expect("seeded", 400)
+
+        client.post("/product", data={"prod_name": "product-0000000",
+                                      "prod_quantity": "500"})
+        expect("form restock", 900)
+        client.post("/product", data={"prod_name": "widget",
+                                      "prod_quantity": "50"})
+        expect("form new product", 950)
+        client.post("/edit?type=product", data={
+            "prod_id": product_id("widget"), "prod_quantity": "20"})
+        expect("form edit", 920)
+
+        response = client.post("/api/v1/products", json={
+            "name": "gadget", "quantity": 30, "warehouse_id": 2})
+        check(response.status_code == 201, f"API create: {response.status_code}")
+        expect("API create", 950)
+        response = client.patch(f"/api/v1/products/{product_id('gadget')}",
+                                json={"quantity": 60})
+        check(response.status_code == 200, f"API update: {response.status_code}")
+        expect("API update", 980)
+        response = client.post("/api/v1/products/bulk", json=[
+            {"name": "gadget", "quantity": 10},
+            {"name": "gizmo", "quantity": 40},
+        ])
+        check(response.status_code == 200, f"API bulk: {response.status_code}")
+        expect("API bulk upsert", 970)
+        response = client.post(
+            "/api/v1/products/import?format=csv",
+            data="name,quantity,warehouse_id\ngizmo,15,\nsprocket,25,2\n",
+            content_type="text/csv",
+        )
+        check(response.status_code == 200, f"API import: {response.status_code}")
+        expect("API import", 970)
+
+        response = client.post("/api/v1/orders", json={
+            "product": "product-0000000", "quantity": 200,
+            "email": "check@example.com"})
+        check(response.status_code == 201, f"API order: {response.status_code}")
+        before = expect("API order", 770)
+        client.post("/movement", data={
+            "prod_name": "sprocket", "from_loc": "Warehouse 2",
+            "to_loc": "Main Warehouse", "quantity": "5"})
+        after = expect("form movement", 770)
+        check(after[2] == before[2] - 5, "form movement: stock did not move")
+        client.post("/delete?type=product",
+                    data={"prod_id": product_id("gizmo")})
+        expect("form delete", 755)
+
+    print("OK: capacity matches stock on every path")
+
+
+if __name__ == "__main__":
+    main()
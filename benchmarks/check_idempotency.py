@@ -0,0 +1,142 @@
+"""Concurrent replays of idempotent requests must apply exactly once.
+
+    python benchmarks/check_idempotency.py --threads 32 --rounds 20
+
+Each round fires --threads identical requests with one Idempotency-Key at
+the same moment (a barrier releases them together) for a form restock, an
+API order and a form delete, then checks that stock moved once, one order
+exists, every thread got the same status, and all but one response was a
+replay. A final round with distinct keys checks nothing is deduplicated by
+mistake. Exits 1 on the first failure.
+"""
+import argparse
+import threading
+import uuid
+from contextlib import closing
+
+from common import seed_products, temp_database
+
+
+def fire(app, threads, send):
+    """Call send(client) from `threads` threads at once; return responses."""
+    barrier = threading.Barrier(threads)
+    responses = [None] * threads
+
+    def worker(n):
+        client = app.test_client()
+        barrier.wait()
+        responses[n] = send(client)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return responses
+
+
+def check(condition, message):
+    if not condition:
+        raise SystemExit(f"FAIL: {message}")
+
+
+def check_replays(responses, what):
+    statuses = {r.status_code for r in responses}
+    replayed = sum(r.headers.get("Idempotent-Replayed") == "true"
+                   for r in responses)
+    check(len(statuses) == 1, f"{what}: mixed statuses {statuses}")
+    check(replayed == len(responses) - 1,
+          f"{what}: {replayed} replays of {len(responses)} requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    temp_database("check-idempotency-")
+    seed_products(args.rounds + 10, quantity=1000)
+    from app import app
+    from python_warehouse.db import connect_db
+
+    def quantity(conn, name):
+        row = conn.execute(
+            "SELECT quantity FROM products WHERE name = ?", (name,)
+        ).fetchone()
+        return row and row[0]
+
+    def product_id(conn, name):
+        return conn.execute(
+            "SELECT id FROM products WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    # Products 2 .. rounds + 1 are deleted, one per round; the last one is
+    # left for the checks after the rounds
+    spare = f"product-{args.rounds + 9:07d}"
+
+    with closing(connect_db()) as conn:
+        for n in range(args.rounds):
+            key = uuid.uuid4().hex
+            before = quantity(conn, "product-0000000")
+            responses = fire(app, args.threads, lambda c: c.post(
+                "/product",
+                data={"prod_name": "product-0000000", "prod_quantity": "5",
+                      "idempotency_key": key},
+            ))
+            check_replays(responses, "restock")
+            after = quantity(conn, "product-0000000")
+            check(after == before + 5,
+                  f"restock applied {(after - before) // 5} times")
+
+            key = uuid.uuid4().hex
+            responses = fire(app, args.threads, lambda c: c.post(
+                "/api/v1/orders", headers={"Idempotency-Key": key},
+                json={"product": "product-0000001", "quantity": 1,
+                      "email": "replay@example.com"},
+            ))
+            check_replays(responses, "order")
+            check(len({r.get_json()["id"] for r in responses}) == 1,
+                  "replayed orders returned different ids")
+
+            key = uuid.uuid4().hex
+            doomed = f"product-{n + 2:07d}"
+            doomed_id = product_id(conn, doomed)
+            responses = fire(app, args.threads, lambda c: c.post(
+                "/delete?type=product",
+                data={"prod_id": str(doomed_id), "idempotency_key": key},
+            ))
+            check_replays(responses, "delete")
+            check(quantity(conn, doomed) is None, "product not deleted")
+
+        orders = conn.execute(
+            "SELECT COUNT(*) FROM orders WHERE email = 'replay@example.com'"
+        ).fetchone()[0]
+        check(orders == args.rounds, f"{orders} orders for {args.rounds} rounds")
+
+        # Distinct keys are distinct requests
+        before = quantity(conn, spare)
+        responses = fire(app, args.threads, lambda c: c.post(
+            "/product",
+            data={"prod_name": spare, "prod_quantity": "1",
+                  "idempotency_key": uuid.uuid4().hex},
+        ))
+        check(quantity(conn, spare) == before + args.threads,
+              "requests with distinct keys were deduplicated")
+
+        # A key reused for a different request is refused
+        key = uuid.uuid4().hex
+        client = app.test_client()
+        client.post("/product", data={"prod_name": spare,
+                                      "prod_quantity": "1",
+                                      "idempotency_key": key})
+        response = client.post("/product", data={"prod_name": spare,
+                                                 "prod_quantity": "2",
+                                                 "idempotency_key": key})
+        check(response.status_code == 422, "key reuse was not refused")
+
+    print(f"OK: {args.rounds} rounds x {args.threads} concurrent replays")
+
+
+if __name__ == "__main__":
+    main()
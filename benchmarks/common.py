@@ -0,0 +1,141 @@
+"""Helpers shared by the benchmark scripts.
+
+Every benchmark runs against a throwaway database so the checked-in
+inventory.db is never touched.
+"""
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def temp_database(prefix="bench-"):
+    """Point DATABASE_NAME at a fresh file and create the schema there."""
+    directory = tempfile.mkdtemp(prefix=prefix)
+    path = os.path.join(directory, "inventory.db")
+    os.environ["DATABASE_NAME"] = path
+
+    from python_warehouse.db import init_db
+    init_db()
+    return path
+
+
+def seed_products(count, quantity=1000, warehouses=1):
+    """Insert `count` products spread round-robin over `warehouses`."""
+    from python_warehouse.db import connect_db
+
+    with closing(connect_db()) as conn, conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO warehouse (id, location_name, max_capacity, "
+            "used_capacity) VALUES (?, ?, ?, 0)",
+            ((w, f"Warehouse {w}", count * quantity) for w in range(1, warehouses + 1)),
+        )
+        conn.executemany(
+            "INSERT INTO products (name, quantity, warehouse_id) VALUES (?, ?, ?)",
+            ((f"product-{i:07d}", quantity, i % warehouses + 1)
+             for i in range(count)),
+        )
+
+
+def seed_orders(count, products, days=30, seed=0):
+    """Insert `count` orders for the first `products` seeded products,
+    spread over the last `days` days; about one in ten is still queued."""
+    from python_warehouse.db import connect_db
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    statuses = ["processed"] * 9 + ["queued"]
+    with closing(connect_db()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO orders (id, product, quantity, email, status, "
+            "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"{i:019d}", f"product-{rng.randrange(products):07d}",
+              rng.randint(1, 5), f"customer{rng.randrange(1000)}@example.com",
+              rng.choice(statuses),
+              (now - timedelta(seconds=rng.uniform(0, days * 86400)))
+              .strftime("%Y-%m-%d %H:%M:%S"))
+             for i in range(count)),
+        )
+
+
+def seed_database(products, warehouses=1, orders=0, quantity=1000):
+    """A fresh temporary database with the given row counts; returns its path."""
+    path = temp_database()
+    seed_products(products, quantity, warehouses)
+    if orders:
+        seed_orders(orders, products)
+    return path
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(benchmark, params, metrics):
+    """Result document shared by the suite, so runs on different commits
+    can be diffed with compare.py. Metric names ending in _rps are better
+    when higher; all others are timings, better when lower."""
+    return {
+        "benchmark": benchmark,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        # Where the result was written does not change what was measured
+        "params": {k: v for k, v in params.items() if k != "output"},
+        "metrics": metrics,
+    }
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+        for p in points
+    }
+
+
+def run_modes(script, modes, args):
+    """Run `script` once per mode in a fresh interpreter.
+
+    Settings such as DB_POOL_SIZE are read when a process first touches the
+    database, so each mode gets its own process and environment.
+    """
+    results = {}
+    for mode, env in modes.items():
+        out = subprocess.run(
+            [sys.executable, script, "--run-mode", mode, *args],
+            env={**os.environ, **env},
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+    return results
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,54 @@
+"""Compare two benchmark results and flag regressions.
+
+    python benchmarks/micro.py --output before.json   # on the old commit
+    python benchmarks/micro.py --output after.json    # on the new commit
+    python benchmarks/compare.py before.json after.json --threshold 10
+
+Exits with status 1 when any metric got worse by more than --threshold
+percent, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def change(name, old, new):
+    """Percent change, positive meaning worse."""
+    if old in (None, 0) or new is None:
+        return None
+    delta = (new - old) / old * 100
+    return -delta if name.endswith("_rps") else delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.before) as fp:
+        before = json.load(fp)
+    with open(args.after) as fp:
+        after = json.load(fp)
+    if before["benchmark"] != after["benchmark"]:
+        sys.exit(f"Cannot compare {before['benchmark']} with {after['benchmark']}")
+    if before["params"] != after["params"]:
+        print("warning: the runs used different parameters", file=sys.stderr)
+
+    print(f"{before['benchmark']}: {before['commit']} -> {after['commit']}")
+    regressions = 0
+    for name, old in before["metrics"].items():
+        new = after["metrics"].get(name)
+        worse = change(name, old, new)
+        flag = ""
+        if worse is not None and worse > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        shown = f"{worse:+.1f}%" if worse is not None else "n/a"
+        print(f"{name:<40}{old!s:>12}{new!s:>12}{shown:>10}{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Concurrent HTTP load against the Flask app.
+
+    python benchmarks/load.py --target client --concurrency 8 --seconds 10
+    python benchmarks/load.py --target gunicorn --workers 4 --output load.json
+
+`client` drives the app in-process through Flask's test client; `gunicorn`
+starts a local Gunicorn on a free port and sends real HTTP requests over
+keep-alive connections. Each thread cycles through --paths. Throughput and
+latency percentiles per path are printed as JSON for compare.py.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from common import ROOT, percentiles, report, seed_database
+
+DEFAULT_PATHS = (
+    "/", "/product", "/location", "/movement",
+    "/api/v1/products", "/api/v1/search?q=product-00",
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, port):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--workers", str(workers), "--bind", f"127.0.0.1:{port}"],
+        cwd=ROOT, env=os.environ.copy(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("gunicorn exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit("gunicorn did not start listening within 30s")
+
+
+def client_sender():
+    from app import app
+
+    def make():
+        client = app.test_client()
+        return lambda path: client.get(path).status_code
+
+    return make
+
+
+def http_sender(port):
+    def make():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+
+        def send(path):
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+
+        return send
+
+    return make
+
+
+def run_load(make_sender, paths, concurrency, seconds):
+    deadline = time.perf_counter() + seconds
+    samples = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    lock = threading.Lock()
+
+    def worker(offset):
+        send = make_sender()
+        local = {path: [] for path in paths}
+        failed = {path: 0 for path in paths}
+        for path in itertools.islice(itertools.cycle(paths), offset, None):
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            status = send(path)
+            local[path].append((time.perf_counter() - start) * 1000)
+            if status >= 400:
+                failed[path] += 1
+        with lock:
+            for path in paths:
+                samples[path].extend(local[path])
+                errors[path] += failed[path]
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    metrics = {
+        "total_rps": round(sum(map(len, samples.values())) / elapsed, 1),
+        "errors": sum(errors.values()),
+    }
+    for path, values in samples.items():
+        metrics[f"{path}_rps"] = round(len(values) / elapsed, 1)
+        for name, value in percentiles(values).items():
+            metrics[f"{path}_{name}_ms"] = (
+                round(value, 3) if value is not None else None
+            )
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=("client", "gunicorn"),
+                        default="client")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="gunicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--warehouses", type=int, default=20)
+    parser.add_argument("--orders", type=int, default=20_000)
+    parser.add_argument("--paths", default=",".join(DEFAULT_PATHS))
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    seed_database(args.products, args.warehouses, args.orders)
+    paths = args.paths.split(",")
+    server = None
+    if args.target == "gunicorn":
+        port = free_port()
+        server = start_gunicorn(args.workers, port)
+        make_sender = http_sender(port)
+    else:
+        make_sender = client_sender()
+    try:
+        metrics = run_load(make_sender, paths, args.concurrency, args.seconds)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    result = report(f"load-{args.target}", vars(args), metrics)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Micro-benchmarks of the inventory and order code paths.
+
+    python benchmarks/micro.py --products 50000 --output micro.json
+
+Each case is run --repeat times against a seeded database and reported as
+its median and minimum in milliseconds, in the JSON format compare.py reads.
+"""
+import argparse
+import json
+import statistics
+import time
+from contextlib import closing
+
+from common import report, seed_database
+
+
+def measure(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def cases(args):
+    from python_warehouse.db import connect_db
+    from python_warehouse.inventory import Inventory
+    from python_warehouse.order_queue import ProcessQueue, Queue
+    from python_warehouse.ordering import place_order
+
+    inventory = Inventory()
+
+    def touch_products():
+        # Bumps the products version so get_inventory must reload
+        with closing(connect_db()) as conn, conn:
+            conn.execute("UPDATE products SET quantity = quantity WHERE id = 1")
+
+    def process_queue_startup():
+        ProcessQueue(Queue()).depth()
+
+    counter = iter(range(10**9))
+
+    def order():
+        n = next(counter)
+        place_order(f"product-{n % args.products:07d}", 1, "bench@example.com")
+
+    return {
+        "inventory_load_ms": (Inventory, None),
+        "get_inventory_unchanged_ms": (inventory.get_inventory, None),
+        "get_inventory_reload_ms": (inventory.get_inventory, touch_products),
+        "process_queue_startup_ms": (process_queue_startup, None),
+        "place_order_ms": (order, None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--warehouses", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    seed_database(args.products, args.warehouses, args.orders)
+    metrics = {}
+    for name, (fn, setup) in cases(args).items():
+        median, best = measure(fn, args.repeat, setup)
+        metrics[name] = round(median, 4)
+        metrics[name.replace("_ms", "_min_ms")] = round(best, 4)
+
+    result = report("micro", vars(args), metrics)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Query-plan regression check for the hot queries.
+
+    python benchmarks/query_plans.py
+
+Runs EXPLAIN QUERY PLAN for each query on a freshly migrated database and
+exits non-zero if one of them no longer uses the index it is expected to.
+"""
+import sys
+from contextlib import closing
+
+from common import seed_products, temp_database
+
+# (query, parameters, substring expected in the plan)
+HOT_QUERIES = [
+    ("SELECT id, product, quantity FROM orders WHERE status = 'queued'", (),
+     "USING INDEX idx_orders_status_id"),
+    ("SELECT id, product, quantity, email, status FROM orders "
+     "ORDER BY status, id", (),
+     "USING INDEX idx_orders_status_id"),
+    ("SELECT id, status FROM orders WHERE email = ?", ("a@b.c",),
+     "USING INDEX idx_orders_email"),
+    ("SELECT id, name, quantity FROM products WHERE warehouse_id = ?", (1,),
+     "USING INDEX idx_products_warehouse"),
+    ("SELECT product_id, quantity FROM stock WHERE warehouse_id = ?", (1,),
+     "USING INDEX idx_stock_warehouse"),
+    ("SELECT quantity FROM stock WHERE product_id = ? AND warehouse_id = ?",
+     (1, 1), "USING PRIMARY KEY"),
+]
+
+
+def query_plan(conn, query, params):
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def main():
+    temp_database()
+    seed_products(5000, warehouses=50)
+    from python_warehouse.db import connect_db
+
+    failures = 0
+    with closing(connect_db()) as conn:
+        with conn:
+            conn.executemany(
+                "INSERT INTO orders (id, product, quantity, email, status) "
+                "VALUES (?, ?, 1, ?, ?)",
+                ((f"{i:05d}", f"product-{i:07d}", f"c{i % 500}@example.com",
+                  ("pending", "queued", "processed")[i % 3])
+                 for i in range(20000)),
+            )
+        # Let the planner see realistic table statistics
+        conn.execute("ANALYZE")
+        for query, params, expected in HOT_QUERIES:
+            plan = query_plan(conn, query, params)
+            ok = expected in plan
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {query}\n     {plan}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""Create a synthetic database for benchmarking or manual testing.
+
+    python benchmarks/seed.py --products 100000 --warehouses 20 --orders 50000
+
+The schema is created with init_db() in a new temporary directory, whose
+path is printed; pass it on as DATABASE_NAME.
+"""
+import argparse
+
+from common import seed_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--warehouses", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(seed_database(args.products, args.warehouses, args.orders))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Multi-process oversell check for order placement.
+
+    python benchmarks/stress_orders.py --procs 8 --orders 200 --stock 500
+
+Every process races to order one unit at a time of the same product. With
+place_order the number of units sold must equal the starting stock exactly
+and the quantity must never go negative. --legacy runs the old
+read-then-write sequence instead, to show the oversell it allowed.
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+from contextlib import closing
+
+from common import temp_database
+
+PRODUCT = "widget"
+
+
+def legacy_order(conn, amount):
+    stock = conn.execute(
+        "SELECT quantity FROM products WHERE name = ?", (PRODUCT,)
+    ).fetchone()[0]
+    if stock < amount:
+        return False
+    conn.execute("UPDATE products SET quantity = ? WHERE name = ?",
+                 (stock - amount, PRODUCT))
+    conn.commit()
+    return True
+
+
+def worker(proc, orders, legacy, start, results):
+    from python_warehouse.db import connect_db
+    from python_warehouse.ordering import InsufficientStock, place_order
+
+    start.wait()
+    sold = 0
+    with closing(connect_db()) as conn:
+        for i in range(orders):
+            if legacy:
+                sold += legacy_order(conn, 1)
+                continue
+            try:
+                place_order(PRODUCT, 1, f"p{proc}@example.com",
+                            order_id=f"{proc}-{i}", conn=conn)
+                sold += 1
+            except InsufficientStock:
+                pass
+    results.put(sold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procs", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    temp_database()
+    from python_warehouse.db import connect_db
+    with closing(connect_db()) as conn, conn:
+        conn.execute(
+            "INSERT INTO products (name, quantity, warehouse_id) VALUES (?, ?, 1)",
+            (PRODUCT, args.stock),
+        )
+
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(
+            target=worker, args=(p, args.orders, args.legacy, start, results))
+        for p in range(args.procs)
+    ]
+    for p in procs:
+        p.start()
+    began = time.perf_counter()
+    start.set()
+    sold = sum(results.get() for _ in procs)
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - began
+
+    with closing(connect_db()) as conn:
+        left = conn.execute(
+            "SELECT quantity FROM products WHERE name = ?", (PRODUCT,)
+        ).fetchone()[0]
+        recorded = conn.execute(
+            "SELECT COALESCE(SUM(quantity), 0) FROM orders"
+        ).fetchone()[0]
+
+    oversold = sold - (args.stock - left)
+    print(f"attempted {args.procs * args.orders}, sold {sold}, stock left "
+          f"{left}, orders recorded {recorded}, oversold {oversold} "
+          f"({args.procs * args.orders / elapsed:.0f} attempts/sec)")
+    ok = oversold == 0 and left >= 0 and (args.legacy or recorded == sold)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+from flask import g
+
+from python_warehouse.db import connect_db
+
+
+def get_db():
+    """Return this request's connection, checking one out of the pool on
+    first use. It is handed back by close_db() when the app context ends.
+    """
+    if "db" not in g:
+        g.db = connect_db()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        # Returns the connection to the pool instead of closing it
+        conn.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
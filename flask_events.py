@@ -0,0 +1,43 @@
+import os
+
+from flask import Response, request
+
+from flask_db import get_db
+from python_warehouse.change_feed import get_change_feed
+
+
+def events():
+    """Server-sent events: "product" (id, name, quantity or deleted),
+    "order" (id, product, quantity, status), "queue" (orders by status)
+    and "reset" (reload the page).
+
+    The stream holds no database connection; it waits on this worker's
+    change feed. Browsers reconnect by themselves and send Last-Event-ID,
+    so changes missed in between are replayed.
+    """
+    after = request.headers.get("Last-Event-ID", type=int)
+    subscription = get_change_feed().subscribe(get_db(), after)
+    heartbeat = float(os.environ.get("EVENTS_HEARTBEAT", "15"))
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield from subscription.events(heartbeat)
+        finally:
+            subscription.close()
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Deliver events as they happen through an nginx proxy
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def init_app(app):
+    """Serve /events.
+
+    Every open stream occupies a worker thread (or greenlet) for as long
+    as the page is open, so serve the app with the gevent worker, or
+    gthread with enough threads, as gunicorn.conf.py does.
+    """
+    app.add_url_rule("/events", "events", events)
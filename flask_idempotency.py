@@ -0,0 +1,101 @@
+import hashlib
+from functools import wraps
+
+from flask import Response, abort, current_app, make_response, request
+
+from flask_db import get_db
+from python_warehouse.idempotency import (
+    KeyAbandoned, KeyInProgress, KeyMismatch, claim, complete, release,
+)
+
+HEADER = "Idempotency-Key"
+# HTML forms cannot set headers; base-template.jinja adds this field to
+# every POST form instead
+FORM_FIELD = "idempotency_key"
+MAX_KEY_LENGTH = 255
+# Response headers replayed along with the status and body
+STORED_HEADERS = ("Content-Type", "Location")
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def request_key():
+    return request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+
+
+def fingerprint():
+    """Hash of what the request asks for, so a key reused for a different
+    request is refused rather than answered with the wrong result."""
+    digest = hashlib.sha256(f"{request.method} {request.full_path}".encode())
+    if request.form:
+        for name, value in sorted(request.form.items(multi=True)):
+            if name != FORM_FIELD:
+                digest.update(f"\0{name}={value}".encode())
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """Run a mutating request at most once per Idempotency-Key.
+
+    Requests without a key behave as before. The first request with a key
+    runs and its response is stored; retries with the same key get that
+    response back (with Idempotent-Replayed: true) without running the
+    view. A duplicate arriving while the first is still running waits for
+    it, or gets 409 after a few seconds.
+
+    The result is stored in its own commit after the view's, so it can be
+    lost with the process in between. A key whose result never arrived is
+    not run again: retries get 409 and the client has to check and use a
+    new key. Errors the app handles (aborts, 4xx) are stored like any
+    response. Other errors (unhandled exceptions, 5xx) give the key up so
+    they can be retried, but only when the view wrote nothing through the
+    request's connection.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = None if request.method in SAFE_METHODS else request_key()
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            abort(400, f"{HEADER} must be at most {MAX_KEY_LENGTH} characters")
+
+        conn = get_db()
+        try:
+            stored = claim(conn, key, fingerprint())
+        except KeyMismatch:
+            abort(422, f"{HEADER} was already used for a different request")
+        except KeyAbandoned:
+            abort(409, f"The request with this {HEADER} did not finish and "
+                       "may have been applied; check, then retry with a new key")
+        except KeyInProgress:
+            abort(409, f"A request with this {HEADER} is still in progress")
+        if stored is not None:
+            response = Response(stored.body, stored.status, stored.headers)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        changes = conn.total_changes
+        try:
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception as exc:
+                # Raises again when no error handler answers it
+                response = make_response(current_app.handle_user_exception(exc))
+        except BaseException:
+            if conn.total_changes == changes:
+                release(conn, key)
+            raise
+        if response.status_code >= 500 or response.is_streamed:
+            if conn.total_changes == changes:
+                release(conn, key)
+        else:
+            complete(
+                conn, key, response.status_code,
+                {h: response.headers[h] for h in STORED_HEADERS
+                 if h in response.headers},
+                response.get_data(),
+            )
+        return response
+
+    return wrapper
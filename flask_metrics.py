@@ -0,0 +1,70 @@
+import time
+
+from flask import Response, g, request
+
+from flask_db import get_db
+from python_warehouse import metrics
+from python_warehouse.capacity import get_capacity_engine
+from python_warehouse.order_queue import depth
+
+
+def start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def record_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        metrics.registry.observe(
+            "http_request_duration_seconds",
+            (
+                ("endpoint", request.endpoint or "unmatched"),
+                ("method", request.method),
+                ("status", str(response.status_code)),
+            ),
+            time.perf_counter() - start,
+        )
+        metrics.registry.flush()
+    return response
+
+
+def gauges():
+    """Read at scrape time from the database, so every worker reports the
+    same values and they need no aggregation."""
+    orders = depth()
+    utilization = get_capacity_engine().utilization(get_db())
+    return [
+        (
+            "inventory_orders", "Orders waiting, in flight or dead, by status",
+            [((("status", status),), count) for status, count in orders.items()],
+        ),
+        (
+            "inventory_warehouse_used_ratio", "used_capacity / max_capacity",
+            [((("warehouse_id", wid),), used / max_cap if max_cap else 0)
+             for wid, max_cap, used in utilization],
+        ),
+        (
+            "inventory_warehouse_used_capacity", "Units stored in a warehouse",
+            [((("warehouse_id", wid),), used) for wid, _, used in utilization],
+        ),
+    ]
+
+
+def metrics_view():
+    return Response(
+        metrics.render(metrics.collect(), gauges()),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+def init_app(app):
+    """Time every request and serve all workers' metrics at /metrics.
+
+    Set METRICS_DIR to a directory shared by the Gunicorn workers so a
+    scrape, whichever worker answers it, covers all of them.
+    """
+    if not metrics.enabled():
+        return
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
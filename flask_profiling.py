@@ -0,0 +1,53 @@
+import hmac
+import os
+
+from flask import Response, abort, current_app, request
+
+from python_warehouse.profiling import sample
+
+
+def profile_view():
+    """Sample a request to this app and return collapsed stacks.
+
+        GET /debug/profile?path=/product&repeat=20
+        X-Profile-Token: <PROFILE_TOKEN>
+
+    The request at `path` is replayed `repeat` times in this worker while
+    its stack is sampled every `interval` ms. The response can be fed to
+    flamegraph.pl or dropped into speedscope.
+    """
+    token = request.headers.get("X-Profile-Token") or request.args.get("token", "")
+    # As bytes: compare_digest refuses str with non-ASCII characters
+    if not hmac.compare_digest(
+        token.encode(), current_app.config["PROFILE_TOKEN"].encode()
+    ):
+        abort(403)
+    path = request.args.get("path", "/")
+    if not path.startswith("/") or path.startswith("/debug/"):
+        abort(400)
+    repeat = max(1, min(request.args.get("repeat", 10, type=int), 1000))
+    interval = max(0.1, request.args.get("interval", 1.0, type=float)) / 1000
+
+    client = current_app.test_client()
+
+    def run():
+        return [client.get(path).status_code for _ in range(repeat)]
+
+    statuses, collapsed, elapsed = sample(run, interval)
+    return Response(
+        collapsed,
+        mimetype="text/plain",
+        headers={
+            "X-Profile-Seconds": f"{elapsed:.3f}",
+            "X-Profile-Statuses": ",".join(sorted(set(map(str, statuses)))),
+        },
+    )
+
+
+def init_app(app):
+    """Register /debug/profile, only when PROFILE_TOKEN is set."""
+    token = os.environ.get("PROFILE_TOKEN")
+    if not token:
+        return
+    app.config["PROFILE_TOKEN"] = token
+    app.add_url_rule("/debug/profile", "debug_profile", profile_view)
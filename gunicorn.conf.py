@@ -0,0 +1,77 @@
+"""Gunicorn settings for the inventory app.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded in the master, where create_app() also bootstraps
+the schema, so workers fork with everything imported and migrated.
+Pools, caches and background threads are per process: the master closes
+its connections before forking, and each module resets its own state in
+the child through os.register_at_fork.
+
+Each worker also runs ORDER_WORKERS (default 2) order-queue threads that
+process queued orders and mail invoices. Set ORDER_WORKERS=0 when they run
+as a separate service instead (python -m python_warehouse.order_queue).
+"""
+import multiprocessing
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get(
+    "WEB_CONCURRENCY", min(4, multiprocessing.cpu_count() * 2 + 1)
+))
+preload_app = True
+
+# /events streams stay open as long as a page does, so each one needs a
+# cheap concurrent worker slot: a greenlet with gevent, else a thread
+try:
+    import gevent  # noqa: F401
+except ImportError:
+    worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+else:
+    worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+order_workers = int(os.environ.get("ORDER_WORKERS", "2"))
+_order_pool = None
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+if worker_class == "gevent":
+    # Patch before the preloaded app imports threading, socket and ssl
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def on_starting(server):
+    # Runs once in the master, after preload_app has loaded the app but
+    # before any worker forks. Only workers write metrics dumps (when they
+    # serve a request), so none of this run's can be removed here.
+    from python_warehouse.metrics import clear_metrics_dir
+
+    clear_metrics_dir()
+
+
+def when_ready(server):
+    # The preloaded app used the master's pool; workers must not inherit
+    # open SQLite connections
+    from python_warehouse.db import close_pools
+
+    close_pools()
+
+
+def post_fork(server, worker):
+    global _order_pool
+    if order_workers > 0:
+        from python_warehouse.notifications import send_invoice
+        from python_warehouse.order_queue import WorkerPool
+
+        _order_pool = WorkerPool(send_invoice, workers=order_workers).start()
+
+
+def worker_exit(server, worker):
+    # Let claimed orders finish; anything left is re-claimed once its
+    # lease runs out
+    from python_warehouse.notifications import stop_notifier
+
+    if _order_pool is not None:
+        _order_pool.stop(timeout=10)
+    stop_notifier()
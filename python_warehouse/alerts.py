@@ -0,0 +1,75 @@
+import math
+import os
+from collections import namedtuple
+
+# daily_demand: units ordered per day over the window; suggested: units to
+# reorder so the product lasts cover_days beyond its reorder point
+Alert = namedtuple(
+    "Alert",
+    "product_id name quantity reorder_point raised_at daily_demand suggested",
+)
+
+
+def reorder_window_days():
+    """REORDER_WINDOW_DAYS: how far back order velocity is measured."""
+    return int(os.environ.get("REORDER_WINDOW_DAYS", "30"))
+
+
+def reorder_cover_days():
+    """REORDER_COVER_DAYS: how many days of demand a reorder should cover."""
+    return int(os.environ.get("REORDER_COVER_DAYS", "14"))
+
+
+def suggest_quantity(quantity, reorder_point, daily_demand, cover_days):
+    """Units to order: enough for cover_days of demand on top of the
+    reorder point, and always enough to clear the alert."""
+    target = reorder_point + math.ceil(daily_demand * cover_days)
+    return max(target - quantity, reorder_point - quantity + 1, 0)
+
+
+def low_stock(conn, limit=None, window_days=None, cover_days=None):
+    """Products at or below their reorder point, newest alert first.
+
+    Reads stock_alerts, which the triggers of migration 11 keep down to the
+    products that are actually low, and the recent orders of just those
+    products; the cost grows with the number of alerts, not the catalog.
+    """
+    window_days = window_days or reorder_window_days()
+    cover_days = cover_days or reorder_cover_days()
+    rows = conn.execute(
+        "SELECT a.product_id, p.name, a.quantity, a.reorder_point, a.raised_at, "
+        "(SELECT COALESCE(SUM(o.quantity), 0) FROM orders o "
+        " WHERE o.product = p.name COLLATE NOCASE "
+        " AND o.created_at >= datetime('now', ?) AND o.status != 'dead') "
+        "FROM stock_alerts a JOIN products p ON p.id = a.product_id "
+        "ORDER BY a.raised_at DESC, a.product_id DESC LIMIT ?",
+        (f"-{int(window_days)} days", -1 if limit is None else limit),
+    ).fetchall()
+    alerts = []
+    for product_id, name, quantity, reorder_point, raised_at, units in rows:
+        daily = units / window_days
+        alerts.append(Alert(
+            product_id, name, quantity, reorder_point, raised_at,
+            round(daily, 3),
+            suggest_quantity(quantity, reorder_point, daily, cover_days),
+        ))
+    return alerts
+
+
+def alert_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM stock_alerts").fetchone()[0]
+
+
+def set_reorder_point(conn, product, reorder_point):
+    """Set a product's reorder point by name; returns False if unknown.
+
+    The alert triggers raise or clear its alert in the same statement.
+    """
+    if reorder_point < 0:
+        raise ValueError("Reorder point cannot be negative")
+    with conn:
+        cursor = conn.execute(
+            "UPDATE products SET reorder_point = ? WHERE name = ?",
+            (reorder_point, product),
+        )
+    return cursor.rowcount > 0
@@ -0,0 +1,137 @@
+"""Space and stock analytics across all warehouses.
+
+Aggregation is pushed into SQL and results are read with chunked
+read_sql_query, so memory is bounded by the size of one chunk plus the
+per-warehouse totals (and a top-N of products), never by order history.
+"""
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 50_000
+WINDOW_DAYS = 30
+AT_RISK_PRODUCTS = 20
+
+# Same thresholds as the original per-row classification:
+# < 50% low, < 90% efficient, otherwise near capacity
+STATUS_BINS = [-np.inf, 50, 90, np.inf]
+STATUS_LABELS = ["Low Utilization", "Efficient", "Near Capacity"]
+
+
+def classify_utilization(pct):
+    return pd.cut(pct, bins=STATUS_BINS, labels=STATUS_LABELS, right=False)
+
+
+def warehouse_utilization(conn):
+    df = pd.read_sql_query(
+        "SELECT id, location_name, max_capacity, used_capacity "
+        "FROM warehouse ORDER BY id",
+        conn,
+    )
+    max_cap = df["max_capacity"].to_numpy(dtype=float)
+    used = df["used_capacity"].fillna(0).to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["utilization_pct"] = np.where(max_cap > 0, used / max_cap * 100, np.nan)
+    df["status"] = classify_utilization(df["utilization_pct"])
+    return df
+
+
+def product_demand(conn, window_days=WINDOW_DAYS, chunksize=CHUNK_ROWS):
+    """Units ordered per product over the window, as a Series keyed by
+    lowercased name. Orders are summed by SQLite; only the per-product
+    totals are streamed back."""
+    parts = [
+        chunk.set_index("product")["units"]
+        for chunk in pd.read_sql_query(
+            "SELECT lower(product) AS product, SUM(quantity) AS units "
+            "FROM orders WHERE created_at >= datetime('now', ?) "
+            "AND status != 'dead' GROUP BY lower(product)",
+            conn,
+            params=(f"-{int(window_days)} days",),
+            chunksize=chunksize,
+        )
+    ]
+    if not parts:
+        return pd.Series(dtype="float64", name="units")
+    return pd.concat(parts)
+
+
+def stock_metrics(chunk, demand, window_days):
+    """Add daily demand, turnover and days of cover to a chunk of stock
+    rows. A product's demand is split over its locations in proportion to
+    the stock each one holds."""
+    total = chunk["product_total"].to_numpy(dtype=float)
+    on_hand = chunk["on_hand"].to_numpy(dtype=float)
+    units = (
+        demand.reindex(chunk["product"].str.lower()).fillna(0).to_numpy(dtype=float)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(total > 0, on_hand / total, 0.0)
+        daily = units * share / window_days
+        chunk["daily_demand"] = daily
+        chunk["turnover"] = np.where(on_hand > 0, daily * window_days / on_hand, np.nan)
+        chunk["days_of_cover"] = np.where(daily > 0, on_hand / daily, np.inf)
+    return chunk
+
+
+def space_report(conn, window_days=WINDOW_DAYS, chunksize=CHUNK_ROWS,
+                 top=AT_RISK_PRODUCTS):
+    """Return {"warehouses": DataFrame, "at_risk": DataFrame}.
+
+    warehouses has utilization, status, on-hand units, daily demand,
+    turnover and days of cover per warehouse. at_risk lists the `top`
+    product/warehouse pairs with the fewest days of cover.
+    """
+    warehouses = warehouse_utilization(conn)
+    demand = product_demand(conn, window_days, chunksize)
+
+    totals = None
+    at_risk = None
+    for chunk in pd.read_sql_query(
+        "SELECT s.warehouse_id, p.name AS product, s.quantity AS on_hand, "
+        "p.quantity AS product_total FROM stock s "
+        "JOIN products p ON p.id = s.product_id WHERE s.quantity > 0",
+        conn,
+        chunksize=chunksize,
+    ):
+        # read_sql_query yields one empty, untyped chunk when nothing is
+        # in stock
+        if chunk.empty:
+            continue
+        chunk = stock_metrics(chunk, demand, window_days)
+        part = chunk.groupby("warehouse_id")[["on_hand", "daily_demand"]].sum()
+        totals = part if totals is None else totals.add(part, fill_value=0)
+        candidates = chunk.nsmallest(top, "days_of_cover")
+        at_risk = (
+            candidates if at_risk is None
+            else pd.concat([at_risk, candidates]).nsmallest(top, "days_of_cover")
+        )
+
+    if totals is None:
+        totals = pd.DataFrame(columns=["on_hand", "daily_demand"], dtype=float)
+    warehouses = warehouses.merge(
+        totals, how="left", left_on="id", right_index=True
+    ).fillna({"on_hand": 0, "daily_demand": 0})
+    on_hand = warehouses["on_hand"].to_numpy(dtype=float)
+    daily = warehouses["daily_demand"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        warehouses["turnover"] = np.where(
+            on_hand > 0, daily * window_days / on_hand, np.nan)
+        warehouses["days_of_cover"] = np.where(daily > 0, on_hand / daily, np.inf)
+
+    if at_risk is None:
+        at_risk = pd.DataFrame(columns=[
+            "warehouse_id", "product", "on_hand", "product_total",
+            "daily_demand", "turnover", "days_of_cover"])
+    return {"warehouses": warehouses, "at_risk": at_risk.reset_index(drop=True)}
+
+
+def report_json(report):
+    """Make a space_report() result JSON-serialisable (inf/NaN -> None)."""
+    def records(df):
+        df = df.replace([np.inf, -np.inf], np.nan)
+        return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+    return {
+        "warehouses": records(report["warehouses"]),
+        "at_risk": records(report["at_risk"]),
+    }
@@ -0,0 +1,202 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+try:
+    from python_warehouse.db import table_version
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import table_version
+
+POLICIES = ("best_fit", "least_loaded")
+
+
+class CapacityEngine:
+    """Free capacity of every warehouse, kept in sorted indexes.
+
+    _by_free orders warehouses by free space, so the best fit (the smallest
+    space that still takes the stock) is one bisect away. _by_load orders
+    them by utilization for the least-loaded policy. A best-fit pick is
+    O(log n), with no table scan per pick.
+
+    used_capacity is booked by the triggers of migration 18 whenever stock
+    changes, one warehouse update per stock_events row. So the indexes are
+    brought up to date incrementally: when the warehouse write counter has
+    moved by exactly the number of new stock events, only those deltas are
+    applied, each moving one entry in each list (O(n), but only a memmove
+    of n pointers). Any other change to the table, or more events than
+    there are warehouses, rebuilds the indexes from the table instead.
+    State read inside a caller's uncommitted transaction is never kept.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._warehouses = {}
+        self._by_free = []
+        self._by_load = []
+        self._version = None
+        # last stock_events id applied
+        self._event_id = 0
+
+    # -- index maintenance -------------------------------------------------
+
+    @staticmethod
+    def _keys(warehouse_id, max_cap, used):
+        free = max_cap - used
+        load = used / max_cap if max_cap else 1.0
+        return (free, warehouse_id), (load, warehouse_id)
+
+    def _put(self, warehouse_id, max_cap, used):
+        old = self._warehouses.get(warehouse_id)
+        if old is not None:
+            free_key, load_key = self._keys(warehouse_id, *old)
+            del self._by_free[bisect_left(self._by_free, free_key)]
+            del self._by_load[bisect_left(self._by_load, load_key)]
+        self._warehouses[warehouse_id] = (max_cap, used)
+        free_key, load_key = self._keys(warehouse_id, max_cap, used)
+        insort(self._by_free, free_key)
+        insort(self._by_load, load_key)
+
+    def _reload(self, conn, version):
+        self._version = version
+        self._event_id = conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM stock_events"
+        ).fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, COALESCE(max_capacity, 0), COALESCE(used_capacity, 0) "
+            "FROM warehouse"
+        ).fetchall()
+        self._warehouses = {wid: (max_cap, used) for wid, max_cap, used in rows}
+        self._by_free = sorted(
+            self._keys(wid, *caps)[0] for wid, caps in self._warehouses.items())
+        self._by_load = sorted(
+            self._keys(wid, *caps)[1] for wid, caps in self._warehouses.items())
+
+    def _catch_up(self, conn, version):
+        """Apply the stock events since the last sync; False when they do
+        not account for every write to the warehouse table."""
+        if self._version is None:
+            return False
+        events = conn.execute(
+            "SELECT id, warehouse_id, delta FROM stock_events "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (self._event_id, len(self._warehouses) + 1),
+        ).fetchall()
+        if (
+            len(events) > len(self._warehouses)
+            or version != self._version + len(events)
+            or any(event[0] != self._event_id + i
+                   for i, event in enumerate(events, 1))
+            or any(event[1] not in self._warehouses for event in events)
+        ):
+            return False
+        for _, warehouse_id, delta in events:
+            max_cap, used = self._warehouses[warehouse_id]
+            self._put(warehouse_id, max_cap, used + delta)
+        self._version = version
+        self._event_id += len(events)
+        return True
+
+    def _sync(self, conn):
+        # The counter, events and rows are read in one transaction, so
+        # they describe the same moment
+        own_txn = not conn.in_transaction
+        if own_txn:
+            conn.execute("BEGIN")
+        try:
+            version = table_version(conn, "warehouse")
+            if version != self._version and not self._catch_up(conn, version):
+                self._reload(conn, version)
+        except BaseException:
+            self._version = None
+            raise
+        finally:
+            if own_txn:
+                conn.commit()
+        if not own_txn:
+            # Read inside the caller's transaction, which may still roll
+            # back: good for this call only, so reload on the next one
+            self._version = None
+
+    # -- queries -----------------------------------------------------------
+
+    def free(self, warehouse_id, conn):
+        with self._lock:
+            self._sync(conn)
+            max_cap, used = self._warehouses.get(warehouse_id, (0, 0))
+            return max_cap - used
+
+    def pick(self, quantity, conn, policy="best_fit"):
+        """Return the id of a warehouse that can take `quantity`, or None."""
+        with self._lock:
+            self._sync(conn)
+            if policy == "best_fit":
+                i = bisect_left(self._by_free, (quantity, -1))
+                return self._by_free[i][1] if i < len(self._by_free) else None
+            if policy == "least_loaded":
+                for _, warehouse_id in self._by_load:
+                    max_cap, used = self._warehouses[warehouse_id]
+                    if max_cap - used >= quantity:
+                        return warehouse_id
+                return None
+            raise ValueError(f"Unknown policy {policy!r}; use one of {POLICIES}")
+
+    def utilization(self, conn):
+        """[(warehouse_id, max_capacity, used_capacity)] ordered by id."""
+        with self._lock:
+            self._sync(conn)
+            return sorted((wid, *caps) for wid, caps in self._warehouses.items())
+
+    @staticmethod
+    def has_room(warehouse_id, quantity, conn):
+        """Whether a warehouse has space for `quantity` more.
+
+        Read from the table, in the caller's transaction: run it in the
+        BEGIN IMMEDIATE transaction that then writes the stock, so no other
+        writer can take the space in between. The stock write books it.
+        """
+        row = conn.execute(
+            "SELECT COALESCE(used_capacity, 0) + ? <= COALESCE(max_capacity, 0) "
+            "FROM warehouse WHERE id = ?",
+            (quantity, warehouse_id),
+        ).fetchone()
+        return bool(row and row[0])
+
+    # -- rebalancing -------------------------------------------------------
+
+    def rebalance_plan(self, conn, threshold=0.9):
+        """Propose (from_id, to_id, quantity) moves that bring every
+        warehouse above `threshold` utilization back down to it.
+
+        Excess goes to the least-loaded warehouses first, and no destination
+        is filled past the threshold. Nothing is written.
+        """
+        with self._lock:
+            self._sync(conn)
+            headroom = {
+                wid: int(max_cap * threshold) - used
+                for wid, (max_cap, used) in self._warehouses.items()
+            }
+        over = sorted(
+            ((room, wid) for wid, room in headroom.items() if room < 0)
+        )
+        # Max-heap of spare room below the threshold
+        targets = [(-room, wid) for wid, room in headroom.items() if room > 0]
+        heapq.heapify(targets)
+        moves = []
+        for room, source in over:
+            excess = -room
+            while excess > 0 and targets:
+                neg_room, target = heapq.heappop(targets)
+                amount = min(excess, -neg_room)
+                moves.append((source, target, amount))
+                excess -= amount
+                if amount < -neg_room:
+                    heapq.heappush(targets, (neg_room + amount, target))
+        return moves
+
+
+_engine = CapacityEngine()
+
+
+def get_capacity_engine():
+    return _engine
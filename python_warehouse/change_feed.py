@@ -0,0 +1,216 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+
+try:
+    from python_warehouse.db import database_path, open_connection
+    from python_warehouse.order_queue import depth
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import database_path, open_connection
+    from order_queue import depth
+
+# id is the change_feed row id, or None for events made up by the feed
+# itself ("queue" totals, "reset"); data is JSON text
+Change = namedtuple("Change", "id kind data")
+
+# Rows read per poll; a worker that falls further behind than this (a bulk
+# import, say) tells its clients to reload instead of streaming every row
+POLL_BATCH = 1000
+# Changes buffered per client; a client that cannot keep up is dropped
+SUBSCRIBER_BUFFER = 1000
+
+RESET = Change(None, "reset", "{}")
+
+
+def format_event(change):
+    """A change as one server-sent event. Only feed rows carry an id, so
+    Last-Event-ID on reconnect always names a row of change_feed."""
+    event_id = "" if change.id is None else f"id: {change.id}\n"
+    return f"{event_id}event: {change.kind}\ndata: {change.data}\n\n"
+
+
+def queue_change(counts):
+    return Change(None, "queue", json.dumps(counts))
+
+
+class Subscription:
+    """One /events client: the backlog it missed, then live changes."""
+
+    def __init__(self, feed, backlog):
+        self._feed = feed
+        self._queue = queue.Queue(SUBSCRIBER_BUFFER)
+        self.backlog = backlog
+        self.lagged = False
+
+    def put(self, change):
+        try:
+            self._queue.put_nowait(change)
+        except queue.Full:
+            self.lagged = True
+            return False
+        return True
+
+    def events(self, heartbeat):
+        """Yield formatted events; a comment line every `heartbeat` seconds
+        keeps proxies from timing out and notices departed clients."""
+        for change in self.backlog:
+            yield format_event(change)
+        while True:
+            try:
+                change = self._queue.get(timeout=heartbeat)
+            except queue.Empty:
+                if self.lagged:
+                    yield format_event(RESET)
+                    return
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(change)
+
+    def close(self):
+        self._feed.unsubscribe(self)
+
+
+class ChangeFeed:
+    """Tails the change_feed table for one worker process.
+
+    A single thread polls, so the database sees one reader per worker no
+    matter how many clients are connected; each poll is a PRAGMA
+    data_version check and rows are only read after another connection has
+    committed. New rows are fanned out to every subscriber's queue, and
+    whenever orders changed the queue totals follow as a "queue" event.
+    The thread only sleeps and waits on queues, so it runs unchanged as a
+    greenlet under Gunicorn's gevent worker.
+
+    The table itself is trimmed by trigger (see migration 15), so a
+    client that reconnects more than about 10000 changes behind is reset.
+    """
+
+    def __init__(self, interval=0.25, db_path=None):
+        self.interval = interval
+        self._conn = open_connection(db_path or database_path())
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._data_version = None
+        self.last_id = self._conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM change_feed"
+        ).fetchone()[0]
+        self.queue_state = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="change-feed", daemon=True
+        )
+        self._thread.start()
+
+    def subscribe(self, conn, after=None):
+        """Register a client. With `after` (its Last-Event-ID) the changes
+        it missed are replayed from `conn`; if they have been trimmed, or
+        are too many, it gets a "reset" and should reload."""
+        with self._lock:
+            last_id = self.last_id
+            subscription = Subscription(self, [])
+            self._subscribers.add(subscription)
+        backlog = []
+        if after is not None and after < last_id:
+            rows = conn.execute(
+                "SELECT id, kind, data FROM change_feed "
+                "WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (after, last_id, POLL_BATCH + 1),
+            ).fetchall()
+            if len(rows) > POLL_BATCH or not rows or rows[0][0] != after + 1:
+                backlog = [RESET]
+            else:
+                backlog = [Change(*row) for row in rows]
+        state = self.queue_state
+        backlog.append(queue_change(state if state is not None else depth()))
+        subscription.backlog = backlog
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        sqlite3.Connection.close(self._conn)
+
+    def _publish(self, changes):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            for change in changes:
+                if not subscription.put(change):
+                    # Its stream ends with a reset once it drains
+                    self.unsubscribe(subscription)
+                    break
+
+    def poll(self):
+        """Read and publish what was committed since the last poll."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        rows = self._conn.execute(
+            "SELECT id, kind, data FROM change_feed WHERE id > ? "
+            "ORDER BY id LIMIT ?",
+            (self.last_id, POLL_BATCH + 1),
+        ).fetchall()
+        if not rows:
+            return
+        if len(rows) > POLL_BATCH:
+            changes = [RESET]
+            last_id = self._conn.execute(
+                "SELECT MAX(id) FROM change_feed"
+            ).fetchone()[0]
+        else:
+            changes = [Change(*row) for row in rows]
+            last_id = rows[-1][0]
+        if any(change.kind != "product" for change in changes):
+            self.queue_state = depth()
+            changes.append(queue_change(self.queue_state))
+        with self._lock:
+            self.last_id = last_id
+        self._publish(changes)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except sqlite3.Error:
+                # A locked or busy database; try again on the next tick
+                continue
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def _reset_feed():
+    # The poll thread and its connection do not survive a fork
+    global _feed, _feed_lock
+    _feed = None
+    _feed_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_feed)
+
+
+def get_change_feed():
+    """The per-process feed, started on first use.
+
+    CHANGE_FEED_POLL (seconds, default 0.25) is how often it checks for
+    commits.
+    """
+    global _feed
+    with _feed_lock:
+        if _feed is None:
+            _feed = ChangeFeed(
+                interval=float(os.environ.get("CHANGE_FEED_POLL", "0.25")),
+            )
+        return _feed
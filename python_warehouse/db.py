@@ -1,24 +1,223 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
+from contextlib import closing, contextmanager
 from pathlib import Path
 from typing import Optional
 
+try:
+    from python_warehouse import metrics, profiling
+except ImportError:  # running the CLI from inside python_warehouse/
+    import metrics
+    import profiling
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that goes back to its pool on close().
+
+    Connections opened with pooling disabled have no pool and really close.
+    """
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records statement time and row counts in metrics, and
+    logs statements slower than the connection's slow_query threshold."""
+    kind = "empty"
+
+    def _timed(self, run, sql, parameters, plan_parameters):
+        self.kind = metrics.statement_kind(sql)
+        start = time.perf_counter()
+        try:
+            return run(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.record_query(self.kind, elapsed, self.rowcount)
+            threshold = self.connection.slow_query
+            if threshold is not None and elapsed >= threshold:
+                profiling.log_slow_query(
+                    self.connection, self.kind, sql, plan_parameters, elapsed
+                )
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # The rows are consumed by then, so there is nothing to plan with
+        return self._timed(super().executemany, sql, seq_of_parameters, None)
+
+    def fetchone(self):
+        row = super().fetchone()
+        metrics.record_rows(self.kind, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        metrics.record_rows(self.kind, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        metrics.record_rows(self.kind, len(rows))
+        return rows
+
+
+class TimedConnection(PooledConnection):
+    """Pooled connection whose statements all go through TimedCursor."""
+    slow_query = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _setting(name, default):
+    return os.environ.get(name, default)
+
+
+def apply_pragmas(conn):
+    # Applied once when a connection is opened; a pooled connection keeps
+    # them for its whole life. journal_mode=WAL is persisted in the file.
+    conn.execute(f"PRAGMA journal_mode={_setting('DB_JOURNAL_MODE', 'WAL')}")
+    conn.execute(f"PRAGMA synchronous={_setting('DB_SYNCHRONOUS', 'NORMAL')}")
+    conn.execute(f"PRAGMA busy_timeout={int(_setting('DB_BUSY_TIMEOUT_MS', '5000'))}")
+    conn.execute(f"PRAGMA mmap_size={int(_setting('DB_MMAP_SIZE', str(256 * 1024 * 1024)))}")
+    conn.execute(f"PRAGMA cache_size={int(_setting('DB_CACHE_SIZE', '-16000'))}")
+
+
+def open_connection(db_path, pool=None):
+    slow_query = profiling.slow_query_threshold()
+    timed = metrics.enabled() or slow_query is not None
+    conn = sqlite3.connect(
+        db_path,
+        factory=TimedConnection if timed else PooledConnection,
+        check_same_thread=False,
+    )
+    if timed:
+        conn.slow_query = slow_query
+    apply_pragmas(conn)
+    conn.pool = pool
+    return conn
+
+
+class ConnectionPool:
+    """Per-process pool of configured connections for one database file.
+
+    Idle connections are kept in a LIFO so the most recently used (warm)
+    connection is handed out first. A connection is owned by exactly one
+    thread between acquire() and release(), so they can be shared by the
+    threads of a worker.
+    """
+
+    def __init__(self, db_path, size):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return open_connection(self.db_path, pool=self)
+
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            sqlite3.Connection.close(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            sqlite3.Connection.close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _forget_pools():
+    # Connections must not cross a fork; each Gunicorn worker builds its own.
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
+
+
+def close_pools():
+    """Close this process's idle pooled connections, e.g. in a Gunicorn
+    master after preloading the app and before it forks workers."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
+
+
+def database_path():
+    return os.environ.get(
+        "DATABASE_NAME",
+        str((Path(__file__).parent.parent / "inventory.db").resolve()),
+    )
+
+
+def get_pool(db_path: Optional[str] = None):
+    if db_path is None:
+        db_path = database_path()
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            size = int(_setting("DB_POOL_SIZE", "8"))
+            pool = _pools[db_path] = ConnectionPool(db_path, size)
+        return pool
+
 
 def connect_db(db_path: Optional[str] = None):
     """Return a sqlite3 connection.
 
     If db_path is provided, use it. Otherwise read from env var DATABASE_NAME;
     if not set, default to a file 'inventory.db' in the project root.
+
+    Connections come from a per-process pool (size DB_POOL_SIZE, 0 disables
+    pooling) and already have the WAL/synchronous/busy_timeout/mmap/cache
+    pragmas applied. Calling close() returns the connection to the pool.
     """
-    if db_path is None:
-        db_path = os.environ.get(
-            "DATABASE_NAME",
-            str((Path(__file__).parent.parent / "inventory.db").resolve()),
-        )
-    return sqlite3.connect(db_path)
+    pool = get_pool(db_path)
+    if pool.size <= 0:
+        return open_connection(pool.db_path)
+    return pool.acquire()
 
 def init_db():
-    with connect_db() as conn:
+    """Create the schema and apply pending migrations.
+
+    A database that is already current costs one PRAGMA read and takes no
+    write lock, so every process can call this on startup.
+    """
+    with closing(connect_db()) as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+
+    with closing(connect_db()) as conn, conn:
         cursor = conn.cursor()
 
         # Warehouse table
@@ -58,9 +257,487 @@ def init_db():
                        INSERT OR IGNORE INTO warehouse (id, location_name, max_capacity, used_capacity)
                        VALUES (1, 'Main Warehouse', 1000, 0)
                        ''')
+        conn.commit()
+
+        # Indexes and every later schema change
+        migrate(conn)
+
+
+@contextmanager
+def immediate(conn):
+    """Run the block in a BEGIN IMMEDIATE transaction.
+
+    The write lock is taken up front, so reads inside the block cannot be
+    invalidated by another writer before the block commits.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# Schema migrations, oldest first. PRAGMA user_version holds the number of
+# migrations already applied, so each one runs exactly once per database.
+# Only ever append to this list.
+MIGRATIONS = [
+    # 1: indexes for the order queue, order history and warehouse lookups
+    [
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders (status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_email ON orders (email)",
+        "CREATE INDEX IF NOT EXISTS idx_products_warehouse ON products (warehouse_id)",
+    ],
+    # 2: stock per (product, warehouse). products.quantity stays the total;
+    # the triggers book every change to it against the product's warehouse.
+    [
+        """CREATE TABLE IF NOT EXISTS stock (
+               product_id INTEGER NOT NULL REFERENCES products(id),
+               warehouse_id INTEGER NOT NULL REFERENCES warehouse(id),
+               quantity INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (product_id, warehouse_id)
+           ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_stock_warehouse ON stock (warehouse_id)",
+        """INSERT OR IGNORE INTO stock (product_id, warehouse_id, quantity)
+           SELECT id, COALESCE(warehouse_id, 1), COALESCE(quantity, 0)
+           FROM products""",
+        """CREATE TRIGGER IF NOT EXISTS stock_product_insert
+           AFTER INSERT ON products
+           BEGIN
+               INSERT INTO stock (product_id, warehouse_id, quantity)
+               VALUES (NEW.id, COALESCE(NEW.warehouse_id, 1),
+                       COALESCE(NEW.quantity, 0))
+               ON CONFLICT (product_id, warehouse_id)
+               DO UPDATE SET quantity = quantity + excluded.quantity;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_product_quantity
+           AFTER UPDATE OF quantity ON products
+           WHEN COALESCE(NEW.quantity, 0) != COALESCE(OLD.quantity, 0)
+           BEGIN
+               INSERT INTO stock (product_id, warehouse_id, quantity)
+               VALUES (NEW.id, COALESCE(NEW.warehouse_id, 1),
+                       COALESCE(NEW.quantity, 0) - COALESCE(OLD.quantity, 0))
+               ON CONFLICT (product_id, warehouse_id)
+               DO UPDATE SET quantity = quantity + excluded.quantity;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_product_delete
+           AFTER DELETE ON products
+           BEGIN
+               DELETE FROM stock WHERE product_id = OLD.id;
+           END""",
+    ],
+    # 3: a write counter per table, bumped by triggers, so caches in any
+    # worker can tell whether a table changed with one primary-key lookup
+    [
+        """CREATE TABLE IF NOT EXISTS table_versions (
+               name TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           )""",
+        "INSERT OR IGNORE INTO table_versions (name) VALUES ('products'), ('warehouse')",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1
+                WHERE name = '{table}';
+            END"""
+        for table in ("products", "warehouse")
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ],
+    # 4: version orders as well, for API ETags
+    [
+        "INSERT OR IGNORE INTO table_versions (name) VALUES ('orders')",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS orders_version_{event.lower()}
+            AFTER {event} ON orders
+            BEGIN
+                UPDATE table_versions SET version = version + 1
+                WHERE name = 'orders';
+            END"""
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ],
+    # 5: how far each bulk import got, so an interrupted one can resume
+    [
+        """CREATE TABLE IF NOT EXISTS import_progress (
+               source TEXT PRIMARY KEY,
+               rows_done INTEGER NOT NULL DEFAULT 0,
+               finished INTEGER NOT NULL DEFAULT 0,
+               updated_at TEXT
+           )""",
+    ],
+    # 6: durable order queue. status goes pending -> queued -> processing ->
+    # processed, or back to queued on failure and dead after too many tries.
+    # lease_until (unix time) hides a claimed or backed-off order.
+    [
+        "ALTER TABLE orders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE orders ADD COLUMN lease_until REAL",
+        "ALTER TABLE orders ADD COLUMN last_error TEXT",
+        "ALTER TABLE orders ADD COLUMN created_at TEXT",
+        """CREATE TRIGGER IF NOT EXISTS orders_created_at
+           AFTER INSERT ON orders
+           WHEN NEW.created_at IS NULL
+           BEGIN
+               UPDATE orders SET created_at = datetime('now') WHERE id = NEW.id;
+           END""",
+    ],
+    # 7: one row per process that generated order ids; rowid picks the
+    # worker bits of its ids
+    [
+        """CREATE TABLE IF NOT EXISTS id_workers (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               pid INTEGER,
+               host TEXT,
+               claimed_at TEXT DEFAULT (datetime('now'))
+           )""",
+    ],
+    # 8: append-only ledger of stock movements between warehouses. The
+    # per-location balances live in stock and are updated in the same
+    # transaction as each ledger row.
+    [
+        """CREATE TABLE IF NOT EXISTS movements (
+               id INTEGER PRIMARY KEY,
+               product_id INTEGER NOT NULL REFERENCES products(id),
+               from_warehouse INTEGER REFERENCES warehouse(id),
+               to_warehouse INTEGER REFERENCES warehouse(id),
+               quantity INTEGER NOT NULL CHECK (quantity > 0),
+               moved_at TEXT NOT NULL DEFAULT (datetime('now'))
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_movements_product ON movements (product_id, id)",
+        "INSERT OR IGNORE INTO table_versions (name) VALUES ('stock'), ('movements')",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1
+                WHERE name = '{table}';
+            END"""
+        for table, events in (("stock", ("INSERT", "UPDATE", "DELETE")),
+                              ("movements", ("INSERT",)))
+        for event in events
+    ],
+    # 9: demand over a time window for the analytics reports
+    [
+        "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)",
+    ],
+    # 10: full-text index over product names for search and autocomplete.
+    # External content: the index stores only tokens and reads names back
+    # from products by rowid; the triggers keep it in step with the table.
+    [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5 (
+               name, content = 'products', content_rowid = 'id',
+               tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+           )""",
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+        """CREATE TRIGGER IF NOT EXISTS products_fts_insert
+           AFTER INSERT ON products
+           BEGIN
+               INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS products_fts_delete
+           AFTER DELETE ON products
+           BEGIN
+               INSERT INTO products_fts (products_fts, rowid, name)
+               VALUES ('delete', old.id, old.name);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS products_fts_rename
+           AFTER UPDATE OF name ON products
+           BEGIN
+               INSERT INTO products_fts (products_fts, rowid, name)
+               VALUES ('delete', old.id, old.name);
+               INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+           END""",
+    ],
+    # 11: low-stock alerts. A product is low when its quantity is at or
+    # below its reorder point; stock_alerts holds exactly the low products,
+    # maintained by triggers, so reading alerts never scans the catalog.
+    [
+        "ALTER TABLE products ADD COLUMN reorder_point INTEGER NOT NULL DEFAULT 0",
+        """CREATE TABLE IF NOT EXISTS stock_alerts (
+               product_id INTEGER PRIMARY KEY REFERENCES products(id),
+               quantity INTEGER NOT NULL,
+               reorder_point INTEGER NOT NULL,
+               raised_at TEXT NOT NULL DEFAULT (datetime('now'))
+           )""",
+        """INSERT OR IGNORE INTO stock_alerts (product_id, quantity, reorder_point)
+           SELECT id, COALESCE(quantity, 0), reorder_point FROM products
+           WHERE COALESCE(quantity, 0) <= reorder_point""",
+        """CREATE TRIGGER IF NOT EXISTS stock_alerts_insert
+           AFTER INSERT ON products
+           WHEN COALESCE(NEW.quantity, 0) <= NEW.reorder_point
+           BEGIN
+               INSERT OR REPLACE INTO stock_alerts (product_id, quantity, reorder_point)
+               VALUES (NEW.id, COALESCE(NEW.quantity, 0), NEW.reorder_point);
+           END""",
+        # Raised on crossing into low stock; while a product stays low only
+        # its row is refreshed, keeping the original raised_at
+        """CREATE TRIGGER IF NOT EXISTS stock_alerts_raise
+           AFTER UPDATE OF quantity, reorder_point ON products
+           WHEN COALESCE(NEW.quantity, 0) <= NEW.reorder_point
+           BEGIN
+               INSERT INTO stock_alerts (product_id, quantity, reorder_point)
+               VALUES (NEW.id, COALESCE(NEW.quantity, 0), NEW.reorder_point)
+               ON CONFLICT (product_id) DO UPDATE SET
+                   quantity = excluded.quantity,
+                   reorder_point = excluded.reorder_point;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_alerts_clear
+           AFTER UPDATE OF quantity, reorder_point ON products
+           WHEN COALESCE(NEW.quantity, 0) > NEW.reorder_point
+                AND COALESCE(OLD.quantity, 0) <= OLD.reorder_point
+           BEGIN
+               DELETE FROM stock_alerts WHERE product_id = NEW.id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_alerts_delete
+           AFTER DELETE ON products
+           BEGIN
+               DELETE FROM stock_alerts WHERE product_id = OLD.id;
+           END""",
+        # Order velocity of one product, for reorder suggestions
+        "CREATE INDEX IF NOT EXISTS idx_orders_product_created "
+        "ON orders (product COLLATE NOCASE, created_at)",
+    ],
+    # 12: change feed for /events. Triggers append a small JSON delta per
+    # stock or order change; each worker tails it from the last id it has
+    # seen and old rows are trimmed (see migration 15).
+    [
+        """CREATE TABLE IF NOT EXISTS change_feed (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               kind TEXT NOT NULL,
+               data TEXT NOT NULL
+           )""",
+        """CREATE TRIGGER IF NOT EXISTS change_feed_product_insert
+           AFTER INSERT ON products
+           BEGIN
+               INSERT INTO change_feed (kind, data) VALUES ('product', json_object(
+                   'id', NEW.id, 'name', NEW.name, 'quantity', NEW.quantity));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_feed_product_update
+           AFTER UPDATE OF name, quantity ON products
+           WHEN NEW.quantity IS NOT OLD.quantity OR NEW.name IS NOT OLD.name
+           BEGIN
+               INSERT INTO change_feed (kind, data) VALUES ('product', json_object(
+                   'id', NEW.id, 'name', NEW.name, 'quantity', NEW.quantity));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_feed_product_delete
+           AFTER DELETE ON products
+           BEGIN
+               INSERT INTO change_feed (kind, data) VALUES ('product', json_object(
+                   'id', OLD.id, 'name', OLD.name, 'deleted', json('true')));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_feed_order_insert
+           AFTER INSERT ON orders
+           BEGIN
+               INSERT INTO change_feed (kind, data) VALUES ('order', json_object(
+                   'id', NEW.id, 'product', NEW.product,
+                   'quantity', NEW.quantity, 'status', NEW.status));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_feed_order_status
+           AFTER UPDATE OF status ON orders
+           WHEN NEW.status IS NOT OLD.status
+           BEGIN
+               INSERT INTO change_feed (kind, data) VALUES ('order', json_object(
+                   'id', NEW.id, 'product', NEW.product,
+                   'quantity', NEW.quantity, 'status', NEW.status));
+           END""",
+    ],
+    # 13: results of recent mutating requests by Idempotency-Key, so a
+    # retried request is answered from here instead of being applied again.
+    # status is NULL while the first request is still running.
+    [
+        """CREATE TABLE IF NOT EXISTS idempotency_keys (
+               key TEXT PRIMARY KEY,
+               fingerprint TEXT NOT NULL,
+               created_at REAL NOT NULL,
+               status INTEGER,
+               headers TEXT,
+               body BLOB
+           ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_created "
+        "ON idempotency_keys (created_at)",
+    ],
+    # 14: stock history. Every change to a stock balance is logged as a
+    # delta in stock_events; stock_snapshots holds, per snapshot run, the
+    # balances that changed since the previous run (see history.py). Run 1
+    # is the state at the time of this migration.
+    [
+        """CREATE TABLE IF NOT EXISTS stock_events (
+               id INTEGER PRIMARY KEY,
+               product_id INTEGER NOT NULL,
+               warehouse_id INTEGER NOT NULL,
+               delta INTEGER NOT NULL,
+               at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+           )""",
+        # A product's changes in an id range, across all its warehouses
+        "CREATE INDEX IF NOT EXISTS idx_stock_events_product "
+        "ON stock_events (product_id, id)",
+        """CREATE TABLE IF NOT EXISTS snapshot_runs (
+               id INTEGER PRIMARY KEY,
+               taken_at TEXT NOT NULL,
+               last_event_id INTEGER NOT NULL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_snapshot_runs_taken ON snapshot_runs (taken_at)",
+        """CREATE TABLE IF NOT EXISTS stock_snapshots (
+               product_id INTEGER NOT NULL,
+               warehouse_id INTEGER NOT NULL,
+               run_id INTEGER NOT NULL,
+               quantity INTEGER NOT NULL,
+               PRIMARY KEY (product_id, warehouse_id, run_id)
+           ) WITHOUT ROWID""",
+        """INSERT INTO snapshot_runs (id, taken_at, last_event_id)
+           VALUES (1, strftime('%Y-%m-%d %H:%M:%f', 'now'), 0)""",
+        """INSERT INTO stock_snapshots (product_id, warehouse_id, run_id, quantity)
+           SELECT product_id, warehouse_id, 1, quantity FROM stock""",
+        """CREATE TRIGGER IF NOT EXISTS stock_events_insert
+           AFTER INSERT ON stock
+           WHEN NEW.quantity != 0
+           BEGIN
+               INSERT INTO stock_events (product_id, warehouse_id, delta)
+               VALUES (NEW.product_id, NEW.warehouse_id, NEW.quantity);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_events_update
+           AFTER UPDATE OF quantity ON stock
+           WHEN NEW.quantity != OLD.quantity
+           BEGIN
+               INSERT INTO stock_events (product_id, warehouse_id, delta)
+               VALUES (NEW.product_id, NEW.warehouse_id,
+                       NEW.quantity - OLD.quantity);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_events_delete
+           AFTER DELETE ON stock
+           WHEN OLD.quantity != 0
+           BEGIN
+               INSERT INTO stock_events (product_id, warehouse_id, delta)
+               VALUES (OLD.product_id, OLD.warehouse_id, -OLD.quantity);
+           END""",
+    ],
+    # 15: trim change_feed as it is written, whether or not anyone is
+    # listening on /events: every 1000th row drops those 10000 or more
+    # behind it, so the table never holds more than 11000 rows
+    [
+        """DELETE FROM change_feed
+           WHERE id <= (SELECT MAX(id) FROM change_feed) - 10000""",
+        """CREATE TRIGGER IF NOT EXISTS change_feed_trim
+           AFTER INSERT ON change_feed
+           WHEN NEW.id % 1000 = 0
+           BEGIN
+               DELETE FROM change_feed WHERE id <= NEW.id - 10000;
+           END""",
+    ],
+    # 16: id_workers becomes one row per worker id (0-1023), leased by a
+    # process until its heartbeat (unix time) is too old, so ids freed by
+    # exited processes are reused instead of wrapping onto live ones
+    [
+        "DROP TABLE IF EXISTS id_workers",
+        """CREATE TABLE id_workers (
+               slot INTEGER PRIMARY KEY,
+               pid INTEGER,
+               host TEXT,
+               heartbeat REAL NOT NULL DEFAULT 0
+           )""",
+        """WITH RECURSIVE slots (slot) AS (
+               SELECT 0 UNION ALL SELECT slot + 1 FROM slots WHERE slot < 1023
+           )
+           INSERT INTO id_workers (slot) SELECT slot FROM slots""",
+    ],
+    # 17: log a product's move to another home warehouse in change_feed
+    # too, so the product cache sees every column it holds change
+    [
+        """CREATE TRIGGER IF NOT EXISTS change_feed_product_moved
+           AFTER UPDATE OF warehouse_id ON products
+           WHEN NEW.warehouse_id IS NOT OLD.warehouse_id
+           BEGIN
+               INSERT INTO change_feed (kind, data) VALUES ('product', json_object(
+                   'id', NEW.id, 'name', NEW.name, 'quantity', NEW.quantity,
+                   'warehouse_id', NEW.warehouse_id));
+           END""",
+    ],
+    # 18: warehouse.used_capacity is the sum of the warehouse's stock
+    # balances, kept so by triggers whichever path writes the stock. Each
+    # trigger fires exactly when the stock_events ones do, so every event
+    # is one used_capacity update (the capacity engine relies on this).
+    [
+        """UPDATE warehouse SET used_capacity = COALESCE(
+               (SELECT SUM(quantity) FROM stock WHERE warehouse_id = warehouse.id), 0)""",
+        """CREATE TRIGGER IF NOT EXISTS stock_capacity_insert
+           AFTER INSERT ON stock
+           WHEN NEW.quantity != 0
+           BEGIN
+               UPDATE warehouse SET used_capacity = COALESCE(used_capacity, 0) + NEW.quantity
+               WHERE id = NEW.warehouse_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_capacity_update
+           AFTER UPDATE OF quantity ON stock
+           WHEN NEW.quantity != OLD.quantity
+           BEGIN
+               UPDATE warehouse SET used_capacity = COALESCE(used_capacity, 0)
+                   + NEW.quantity - OLD.quantity
+               WHERE id = NEW.warehouse_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS stock_capacity_delete
+           AFTER DELETE ON stock
+           WHEN OLD.quantity != 0
+           BEGIN
+               UPDATE warehouse SET used_capacity = COALESCE(used_capacity, 0) - OLD.quantity
+               WHERE id = OLD.warehouse_id;
+           END""",
+    ],
+    # 19: row counts of the paginated tables, kept by INSERT and DELETE
+    # triggers, so listing totals survive updates without a COUNT(*).
+    # (Nothing writes these tables with INSERT OR REPLACE, whose deletes
+    # would not fire the triggers.)
+    [
+        """CREATE TABLE IF NOT EXISTS row_counts (
+               name TEXT PRIMARY KEY,
+               count INTEGER NOT NULL
+           )""",
+    ] + [
+        statement
+        for table in ("products", "warehouse", "orders")
+        for statement in (
+            f"""INSERT OR REPLACE INTO row_counts (name, count)
+                SELECT '{table}', COUNT(*) FROM {table}""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_count_insert
+                AFTER INSERT ON {table}
+                BEGIN
+                    UPDATE row_counts SET count = count + 1 WHERE name = '{table}';
+                END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_count_delete
+                AFTER DELETE ON {table}
+                BEGIN
+                    UPDATE row_counts SET count = count - 1 WHERE name = '{table}';
+                END""",
+        )
+    ],
+]
+
+
+def table_version(conn, name):
+    """Return the write counter of a versioned table (see migration 3)."""
+    row = conn.execute(
+        "SELECT version FROM table_versions WHERE name = ?", (name,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def migrate(conn):
+    """Apply pending MIGRATIONS and return the resulting schema version.
+
+    Each migration runs in its own IMMEDIATE transaction together with the
+    user_version bump, so concurrent workers cannot apply one twice.
+    """
+    while True:
+        with immediate(conn):
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return version
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
 
 def clear_inventory_and_orders():
-    with connect_db() as conn:
+    with closing(connect_db()) as conn:
         cursor = conn.cursor()
 
         # Delete all records from all tables
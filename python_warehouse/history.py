@@ -0,0 +1,230 @@
+"""Point-in-time stock: snapshots, compaction and as-of queries.
+
+    python history.py snapshot
+    python history.py compact --keep-days 90
+    python history.py as-of "Widget" --warehouse "Main Warehouse" --at 2024-05-07
+
+Every change to a stock balance is logged as a delta in stock_events by
+the triggers of migration 14. A snapshot run records, for each
+(product, warehouse) balance that changed since the previous run, its
+value at the run's last event. To answer "stock of X as of T", the
+balance is read from the last snapshot row at or before T, and only the
+events logged after that run, up to T, are added. Take a snapshot
+regularly (daily from cron, say) to keep that replay short.
+
+compact deletes events older than the newest snapshot run before the
+cut-off. As-of queries for times before that run then see the state of
+the latest snapshot at or before them, rather than every change.
+"""
+import argparse
+import sys
+from datetime import date, datetime, time, timedelta, timezone
+
+try:
+    from python_warehouse.db import connect_db, immediate
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import connect_db, immediate
+
+
+def format_time(moment):
+    """A datetime as stored in stock_events.at and snapshot_runs.taken_at
+    (UTC, millisecond precision, sorts as text)."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime("%Y-%m-%d %H:%M:%S.") + f"{moment.microsecond // 1000:03d}"
+
+
+def parse_as_of(text):
+    """Parse an ISO 8601 date or time. A bare date, in any form (2026-01-01
+    or 20260101), means the end of that day; times without an offset are
+    taken as UTC."""
+    text = text.strip()
+    try:
+        return format_time(datetime.combine(date.fromisoformat(text), time.max))
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Not an ISO 8601 date or time: {text!r}") from None
+    return format_time(moment)
+
+
+def take_snapshot(conn, taken_at=None, last_event_id=None):
+    """Record a snapshot run and return (run id, balances written).
+
+    Only the balances changed by events since the previous run are
+    written, each as its previous snapshot value plus the summed deltas.
+    taken_at and last_event_id default to now and the newest event; both
+    can be given to build history after the fact.
+    """
+    with immediate(conn):
+        _, previous = conn.execute(
+            "SELECT id, last_event_id FROM snapshot_runs ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if last_event_id is None:
+            last_event_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM stock_events"
+            ).fetchone()[0]
+        run_id = conn.execute(
+            "INSERT INTO snapshot_runs (taken_at, last_event_id) VALUES (?, ?)",
+            (taken_at or format_time(datetime.now(timezone.utc)),
+             max(last_event_id, previous)),
+        ).lastrowid
+        written = conn.execute(
+            "INSERT INTO stock_snapshots (product_id, warehouse_id, run_id, quantity) "
+            "SELECT e.product_id, e.warehouse_id, ?, e.delta + COALESCE(("
+            "  SELECT s.quantity FROM stock_snapshots s "
+            "  WHERE s.product_id = e.product_id AND s.warehouse_id = e.warehouse_id "
+            "  ORDER BY s.run_id DESC LIMIT 1), 0) "
+            "FROM (SELECT product_id, warehouse_id, SUM(delta) AS delta "
+            "      FROM stock_events WHERE id > ? AND id <= ? "
+            "      GROUP BY product_id, warehouse_id) e",
+            (run_id, previous, last_event_id),
+        ).rowcount
+    return run_id, written
+
+
+def compact(conn, keep_days):
+    """Delete events older than the newest snapshot run taken more than
+    keep_days ago; returns how many were deleted."""
+    cutoff = format_time(datetime.now(timezone.utc) - timedelta(days=keep_days))
+    with immediate(conn):
+        row = conn.execute(
+            "SELECT last_event_id FROM snapshot_runs WHERE taken_at <= ? "
+            "ORDER BY taken_at DESC LIMIT 1",
+            (cutoff,),
+        ).fetchone()
+        if row is None:
+            return 0
+        return conn.execute(
+            "DELETE FROM stock_events WHERE id <= ?", (row[0],)
+        ).rowcount
+
+
+def _snapshot_warehouses(conn, product_id, run_id):
+    """Warehouses with a snapshot row for the product, one index seek each
+    rather than a scan of every run."""
+    warehouses = []
+    warehouse_id = -1
+    while True:
+        row = conn.execute(
+            "SELECT warehouse_id FROM stock_snapshots "
+            "WHERE product_id = ? AND warehouse_id > ? AND run_id <= ? "
+            "ORDER BY warehouse_id LIMIT 1",
+            (product_id, warehouse_id, run_id),
+        ).fetchone()
+        if row is None:
+            return warehouses
+        warehouse_id = row[0]
+        warehouses.append(warehouse_id)
+
+
+def stock_as_of(conn, product_id, as_of, warehouse_id=None):
+    """{warehouse_id: quantity} of a product at `as_of` (see format_time),
+    or None if as_of is before stock history began.
+
+    Warehouses that held none of the product at that time are left out.
+    """
+    run = conn.execute(
+        "SELECT id, last_event_id FROM snapshot_runs WHERE taken_at <= ? "
+        "ORDER BY taken_at DESC LIMIT 1",
+        (as_of,),
+    ).fetchone()
+    if run is None:
+        return None
+    run_id, first_event = run
+    # Events past the next run all happened after as_of
+    following = conn.execute(
+        "SELECT last_event_id FROM snapshot_runs WHERE taken_at > ? "
+        "ORDER BY taken_at LIMIT 1",
+        (as_of,),
+    ).fetchone()
+    last_event = following[0] if following else sys.maxsize
+
+    warehouses = (
+        [warehouse_id] if warehouse_id is not None
+        else _snapshot_warehouses(conn, product_id, run_id)
+    )
+    balances = {}
+    for warehouse in warehouses:
+        row = conn.execute(
+            "SELECT quantity FROM stock_snapshots "
+            "WHERE product_id = ? AND warehouse_id = ? AND run_id <= ? "
+            "ORDER BY run_id DESC LIMIT 1",
+            (product_id, warehouse, run_id),
+        ).fetchone()
+        if row is not None:
+            balances[warehouse] = row[0]
+    # A balance changed after its last snapshot row only by events after
+    # this run; had it changed earlier, a later run would hold a row for it
+    for warehouse, delta in conn.execute(
+        "SELECT warehouse_id, SUM(delta) FROM stock_events "
+        "WHERE product_id = ? AND id > ? AND id <= ? AND at <= ? "
+        "GROUP BY warehouse_id",
+        (product_id, first_event, last_event, as_of),
+    ):
+        if warehouse_id is None or warehouse == warehouse_id:
+            balances[warehouse] = balances.get(warehouse, 0) + delta
+    return {w: q for w, q in sorted(balances.items()) if q}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("snapshot", help="Record a snapshot of changed balances")
+    comp = sub.add_parser("compact", help="Delete events covered by old snapshots")
+    comp.add_argument("--keep-days", type=int, default=90)
+    asof = sub.add_parser("as-of", help="Stock of a product at a past time")
+    asof.add_argument("product", help="product name")
+    asof.add_argument("--warehouse", help="warehouse name (default: all)")
+    asof.add_argument("--at", required=True, help="ISO 8601 date or time, UTC")
+    args = parser.parse_args(argv)
+
+    conn = connect_db()
+    try:
+        if args.command == "snapshot":
+            run_id, written = take_snapshot(conn)
+            print(f"Snapshot {run_id}: {written} balances changed")
+        elif args.command == "compact":
+            print(f"Deleted {compact(conn, args.keep_days)} events")
+        else:
+            print_as_of(conn, args.product, args.warehouse, args.at)
+    finally:
+        conn.close()
+
+
+def print_as_of(conn, product, warehouse, at):
+    """Look names up and print a product's stock at a past time."""
+    try:
+        as_of = parse_as_of(at)
+    except ValueError as exc:
+        print(exc)
+        return
+    row = conn.execute(
+        "SELECT id FROM products WHERE name = ?", (product,)
+    ).fetchone()
+    if row is None:
+        print("Item is not available in inventory!")
+        return
+    names = dict(conn.execute("SELECT id, location_name FROM warehouse"))
+    warehouse_id = None
+    if warehouse:
+        ids = {name: wid for wid, name in names.items()}
+        if warehouse not in ids:
+            print(f"Unknown warehouse {warehouse!r}")
+            return
+        warehouse_id = ids[warehouse]
+    balances = stock_as_of(conn, row[0], as_of, warehouse_id)
+    if balances is None:
+        print(f"No stock history before {as_of}")
+        return
+    print(f"\n--- {product.upper()} AS OF {as_of} UTC ---")
+    for wid, quantity in balances.items():
+        print(f"{names.get(wid, f'Warehouse {wid}')}: {quantity}")
+    if not balances:
+        print("None in stock")
+
+
+if __name__ == "__main__":
+    main()
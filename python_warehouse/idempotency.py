@@ -0,0 +1,147 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+StoredResponse = namedtuple("StoredResponse", "status headers body")
+
+PURGE_EVERY = 60.0
+
+
+class KeyMismatch(Exception):
+    """The key was already used for a different request."""
+
+
+class KeyInProgress(Exception):
+    """The first request with this key has not finished yet."""
+
+
+class KeyAbandoned(KeyInProgress):
+    """The first request with this key never recorded a result, so whether
+    it was applied is unknown."""
+
+
+def key_ttl():
+    """IDEMPOTENCY_TTL: seconds a result is kept for replays (default 1 day)."""
+    return float(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+
+
+def max_keys():
+    """IDEMPOTENCY_MAX_KEYS: the newest keys kept once there are more."""
+    return int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "100000"))
+
+
+def lock_seconds():
+    """IDEMPOTENCY_LOCK_SECONDS: how long an unfinished claim counts as
+    still running.
+
+    A request that has held its key this long has died (Gunicorn kills a
+    worker after its 30s timeout), possibly after its changes committed
+    but before complete() recorded the result. Such a key is never taken
+    over: retries get KeyAbandoned until the claim expires with the TTL.
+    """
+    return float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+
+def claim(conn, key, fingerprint, wait=5.0, poll=0.05):
+    """Claim `key` for a request about to run.
+
+    Returns None when the caller now owns the key and should run the
+    request, then record its result with complete() (or give the key up
+    with release() if it wrote nothing). Returns the StoredResponse when a
+    request with this key already ran. A concurrent duplicate waits up to
+    `wait` seconds for the first one to finish before KeyInProgress is
+    raised, or KeyAbandoned at once when the claim is older than
+    lock_seconds(); reusing a key for a request with another fingerprint
+    raises KeyMismatch.
+
+    The claim is a single INSERT on the primary key, so of any number of
+    simultaneous requests with one key exactly one runs.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        now = time.time()
+        with conn:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND created_at < ?",
+                (key, now - key_ttl()),
+            )
+            claimed = conn.execute(
+                "INSERT INTO idempotency_keys (key, fingerprint, created_at) "
+                "VALUES (?, ?, ?) ON CONFLICT (key) DO NOTHING",
+                (key, fingerprint, now),
+            ).rowcount
+        if claimed:
+            maybe_purge(conn, now)
+            return None
+        row = conn.execute(
+            "SELECT fingerprint, created_at, status, headers, body "
+            "FROM idempotency_keys WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            # Released or purged in between; try to claim it again
+            continue
+        stored_fingerprint, created_at, status, headers, body = row
+        if stored_fingerprint != fingerprint:
+            raise KeyMismatch(key)
+        if status is not None:
+            return StoredResponse(status, json.loads(headers), body)
+        if created_at < now - lock_seconds():
+            raise KeyAbandoned(key)
+        if time.monotonic() >= deadline:
+            raise KeyInProgress(key)
+        time.sleep(poll)
+
+
+def complete(conn, key, status, headers, body):
+    """Record the result of the request that claimed `key`."""
+    with conn:
+        conn.execute(
+            "UPDATE idempotency_keys SET status = ?, headers = ?, body = ? "
+            "WHERE key = ?",
+            (status, json.dumps(headers), body, key),
+        )
+
+
+def release(conn, key):
+    """Give up an unfinished claim, so a retry runs the request again.
+
+    Only safe when the request wrote nothing: a release after its changes
+    committed lets the retry apply them a second time.
+    """
+    with conn:
+        conn.execute(
+            "DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL",
+            (key,),
+        )
+
+
+_purged = 0.0
+
+
+def maybe_purge(conn, now):
+    global _purged
+    if now - _purged >= PURGE_EVERY:
+        _purged = now
+        purge(conn, now)
+
+
+def purge(conn, now=None):
+    """Drop results older than the TTL, then all but the newest max_keys.
+
+    Both deletes walk the created_at index from the oldest end.
+    """
+    now = time.time() if now is None else now
+    with conn:
+        expired = conn.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ?",
+            (now - key_ttl(),),
+        ).rowcount
+        overflow = conn.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ("
+            "SELECT created_at FROM idempotency_keys "
+            "ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+            (max_keys() - 1,),
+        ).rowcount
+    return expired + overflow
@@ -1,116 +1,91 @@
-from collections import defaultdict
-from db import connect_db
-
-# Product <> Quantity storage
-class HashTable:
-    def __init__(self):
-        self.map = defaultdict(int)
-
-    # Overrides the inventory with a set amount
-    # could possibly be used for new warehouses adding a base inventory
-    def set(self, key, value):
-        self.map[key] = value
-
-    def get(self, key):
-        return self.map.get(key, 0)
-
-    # Restocking
-    def increment(self, key, amount = 1):
-        self.map[key] += amount
-
-    def remove_stock(self, key, quantity):
-        self.map[key] -= quantity
-
-# Product <> Product_ID storage
+from contextlib import closing
+
+try:
+    from python_warehouse.capacity import get_capacity_engine
+    from python_warehouse.db import connect_db, immediate, table_version
+    from python_warehouse.stock_index import StockIndex
+except ImportError:  # running the CLI from inside python_warehouse/
+    from capacity import get_capacity_engine
+    from db import connect_db, immediate, table_version
+    from stock_index import StockIndex
+
+# Product <> Product_ID and Product <> Quantity storage
 class Inventory:
     def __init__(self):
-        self.product_list = {}
-        self.hash_table = HashTable()
+        self.stock = StockIndex()
         self.next_product_id = 1
+        # products write counter as of the last full load
+        self.loaded_version = None
         self.load_products_from_db()
 
     def load_products_from_db(self):
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, id, quantity FROM products")
-        for name, pid, qty in cursor.fetchall():
-            name = name.lower()
-            self.product_list[name] = pid
-            self.hash_table.set(name, qty)
-            if pid >= self.next_product_id:
-                self.next_product_id = pid + 1
-        conn.close()
+        with closing(connect_db()) as conn:
+            self.loaded_version = table_version(conn, "products")
+            self.stock.reload(conn)
+        self.next_product_id = max(self.next_product_id, self.stock.max_id() + 1)
 
     # Adds a new product and product id.
     # Can also handle restocking.
     def add_product(self, product_name):
         conn = connect_db()
         cursor = conn.cursor()
+        engine = get_capacity_engine()
 
-        # Fetch warehouse capacity
-        cursor.execute("SELECT max_capacity, used_capacity FROM warehouse "
-                       "WHERE id = 1")
-        warehouse = cursor.fetchone()
-        if not warehouse:
+        if not engine.utilization(conn):
             print("Warehouse not initialized.")
-            return
-        max_cap, used = warehouse
-
-        quantity = int(input("How much would you like to add? "))
-        if used + quantity > max_cap:
-            print("Not enough space in the warehouse to add this product.")
             conn.close()
             return
 
+        quantity = int(input("How much would you like to add? "))
         product_name = product_name.lower()
 
-        if product_name not in self.product_list:
-            product_id = self.next_product_id
-            self.next_product_id += 1
-            self.product_list[product_name] = product_id
-            self.hash_table.set(product_name, quantity)
-
-            cursor.execute(
-                "INSERT INTO products (id, name, quantity, warehouse_id) "
-                "VALUES (?, ?, ?, 1)",
-                (product_id, product_name, quantity)
-            )
-        else:
-            self.hash_table.increment(product_name, quantity)
-            cursor.execute(
-                "UPDATE products SET quantity = quantity + ? WHERE name = ?",
-                (quantity, product_name)
-            )
-
-        # Update used warehouse space
-        cursor.execute("UPDATE warehouse SET used_capacity = used_capacity + ? "
-                       "WHERE id = 1", (quantity,))
-
-        conn.commit()
-        conn.close()
+        try:
+            with immediate(conn):
+                # Restocks go to the product's warehouse, new products to
+                # the warehouse that fits them best
+                if product_name in self.stock:
+                    cursor.execute("SELECT warehouse_id FROM products WHERE name = ?",
+                                   (product_name,))
+                    row = cursor.fetchone()
+                    warehouse_id = row[0] if row and row[0] else 1
+                else:
+                    warehouse_id = engine.pick(quantity, conn)
+
+                if warehouse_id is None or not engine.has_room(warehouse_id, quantity, conn):
+                    print("Not enough space in the warehouse to add this product.")
+                    return
+
+                # The stock triggers book the used capacity
+                if product_name not in self.stock:
+                    product_id = self.next_product_id
+                    cursor.execute(
+                        "INSERT INTO products (id, name, quantity, warehouse_id) "
+                        "VALUES (?, ?, ?, ?)",
+                        (product_id, product_name, quantity, warehouse_id)
+                    )
+                    self.next_product_id += 1
+                    self.stock.add(product_name, product_id, quantity)
+                else:
+                    cursor.execute(
+                        "UPDATE products SET quantity = quantity + ? WHERE name = ?",
+                        (quantity, product_name)
+                    )
+                    self.stock.increment(product_name, quantity)
+        finally:
+            conn.close()
 
     def get(self):
-        return self.product_list
+        return self.stock.ids()
 
     def get_inventory(self):
-        conn = connect_db()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id, name, quantity FROM products")
-        rows = cursor.fetchall()
-
-        # Clear current state
-        self.product_list.clear()
-        self.hash_table.map.clear()
-
-        for prod_id, name, quantity in rows:
-            name = name.lower()
-            self.product_list[name] = prod_id
-            self.hash_table.set(name, quantity)
-
-        conn.close()
+        # Only reload when some process wrote to products since last time
+        with closing(connect_db()) as conn:
+            version = table_version(conn, "products")
+            if version != self.loaded_version:
+                self.stock.reload(conn)
+                self.loaded_version = version
 
         return {
-            "Products: ": self.product_list,
-            "Quantities: ": dict(self.hash_table.map)
-        }
\ No newline at end of file
+            "Products: ": self.stock.ids(),
+            "Quantities: ": self.stock.quantities(),
+        }
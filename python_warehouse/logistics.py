@@ -0,0 +1,210 @@
+from collections import namedtuple
+
+try:
+    from python_warehouse.capacity import get_capacity_engine
+    from python_warehouse.db import connect_db, immediate
+except ImportError:  # running the CLI from inside python_warehouse/
+    from capacity import get_capacity_engine
+    from db import connect_db, immediate
+
+# rows: newest first; older / newer: cursors for the neighbouring pages
+HistoryPage = namedtuple("HistoryPage", "rows older newer limit")
+
+
+class MovementError(Exception):
+    pass
+
+
+def _warehouse_id(conn, name):
+    if name is None:
+        return None
+    row = conn.execute(
+        "SELECT id FROM warehouse WHERE location_name = ?", (name,)
+    ).fetchone()
+    if row is None:
+        raise MovementError(f"Unknown warehouse {name!r}")
+    return row[0]
+
+
+def _take(conn, product_id, warehouse_id, quantity):
+    taken = conn.execute(
+        "UPDATE stock SET quantity = quantity - ? "
+        "WHERE product_id = ? AND warehouse_id = ? AND quantity >= ?",
+        (quantity, product_id, warehouse_id, quantity),
+    ).rowcount
+    if not taken:
+        raise MovementError("Not enough stock at the source warehouse")
+
+
+def _put(conn, product_id, warehouse_id, quantity):
+    conn.execute(
+        "INSERT INTO stock (product_id, warehouse_id, quantity) VALUES (?, ?, ?) "
+        "ON CONFLICT (product_id, warehouse_id) "
+        "DO UPDATE SET quantity = quantity + excluded.quantity",
+        (product_id, warehouse_id, quantity),
+    )
+
+
+def move_stock(product, from_location, to_location, quantity, conn=None):
+    """Move stock of a product and record it in the ledger.
+
+    Either location may be None: no source is a receipt of new stock into
+    to_location, no destination is stock leaving from_location. The balance
+    rows in stock, products.quantity and the ledger row are all written in
+    one BEGIN IMMEDIATE transaction, so the balances always match the
+    ledger; the stock triggers book the warehouses' used capacity. Returns
+    the movement id.
+    """
+    if quantity <= 0:
+        raise MovementError("Quantity must be positive")
+    if from_location == to_location:
+        raise MovementError("Source and destination must differ")
+
+    engine = get_capacity_engine()
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_db()
+    try:
+        with immediate(conn):
+            row = conn.execute(
+                "SELECT id, COALESCE(warehouse_id, 1) FROM products WHERE name = ?",
+                (product,),
+            ).fetchone()
+            if row is None:
+                raise MovementError(f"Unknown product {product!r}")
+            product_id, home = row
+            source = _warehouse_id(conn, from_location)
+            target = _warehouse_id(conn, to_location)
+            if target is not None and not engine.has_room(target, quantity, conn):
+                raise MovementError("Not enough space in the destination warehouse")
+
+            # products.quantity changes are booked against the home
+            # warehouse by trigger, so receipts and dispatches pass through it
+            if source is None:
+                conn.execute(
+                    "UPDATE products SET quantity = quantity + ? WHERE id = ?",
+                    (quantity, product_id),
+                )
+                if target != home:
+                    _take(conn, product_id, home, quantity)
+                    _put(conn, product_id, target, quantity)
+            elif target is None:
+                # Taken even when the source is home, to check its balance
+                _take(conn, product_id, source, quantity)
+                _put(conn, product_id, home, quantity)
+                left = conn.execute(
+                    "UPDATE products SET quantity = quantity - ? "
+                    "WHERE id = ? AND quantity >= ?",
+                    (quantity, product_id, quantity),
+                ).rowcount
+                if not left:
+                    raise MovementError("Not enough stock of this product")
+            else:
+                _take(conn, product_id, source, quantity)
+                _put(conn, product_id, target, quantity)
+
+            return conn.execute(
+                "INSERT INTO movements (product_id, from_warehouse, to_warehouse, "
+                "quantity) VALUES (?, ?, ?, ?)",
+                (product_id, source, target, quantity),
+            ).lastrowid
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def rehome(conn, product_id, warehouse_id):
+    """Make warehouse_id a product's home warehouse, moving the stock held
+    at its old home along with it.
+
+    Runs in the caller's transaction, which should be BEGIN IMMEDIATE.
+    The move is recorded in the ledger like any other; returns its id, or
+    None when nothing had to move.
+    """
+    row = conn.execute(
+        "SELECT COALESCE(warehouse_id, 1) FROM products WHERE id = ?",
+        (product_id,),
+    ).fetchone()
+    if row is None or row[0] == warehouse_id:
+        return None
+    home = row[0]
+    if conn.execute(
+        "SELECT 1 FROM warehouse WHERE id = ?", (warehouse_id,)
+    ).fetchone() is None:
+        raise MovementError(f"Unknown warehouse id {warehouse_id!r}")
+    conn.execute(
+        "UPDATE products SET warehouse_id = ? WHERE id = ?",
+        (warehouse_id, product_id),
+    )
+    held = conn.execute(
+        "SELECT quantity FROM stock WHERE product_id = ? AND warehouse_id = ?",
+        (product_id, home),
+    ).fetchone()
+    if held is None or held[0] <= 0:
+        return None
+    quantity = held[0]
+    if not get_capacity_engine().has_room(warehouse_id, quantity, conn):
+        raise MovementError("Not enough space in the destination warehouse")
+    _take(conn, product_id, home, quantity)
+    _put(conn, product_id, warehouse_id, quantity)
+    return conn.execute(
+        "INSERT INTO movements (product_id, from_warehouse, to_warehouse, "
+        "quantity) VALUES (?, ?, ?, ?)",
+        (product_id, home, warehouse_id, quantity),
+    ).lastrowid
+
+
+def stock_by_warehouse(conn):
+    """[(warehouse, units stored, capacity)] for every warehouse.
+
+    Units stored is used_capacity, the sum of the warehouse's balances
+    kept by trigger (migration 18), so this reads one row per warehouse
+    however many products there are. One product's balances are
+    product_stock.
+    """
+    return conn.execute(
+        "SELECT location_name, COALESCE(used_capacity, 0), "
+        "COALESCE(max_capacity, 0) FROM warehouse ORDER BY location_name"
+    ).fetchall()
+
+
+def product_stock(conn, product_id):
+    """[(warehouse, quantity)] for one product's non-zero balances."""
+    return conn.execute(
+        "SELECT w.location_name, s.quantity FROM stock s "
+        "JOIN warehouse w ON w.id = s.warehouse_id "
+        "WHERE s.product_id = ? AND s.quantity != 0 ORDER BY w.location_name",
+        (product_id,),
+    ).fetchall()
+
+
+def history_page(conn, before=None, after=None, limit=50):
+    """One page of the movement ledger, newest first, by keyset on id."""
+    query = (
+        "SELECT m.id, p.name, f.location_name, t.location_name, m.quantity, "
+        "m.moved_at FROM movements m "
+        "LEFT JOIN products p ON p.id = m.product_id "
+        "LEFT JOIN warehouse f ON f.id = m.from_warehouse "
+        "LEFT JOIN warehouse t ON t.id = m.to_warehouse "
+    )
+    if after is not None:
+        rows = conn.execute(
+            query + "WHERE m.id > ? ORDER BY m.id LIMIT ?", (after, limit + 1)
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        return HistoryPage(rows, rows[-1][0] if rows else None,
+                           rows[0][0] if rows and more else None, limit)
+
+    if before is None:
+        rows = conn.execute(
+            query + "ORDER BY m.id DESC LIMIT ?", (limit + 1,)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            query + "WHERE m.id < ? ORDER BY m.id DESC LIMIT ?", (before, limit + 1)
+        ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return HistoryPage(rows, rows[-1][0] if rows and more else None,
+                       rows[0][0] if rows and before is not None else None, limit)
@@ -1,17 +1,21 @@
+from alerts import low_stock, set_reorder_point
 from db import connect_db, init_db, clear_inventory_and_orders
-from inventory import Inventory, HashTable
-from order_numbers import unique_order_id_generator, order_id
+from history import print_as_of
+from inventory import Inventory
+from notifications import send_invoice, stop_notifier
 from order_queue import Queue, ProcessQueue
+from ordering import InsufficientStock, UnknownProduct, place_order
+from product_cache import get_product_cache
 
 init_db()
 
 conn = connect_db()
 cursor = conn.cursor()
 
-quantity = HashTable()
 products = Inventory()
 orders = Queue()
-process = ProcessQueue(orders)
+process = ProcessQueue(orders, handler=send_invoice)
+product_cache = get_product_cache()
 
 customer = False
 employee = False
@@ -52,8 +56,8 @@ while customer:
     if not customer:
         break
 
-    cursor.execute("SELECT quantity FROM products WHERE name = ?", (name,))
-    result = cursor.fetchone()
+    # (id, quantity, warehouse_id) or None
+    result = product_cache.get(name)
 
     if result:
         while True:
@@ -74,24 +78,9 @@ while customer:
         if not customer:
             print("Please select a valid quantity!")
             break
-        stock = result[0]
+        stock = result[1]
 
         if stock >= amount:
-            new_stock = stock - amount
-
-            # Update product quantity
-            cursor.execute(
-                "UPDATE products SET quantity = ? WHERE name = ?",
-                (new_stock, name)
-            )
-
-            # Update warehouse used_capacity
-            cursor.execute(
-                "UPDATE warehouse SET used_capacity = used_capacity - ? WHERE id = 1",
-                (amount,)
-            )
-
-            # Generate or retrieve order ID
             while True:
                 email = input("Order EMAIL: \n")
                 index = email.find('@')
@@ -100,33 +89,24 @@ while customer:
                 else:
                     print("Please enter a valid email address!\n")
 
-            if email not in order_id:
-                order_num = unique_order_id_generator(email)
-            if email == '0':
-                print("Canceling operation!")
-                customer = False
-                break
-            else:
-                order_num = order_id[email]
-        # if not customer:
-        #     break
-        #     print(f"\nOrder Successful!")
+            # Stock is checked again and reserved atomically with the order
+            # insert, so a concurrent order cannot oversell it.
+            try:
+                order_num = place_order(name, amount, email)
+            except InsufficientStock:
+                print("Item is out of stock or insufficient quantity available!\n")
+                continue
+            except UnknownProduct:
+                # Deleted since it was looked up
+                print("Item is not available in inventory!\n")
+                continue
+
             print(f"\nOrder ID: {order_num}")
             print(f"Product: {name}")
             print(f"Quantity: {amount}\n")
             print("Invoices will be sent to your email once the order is processed!\n")
 
-            cursor.execute(
-                "INSERT INTO orders (id, product, quantity, email, status) "
-                "VALUES (?, ?, ?, ?, ?)",
-                (order_num, name, amount, email, 'pending')
-            )
-
-            conn.commit()
-
-            # Place order in queue
-            orders.set_order(order_num, product=name, amount=amount)
-            process.add_order_in_queue(order_num)
+            # place_order has already queued it
             conn.close()
             customer = False
 
@@ -145,6 +125,8 @@ while employee:
         "4 - Exit console\n"
         "5 - Space optimization report\n"
         "6 - Would you like to clear all orders and inventory and start fresh?\n"
+        "7 - Low stock alerts and reorder points\n"
+        "8 - Stock of a product at a past date\n"
     ))
 
     if options == 1:
@@ -179,16 +161,17 @@ while employee:
         conn.close()
 
     elif options == 3:
-        if process.processing_queue:
+        if process.depth():
             process.process_order()
-            print("Order invoice sent to customer email. "
-                  "Order complete and notification"
-                  " sent to accounting!\n")
+            print("Order complete. The invoice is being sent "
+                  "to the customer's email.\n")
         else:
             print("No orders in the queue to process.\n")
 
     elif options == 4:
         print("Exiting employee console...\n")
+        # Deliver invoices for the orders processed in this session
+        stop_notifier()
         break
 
     elif options == 5:
@@ -204,5 +187,38 @@ while employee:
         else:
             print("Operation canceled!\n")
 
+    elif options == 7:
+        conn = connect_db()
+        alerts = low_stock(conn)
+        print("\n--- LOW STOCK ---")
+        if alerts:
+            for alert in alerts:
+                print(f"{alert.name}: {alert.quantity} on hand "
+                      f"(reorder point {alert.reorder_point}) | "
+                      f"{alert.daily_demand}/day | reorder {alert.suggested}")
+        else:
+            print("No products are at or below their reorder point.")
+
+        product_name = input("\nProduct to change its reorder point "
+                             "(press Enter to go back): ").strip()
+        if product_name:
+            point = input("New reorder point: ").strip()
+            if not point.isdigit():
+                print("Invalid input. Please enter a valid number!\n")
+            elif set_reorder_point(conn, product_name, int(point)):
+                print(f"Reorder point of {product_name} set to {point}.\n")
+            else:
+                print("Item is not available in inventory!\n")
+        conn.close()
+
+    elif options == 8:
+        product_name = input("Product name: ").strip()
+        warehouse_name = input("Warehouse (press Enter for all): ").strip()
+        when = input("Date or time, UTC (e.g. 2024-05-07 or "
+                     "2024-05-07T14:30): ").strip()
+        conn = connect_db()
+        print_as_of(conn, product_name, warehouse_name or None, when)
+        conn.close()
+
     else:
         print("Please select a valid option.\n")
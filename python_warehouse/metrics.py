@@ -0,0 +1,206 @@
+import bisect
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_request_duration_seconds": "Time spent serving a request",
+    "sqlite_query_duration_seconds": "Time spent executing one statement",
+    "sqlite_rows_total": "Rows fetched or written by statements",
+}
+
+
+def enabled():
+    return os.environ.get("METRICS_ENABLED", "1") != "0"
+
+
+def metrics_dir():
+    """Directory shared by all worker processes, or None for one process."""
+    return os.environ.get("METRICS_DIR") or None
+
+
+class Registry:
+    """Counters and histograms of this process.
+
+    Labels are passed as a tuple of (name, value) pairs. Under Gunicorn each
+    worker dumps its registry to METRICS_DIR/<pid>.json (see flush()) and a
+    scrape adds the files of all workers together.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        # name -> labels -> [per-bucket counts..., +Inf count, sum]
+        self.histograms = {}
+        self._flushed = 0.0
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            buckets = series.get(labels)
+            if buckets is None:
+                buckets = series[labels] = [0] * (len(BUCKETS) + 2)
+            # Index len(BUCKETS) is the +Inf bucket
+            buckets[bisect.bisect_left(BUCKETS, value)] += 1
+            buckets[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": {
+                    name: [[list(labels), value] for labels, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [[list(labels), list(buckets)]
+                           for labels, buckets in series.items()]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def flush(self, every=1.0):
+        """Write this process's snapshot to METRICS_DIR, at most once per
+        `every` seconds. Files are replaced atomically so a scrape never
+        reads half of one."""
+        directory = metrics_dir()
+        now = time.monotonic()
+        if directory is None or now - self._flushed < every:
+            return
+        self._flushed = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as fp:
+            json.dump(self.snapshot(), fp)
+        os.replace(f"{path}.tmp", path)
+
+
+registry = Registry()
+
+
+def _reset_registry():
+    # A forked worker starts counting from zero under its own pid
+    global registry
+    registry = Registry()
+
+
+os.register_at_fork(after_in_child=_reset_registry)
+
+
+@lru_cache(maxsize=1024)
+def statement_kind(sql):
+    """The leading keyword of a statement, used as its `op` label."""
+    word = sql.lstrip().split(None, 1)
+    return word[0].lower() if word else "empty"
+
+
+def record_query(kind, seconds, rows):
+    labels = (("op", kind),)
+    registry.observe("sqlite_query_duration_seconds", labels, seconds)
+    if rows > 0:
+        registry.inc("sqlite_rows_total", labels, rows)
+
+
+def record_rows(kind, rows):
+    if rows:
+        registry.inc("sqlite_rows_total", (("op", kind),), rows)
+
+
+def collect():
+    """Snapshots of every worker: the files in METRICS_DIR, or just this
+    process when there is no shared directory."""
+    directory = metrics_dir()
+    if directory is None:
+        return [registry.snapshot()]
+    registry.flush(every=0)
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as fp:
+                snapshots.append(json.load(fp))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def clear_metrics_dir():
+    """Remove the dumps of a previous run; call once before workers start."""
+    directory = metrics_dir()
+    if directory is None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith((".json", ".tmp")):
+            os.remove(os.path.join(directory, name))
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, series in snapshot.get("counters", {}).items():
+            merged = counters.setdefault(name, {})
+            for labels, value in series:
+                key = tuple(map(tuple, labels))
+                merged[key] = merged.get(key, 0) + value
+        for name, series in snapshot.get("histograms", {}).items():
+            merged = histograms.setdefault(name, {})
+            for labels, buckets in series:
+                key = tuple(map(tuple, labels))
+                total = merged.setdefault(key, [0] * len(buckets))
+                for n, value in enumerate(buckets):
+                    total[n] += value
+    return counters, histograms
+
+
+def _labels(pairs, extra=()):
+    pairs = (*pairs, *extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render(snapshots, gauges=()):
+    """Prometheus text exposition of merged `snapshots` plus `gauges`, an
+    iterable of (name, help, [(labels, value)])."""
+    counters, histograms = _merge(snapshots)
+    lines = []
+    for name in sorted(counters):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(counters[name].items()):
+            lines.append(f"{name}{_labels(labels)} {value}")
+    for name in sorted(histograms):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, buckets in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), buckets):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(bound)
+                lines.append(
+                    f"{name}_bucket{_labels(labels, (('le', le),))} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(labels)} {buckets[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    for name, help_text, samples in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,377 @@
+import asyncio
+import os
+import queue
+import smtplib
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from email.message import EmailMessage
+
+try:
+    from python_warehouse.order_queue import print_order
+except ImportError:  # running the CLI from inside python_warehouse/
+    from order_queue import print_order
+
+# One order waiting to be mailed; attempts counts failed sends so far
+Notice = namedtuple("Notice", "order_id product quantity email attempts")
+# What one batch did, kept for the last BATCH_HISTORY batches
+Batch = namedtuple("Batch", "size sent failed seconds finished_at")
+
+BATCH_HISTORY = 100
+
+
+def _setting(name, default, kind=str):
+    return kind(os.environ.get(name, default))
+
+
+def render_invoice(notice, sender):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = notice.email
+    message["Subject"] = f"Invoice for order {notice.order_id}"
+    message.set_content(
+        f"Thank you for your order!\n\n"
+        f"Order ID: {notice.order_id}\n"
+        f"Product:  {notice.product}\n"
+        f"Quantity: {notice.quantity}\n\n"
+        f"Corollary Warehousing\n"
+    )
+    return message
+
+
+class SMTPPool:
+    """A few SMTP sessions kept open and reused across batches.
+
+    Sending is blocking, so batches are handed to a worker thread; each
+    batch holds one session for all of its messages. A session the server
+    dropped is replaced on the next batch.
+    """
+
+    def __init__(self, host, port, size=2, username=None, password=None,
+                 starttls=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _open(self):
+        session = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            session.starttls()
+        if self.username:
+            session.login(self.username, self.password or "")
+        return session
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            session = None
+        if session is not None:
+            try:
+                session.noop()
+                return session
+            except (OSError, smtplib.SMTPException):
+                session.close()
+        return self._open()
+
+    def send_batch(self, messages):
+        """Send `messages` on one session.
+
+        Returns (rejected, failed): messages the server refused outright,
+        which are not worth retrying, and ones that hit a transient error.
+        """
+        try:
+            session = self._acquire()
+        except (OSError, smtplib.SMTPException):
+            self._slots.release()
+            raise
+        rejected = []
+        failed = []
+        healthy = True
+        try:
+            for n, message in enumerate(messages):
+                try:
+                    session.send_message(message)
+                except smtplib.SMTPRecipientsRefused:
+                    rejected.append(message)
+                except (OSError, smtplib.SMTPException):
+                    # The session is gone; everything not yet sent failed
+                    failed.extend(messages[n:])
+                    healthy = False
+                    break
+        finally:
+            if healthy:
+                self._idle.put(session)
+            else:
+                session.close()
+            self._slots.release()
+        return rejected, failed
+
+    def close(self):
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                session.quit()
+            except (OSError, smtplib.SMTPException):
+                session.close()
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` messages per second, in bursts of up
+    to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self, count=1):
+        if self.rate <= 0:
+            return
+        count = min(count, self.capacity)
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= count:
+                self._tokens -= count
+                return
+            await asyncio.sleep((count - self._tokens) / self.rate)
+
+
+class Notifier:
+    """Mails order invoices from an asyncio loop on a background thread.
+
+    notify() only hands the order to the loop and returns, so neither a web
+    request nor an order worker ever waits on SMTP. The loop collects up to
+    batch_size notices (waiting at most batch_wait seconds for a batch to
+    fill), waits for the rate limiter and sends the batch over a pooled
+    session. Messages that hit a transient error are retried with
+    exponential backoff up to max_retries times; after that, or when the
+    server refuses the recipient, they are counted as failed.
+
+    Notices only live in memory: ones still queued when the process exits
+    are lost, but the order itself is already processed.
+    """
+
+    def __init__(self, pool, sender, batch_size=20, batch_wait=0.5, rate=10.0,
+                 max_retries=3, queue_size=10000):
+        self.pool = pool
+        self.sender = sender
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.limiter = RateLimiter(rate, burst=batch_size)
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.batches = deque(maxlen=BATCH_HISTORY)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self._main(),), name="notifier",
+            daemon=True,
+        )
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self, timeout=None):
+        """Send what is already queued, then stop the loop.
+
+        Messages still waiting to be retried are abandoned.
+        """
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._queue.put(None), self._loop)
+        self._thread.join(timeout)
+        self._thread = None
+        self.pool.close()
+
+    def notify(self, order_id, product, quantity, email):
+        """Queue an invoice; never blocks. Returns False when not running."""
+        if self._thread is None:
+            return False
+        self._loop.call_soon_threadsafe(
+            self._offer, Notice(order_id, product, quantity, email, 0)
+        )
+        with self._lock:
+            self.accepted += 1
+        return True
+
+    def _offer(self, notice):
+        try:
+            self._queue.put_nowait(notice)
+        except asyncio.QueueFull:
+            with self._lock:
+                self.dropped += 1
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._started.set()
+        retries = set()
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._send(batch, retries)
+        # Retries still waiting out their backoff are given up on
+        for task in list(retries):
+            task.cancel()
+
+    async def _collect(self):
+        """Wait for one notice, then take more for up to batch_wait."""
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = self._loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                notice = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if notice is None:
+                return batch, True
+            batch.append(notice)
+        return batch, False
+
+    async def _send(self, batch, retries):
+        await self.limiter.acquire(len(batch))
+        messages = [render_invoice(notice, self.sender) for notice in batch]
+        notice_of = {id(m): notice for m, notice in zip(messages, batch)}
+        started = time.perf_counter()
+        try:
+            rejected, failed = await asyncio.to_thread(
+                self.pool.send_batch, messages
+            )
+        except (OSError, smtplib.SMTPException):
+            traceback.print_exc()
+            rejected, failed = [], messages
+        failed_notices = [notice_of[id(m)] for m in failed]
+        unsent = len(rejected) + len(failed)
+
+        with self._lock:
+            self.sent += len(batch) - unsent
+            self.failed += len(rejected)
+            self.batches.append(Batch(
+                len(batch), len(batch) - unsent, unsent,
+                time.perf_counter() - started, time.time(),
+            ))
+            for notice in failed_notices:
+                if notice.attempts >= self.max_retries:
+                    self.failed += 1
+                else:
+                    self.retried += 1
+        for notice in failed_notices:
+            if notice.attempts < self.max_retries:
+                task = asyncio.create_task(self._retry(notice))
+                retries.add(task)
+                task.add_done_callback(retries.discard)
+
+    async def _retry(self, notice):
+        await asyncio.sleep(2 ** notice.attempts)
+        self._offer(notice._replace(attempts=notice.attempts + 1))
+
+    def stats(self):
+        with self._lock:
+            batches = list(self.batches)
+            stats = {
+                "accepted": self.accepted,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "dropped": self.dropped,
+                "queued": self._queue.qsize() if self._queue else 0,
+                "batches": len(batches),
+            }
+        if batches:
+            stats["avg_batch_size"] = sum(b.size for b in batches) / len(batches)
+            stats["avg_batch_seconds"] = (
+                sum(b.seconds for b in batches) / len(batches)
+            )
+            stats["last_batch"] = batches[-1]._asdict()
+        return stats
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def _reset_notifier():
+    # The loop thread does not survive a fork
+    global _notifier, _notifier_lock
+    _notifier = None
+    _notifier_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_notifier)
+
+
+def get_notifier():
+    """The per-process notifier, started on first use.
+
+    Configured by SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD,
+    SMTP_STARTTLS, MAIL_FROM, NOTIFY_BATCH_SIZE, NOTIFY_BATCH_WAIT,
+    NOTIFY_RATE (messages per second, 0 for no limit), NOTIFY_RETRIES and
+    NOTIFY_SMTP_POOL.
+    """
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            pool = SMTPPool(
+                _setting("SMTP_HOST", "localhost"),
+                _setting("SMTP_PORT", "25", int),
+                size=_setting("NOTIFY_SMTP_POOL", "2", int),
+                username=os.environ.get("SMTP_USER"),
+                password=os.environ.get("SMTP_PASSWORD"),
+                starttls=os.environ.get("SMTP_STARTTLS") == "1",
+            )
+            _notifier = Notifier(
+                pool,
+                _setting("MAIL_FROM", "invoices@corollary-warehousing.example"),
+                batch_size=_setting("NOTIFY_BATCH_SIZE", "20", int),
+                batch_wait=_setting("NOTIFY_BATCH_WAIT", "0.5", float),
+                rate=_setting("NOTIFY_RATE", "10", float),
+                max_retries=_setting("NOTIFY_RETRIES", "3", int),
+            ).start()
+        return _notifier
+
+
+def send_invoice(job):
+    """Order worker handler: process the order and queue its invoice."""
+    print_order(job)
+    get_notifier().notify(job.id, job.product, job.quantity, job.email)
+
+
+def stop_notifier(timeout=10):
+    """Flush and stop this process's notifier, if it was ever started."""
+    with _notifier_lock:
+        notifier = _notifier
+    if notifier is not None:
+        notifier.stop(timeout)
@@ -1,15 +1,172 @@
-import random
-import string
+import os
+import socket
+import threading
+import time
 
-order_id = {}
+try:
+    from python_warehouse.db import connect_db
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import connect_db
 
-def random_string_generator(size= 5, chars=string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
+# Order ids are 63-bit integers laid out as
+#   milliseconds since EPOCH_MS | worker (10 bits) | sequence (12 bits)
+# so they sort by creation time and never collide between processes.
+# They are stored zero-padded to 19 digits so TEXT order matches numeric
+# order and inserts into the orders primary key always append.
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ID_DIGITS = 19
 
 
-def unique_order_id_generator(email):
-    while True:
-        order_new_id = random_string_generator()
-        if order_new_id not in order_id:
-            order_id[email] = order_new_id
-            return order_new_id
\ No newline at end of file
+# A process holds its worker id for WORKER_LEASE_SECONDS after its last
+# heartbeat, and heartbeats when it takes ids RENEW_SECONDS or more after
+# the previous heartbeat. An id whose holder stopped heartbeating (it
+# exited, or sat idle past the lease) can be claimed by another process.
+WORKER_LEASE_SECONDS = 600.0
+RENEW_SECONDS = 60.0
+
+
+class NoWorkerId(RuntimeError):
+    """Every worker id is leased by a live process."""
+
+
+class WorkerLease:
+    """This process's lease on one row of id_workers.
+
+    current() returns the worker id to put in new ids. While the lease is
+    fresh that needs no database access; otherwise the lease is renewed,
+    or, if another process has taken the id over meanwhile, a new one is
+    claimed. A lease is only taken over once it has expired, and the
+    holder never hands out ids from an expired lease without renewing it
+    first, so two live processes never share an id. ORDER_WORKER_ID
+    overrides the lease.
+    """
+
+    def __init__(self):
+        self.worker_id = None
+        self._renewed = 0.0
+        self._fixed = os.environ.get("ORDER_WORKER_ID")
+
+    def current(self):
+        if self._fixed is not None:
+            return int(self._fixed) & MAX_WORKER
+        now = time.time()
+        if now - self._renewed >= RENEW_SECONDS:
+            self._renew(now)
+        return self.worker_id
+
+    def _renew(self, now):
+        me = (os.getpid(), socket.gethostname())
+        conn = connect_db()
+        try:
+            with conn:
+                renewed = self.worker_id is not None and conn.execute(
+                    "UPDATE id_workers SET heartbeat = ? "
+                    "WHERE slot = ? AND pid = ? AND host = ?",
+                    (now, self.worker_id, *me),
+                ).rowcount
+                if not renewed:
+                    # The longest-idle expired id, to keep the gap since
+                    # its previous holder's last id as large as possible
+                    row = conn.execute(
+                        "UPDATE id_workers SET pid = ?, host = ?, heartbeat = ? "
+                        "WHERE slot = (SELECT slot FROM id_workers "
+                        "WHERE heartbeat < ? ORDER BY heartbeat LIMIT 1) "
+                        "RETURNING slot",
+                        (*me, now, now - WORKER_LEASE_SECONDS),
+                    ).fetchone()
+                    if row is None:
+                        raise NoWorkerId(
+                            f"All {MAX_WORKER + 1} order worker ids are in use")
+                    self.worker_id = row[0]
+        finally:
+            conn.close()
+        self._renewed = now
+
+
+class IdGenerator:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._ms = 0
+        self._sequence = -1
+
+    def allocate(self, count):
+        """Reserve `count` consecutive ids for this worker.
+
+        Needs no database access. If the sequence for the current
+        millisecond runs out, the generator borrows the next millisecond
+        instead of sleeping. The same happens if the clock steps back, so
+        ids never go backwards.
+        """
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                now = int(time.time() * 1000) - EPOCH_MS
+                if now > self._ms:
+                    self._ms, self._sequence = now, -1
+                take = min(count - len(ids), MAX_SEQUENCE - self._sequence)
+                if take == 0:
+                    self._ms, self._sequence = self._ms + 1, -1
+                    continue
+                base = (self._ms << (WORKER_BITS + SEQUENCE_BITS)) | (
+                    self.worker_id << SEQUENCE_BITS)
+                first = self._sequence + 1
+                ids.extend(base | seq for seq in range(first, first + take))
+                self._sequence += take
+        return ids
+
+    def next_id(self):
+        return self.allocate(1)[0]
+
+    def switch_worker(self, worker_id):
+        """Use another worker id from now on. Ids continue from the next
+        millisecond, so they still never go backwards."""
+        with self._lock:
+            self.worker_id = worker_id
+            self._ms, self._sequence = self._ms + 1, -1
+
+
+def format_order_id(value):
+    return f"{value:0{ID_DIGITS}d}"
+
+
+_lease = WorkerLease()
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def _reset_generator():
+    # A forked child must claim its own worker bits
+    global _lease, _generator, _generator_lock
+    _lease = WorkerLease()
+    _generator = None
+    _generator_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_generator)
+
+
+def get_generator():
+    """This process's generator, its worker id lease renewed when due.
+    Claiming or renewing the lease is a write, so call this outside any
+    open write transaction."""
+    global _generator
+    with _generator_lock:
+        worker_id = _lease.current()
+        if _generator is None:
+            _generator = IdGenerator(worker_id)
+        elif worker_id != _generator.worker_id:
+            _generator.switch_worker(worker_id)
+        return _generator
+
+
+def next_order_id():
+    return format_order_id(get_generator().next_id())
+
+
+def allocate_order_ids(count):
+    return [format_order_id(value) for value in get_generator().allocate(count)]
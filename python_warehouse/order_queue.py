@@ -1,77 +1,310 @@
-from collections import deque
-from db import connect_db
+"""Durable order queue in the orders table, and the workers that drain it.
 
-class Queue:
-    def __init__(self):
-        self.by_order = {}
+    python -m python_warehouse.order_queue --workers 4
+
+runs order workers in the foreground until SIGTERM or Ctrl-C, mailing an
+invoice for each processed order. Gunicorn also starts ORDER_WORKERS of
+them in every web worker (see gunicorn.conf.py); set it to 0 when this
+command runs them instead.
+"""
+import argparse
+import signal
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import Future
+
+try:
+    from python_warehouse.db import connect_db, immediate, init_db
+    from python_warehouse.write_batcher import get_write_batcher
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import connect_db, immediate, init_db
+    from write_batcher import get_write_batcher
+
+Job = namedtuple("Job", "id product quantity email attempts")
 
+# Seconds a claimed order stays hidden from other workers before it is
+# considered abandoned and handed out again
+LEASE_SECONDS = 30
+MAX_ATTEMPTS = 5
+
+
+def _submit(sql, params=()):
+    """Start one status update; the returned Future resolves with its
+    rowcount once committed.
+
+    Goes through the write batcher when one is configured, so updates from
+    concurrent workers share a commit. Otherwise the update is committed
+    before this returns.
+    """
+    batcher = get_write_batcher()
+    if batcher is not None:
+        return batcher.execute(sql, params)
+    future = Future()
+    conn = connect_db()
+    try:
+        with conn:
+            future.set_result(conn.execute(sql, params).rowcount)
+    finally:
+        conn.close()
+    return future
+
+
+def _execute(sql, params=()):
+    return _submit(sql, params).result()
+
+
+# Order <> Product storage, kept in the orders table itself
+class Queue:
     def get_order(self):
-        return self.by_order
+        conn = connect_db()
+        try:
+            rows = conn.execute(
+                "SELECT id, product, quantity FROM orders "
+                "WHERE status = 'queued' ORDER BY id"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {order_id: {product: amount} for order_id, product, amount in rows}
 
     def get_product(self, order_id):
-        return self.by_order.get(order_id, None)
+        conn = connect_db()
+        try:
+            row = conn.execute(
+                "SELECT product, quantity FROM orders "
+                "WHERE id = ? AND status IN ('queued', 'processing')",
+                (order_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        return {row[0]: row[1]} if row else None
+
+    # Queues a placed order. product and amount are already on the order row.
+    def set_order(self, order_id, product=None, amount=None):
+        return enqueue(order_id)
+
+    def remove(self, order_id):
+        return _execute(
+            "UPDATE orders SET status = 'pending', lease_until = NULL "
+            "WHERE id = ? AND status = 'queued'",
+            (order_id,),
+        ) > 0
+
+
+def enqueue(order_id):
+    """Move a pending order into the queue.
 
-    def set_order(self, order_id, product, amount):
-        if order_id not in self.by_order:
-            self.by_order[order_id] = {}
-        self.by_order[order_id][product] = amount
+    A primary-key update guarded on status, so queueing an order twice is a
+    no-op and needs no scan. Returns True if the order was newly queued.
+    """
+    return _execute(
+        "UPDATE orders SET status = 'queued', lease_until = NULL "
+        "WHERE id = ? AND status = 'pending'",
+        (order_id,),
+    ) > 0
 
+
+def claim(batch_size=1, lease_seconds=LEASE_SECONDS, conn=None):
+    """Atomically take up to batch_size queued orders, oldest id first.
+
+    Claimed orders are marked 'processing' with a lease; an order whose
+    lease runs out (its worker died) becomes claimable again.
+    """
+    own_conn = conn is None
+    if own_conn:
         conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE orders SET status = ? WHERE id = ?",
-            ("queued", order_id)
-        )
-        conn.commit()
+    now = time.time()
+    try:
+        with immediate(conn):
+            # Leases that ran out belong to workers that died mid-order
+            conn.execute(
+                "UPDATE orders SET status = CASE WHEN attempts >= ? "
+                "THEN 'dead' ELSE 'queued' END, "
+                "last_error = COALESCE(last_error, 'lease expired') "
+                "WHERE status = 'processing' AND lease_until < ?",
+                (MAX_ATTEMPTS, now),
+            )
+            rows = conn.execute(
+                "UPDATE orders SET status = 'processing', lease_until = ?, "
+                "attempts = attempts + 1 "
+                "WHERE id IN (SELECT id FROM orders WHERE status = 'queued' "
+                "AND (lease_until IS NULL OR lease_until <= ?) "
+                "ORDER BY id LIMIT ?) "
+                "RETURNING id, product, quantity, email, attempts",
+                (now + lease_seconds, now, batch_size),
+            ).fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+    return sorted((Job(*row) for row in rows), key=lambda job: job.id)
+
+
+def complete_later(order_id):
+    """Mark an order processed without waiting for the commit; returns a
+    Future of the rowcount."""
+    return _submit(
+        "UPDATE orders SET status = 'processed', lease_until = NULL, "
+        "last_error = NULL WHERE id = ? AND status = 'processing'",
+        (order_id,),
+    )
+
+
+def complete(order_id):
+    return complete_later(order_id).result() > 0
+
+
+def fail(order_id, error, max_attempts=MAX_ATTEMPTS):
+    """Requeue a failed order with exponential backoff, or dead-letter it
+    once it has used up max_attempts."""
+    _execute(
+        "UPDATE orders SET last_error = ?, "
+        "status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'queued' END, "
+        "lease_until = CASE WHEN attempts >= ? THEN NULL "
+        "ELSE ? + (1 << MIN(attempts, 10)) END "
+        "WHERE id = ? AND status = 'processing'",
+        (str(error), max_attempts, max_attempts, time.time(), order_id),
+    )
+
+
+def depth():
+    """Count of orders waiting or in flight, by status."""
+    conn = connect_db()
+    try:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM orders "
+            "WHERE status IN ('queued', 'processing', 'dead') GROUP BY status"
+        ).fetchall()
+    finally:
         conn.close()
+    return {"queued": 0, "processing": 0, "dead": 0, **dict(rows)}
+
+
+def print_order(job):
+    order_data = {job.product: job.quantity}
+    print(f"Processing Order {job.id}: {order_data}")
 
-    def remove(self, order_id):
-        if order_id in self.by_order:
-            del self.by_order[order_id]
-            return True
-        return False
 
 class ProcessQueue:
-    def __init__(self, order_queue):
+    # Nothing is loaded at startup: queued orders are read from the
+    # database when they are claimed.
+    def __init__(self, order_queue, handler=print_order):
         self.order_queue = order_queue
-        self.processing_queue = deque()
-
-        # Load queued orders from DB
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, product, quantity FROM orders WHERE status = 'queued'")
-        for order_id, product, amount in cursor.fetchall():
-            # Rebuild in-memory queue
-            self.order_queue.set_order(order_id, product, amount)
-            self.processing_queue.append((order_id, {product: amount}))
-        conn.close()
+        self.handler = handler
 
     def add_order_in_queue(self, order_id):
-        order = self.order_queue.get_product(order_id)
-        if order and not any(o[0] == order_id for o in self.processing_queue):
-            self.processing_queue.append((order_id, order))
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE orders SET status = ? WHERE id = ?",
-                ("queued", order_id)
-            )
-            conn.commit()
-            conn.close()
-            return True
-        return False
+        return enqueue(order_id)
+
+    def depth(self):
+        return depth()["queued"]
 
     def process_order(self):
-        if self.processing_queue:
-            order_id, order_data = self.processing_queue.popleft()
-            print(f"Processing Order {order_id}: {order_data}")
-            self.order_queue.remove(order_id)
+        jobs = claim(1)
+        if not jobs:
+            return False
+        run_job(self.handler, jobs[0])
+        return True
 
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE orders SET status = 'processed' WHERE id = ?", (order_id,))
 
-            conn.commit()
-            conn.close()
-            return True
-        return False
\ No newline at end of file
+def run_job(handler, job, wait=True):
+    """Run handler(job) and record the outcome.
+
+    With wait=False a successful job's completion is left in flight and its
+    Future returned, so a worker can finish a whole batch of jobs before
+    waiting on one shared commit; a failed job returns None.
+    """
+    try:
+        handler(job)
+    except Exception as exc:
+        traceback.print_exc()
+        fail(job.id, exc)
+        return False if wait else None
+    future = complete_later(job.id)
+    if not wait:
+        return future
+    future.result()
+    return True
+
+
+class WorkerPool:
+    """Background threads that claim and process orders concurrently.
+
+    Each worker claims up to batch_size orders at a time and sleeps for
+    poll_interval when the queue is empty. Safe to run in several processes
+    at once, as claims are atomic.
+    """
+
+    def __init__(self, handler=print_order, workers=4, batch_size=10,
+                 lease_seconds=LEASE_SECONDS, poll_interval=0.5):
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"order-worker-{n}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                jobs = claim(self.batch_size, self.lease_seconds)
+            except Exception:
+                traceback.print_exc()
+                jobs = []
+            if not jobs:
+                self._stop.wait(self.poll_interval)
+                continue
+            completions = [run_job(self.handler, job, wait=False)
+                           for job in jobs]
+            for future in completions:
+                if future is not None:
+                    future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Process queued orders and mail their invoices"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    args = parser.parse_args(argv)
+    try:
+        from python_warehouse.notifications import send_invoice, stop_notifier
+    except ImportError:  # running the CLI from inside python_warehouse/
+        from notifications import send_invoice, stop_notifier
+
+    init_db()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    pool = WorkerPool(
+        send_invoice, workers=args.workers, batch_size=args.batch_size,
+        poll_interval=args.poll_interval,
+    ).start()
+    print(f"{args.workers} order workers running; Ctrl-C to stop")
+    try:
+        stopping.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        stop_notifier()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+try:
+    from python_warehouse.db import connect_db, immediate
+    from python_warehouse.logistics import _put, _take
+    from python_warehouse.order_numbers import next_order_id
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import connect_db, immediate
+    from logistics import _put, _take
+    from order_numbers import next_order_id
+
+
+class OrderError(Exception):
+    pass
+
+
+class UnknownProduct(OrderError):
+    pass
+
+
+class InsufficientStock(OrderError):
+    pass
+
+
+def _sources(conn, product_id, home, amount):
+    """[(warehouse_id, quantity)] to ship `amount` from: the home warehouse
+    first, then the fullest others, never more than a location holds."""
+    rows = conn.execute(
+        "SELECT warehouse_id, quantity FROM stock "
+        "WHERE product_id = ? AND quantity > 0 "
+        "ORDER BY warehouse_id != ?, quantity DESC",
+        (product_id, home),
+    ).fetchall()
+    sources = []
+    for warehouse_id, held in rows:
+        if amount <= 0:
+            break
+        taken = min(held, amount)
+        sources.append((warehouse_id, taken))
+        amount -= taken
+    if amount > 0:
+        return None
+    return sources
+
+
+def place_order(product, amount, email, order_id=None, conn=None):
+    """Reserve `amount` of `product` and record the order atomically.
+
+    Runs reserve_order in its own BEGIN IMMEDIATE transaction. Returns the
+    order id. Raises UnknownProduct or InsufficientStock and leaves the
+    database untouched when the order cannot be filled.
+    """
+    if order_id is None:
+        # Before BEGIN: taking an id may claim or renew this process's
+        # worker id lease
+        order_id = next_order_id()
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_db()
+    try:
+        with immediate(conn):
+            reserve_order(conn, product, amount, email, order_id)
+    finally:
+        if own_conn:
+            conn.close()
+    return order_id
+
+
+def reserve_order(conn, product, amount, email, order_id):
+    """Take the stock for an order and insert it, queued.
+
+    Runs in the caller's transaction, which must be BEGIN IMMEDIATE.
+    Units are shipped from the warehouses that hold them (see _sources),
+    and each source's balance is decremented in that transaction together
+    with products.quantity and the orders insert; the stock triggers book
+    the freed capacity. Concurrent orders for the same product can
+    therefore never oversell, and no location's balance goes negative.
+    The order is inserted already queued, so a worker picks it up once
+    the transaction commits.
+
+    Raises UnknownProduct or InsufficientStock before writing anything
+    when the order cannot be filled.
+    """
+    if amount <= 0:
+        raise ValueError("Order quantity must be positive")
+    row = conn.execute(
+        "SELECT id, name, COALESCE(warehouse_id, 1), quantity "
+        "FROM products WHERE name = ?",
+        (product,),
+    ).fetchone()
+    if row is None:
+        raise UnknownProduct(product)
+    product_id, name, home, quantity = row
+    sources = _sources(conn, product_id, home, amount)
+    if quantity < amount or sources is None:
+        raise InsufficientStock(product)
+
+    # products.quantity changes are booked against the home
+    # warehouse by trigger, so stock held elsewhere passes through it
+    for warehouse_id, taken in sources:
+        if warehouse_id != home:
+            _take(conn, product_id, warehouse_id, taken)
+            _put(conn, product_id, home, taken)
+    conn.execute(
+        "UPDATE products SET quantity = quantity - ? WHERE id = ?",
+        (amount, product_id),
+    )
+    conn.execute(
+        "INSERT INTO orders (id, product, quantity, email, status) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (order_id, name, amount, email, "queued"),
+    )
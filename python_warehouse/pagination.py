@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+# rows: the current page, oldest id first
+# next_after / prev_before: cursors for the neighbouring pages, or None
+Page = namedtuple("Page", "rows next_after prev_before limit")
+
+
+def keyset_page(conn, table, columns, after=None, before=None, limit=50):
+    """Return one page of `table` ordered by id.
+
+    Uses WHERE id > ? / id < ? on the primary key instead of OFFSET, so every
+    page costs the same however deep into the table it is. `table` and
+    `columns` come from code, never from the request. The first column must
+    be the id.
+    """
+    # One extra row tells us whether there is another page beyond this one
+    if before is not None:
+        rows = conn.execute(
+            f"SELECT {columns} FROM {table} WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before, limit + 1),
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        return Page(
+            rows,
+            rows[-1][0] if rows else None,
+            rows[0][0] if rows and more else None,
+            limit,
+        )
+
+    rows = conn.execute(
+        f"SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+        (after if after is not None else -1, limit + 1),
+    ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return Page(
+        rows,
+        rows[-1][0] if rows and more else None,
+        rows[0][0] if rows and after is not None else None,
+        limit,
+    )
+
+
+def cached_count(conn, table):
+    """COUNT(*) of a table, read from the trigger-maintained row_counts
+    (migration 19) when it has an entry there, so updates never make a
+    listing total recount."""
+    row = conn.execute(
+        "SELECT count FROM row_counts WHERE name = ?", (table,)
+    ).fetchone()
+    if row is not None:
+        return row[0]
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
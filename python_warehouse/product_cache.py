@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from python_warehouse.db import database_path, open_connection
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import database_path, open_connection
+
+# Feed rows read per check; further behind than this, the cache is emptied
+FEED_BATCH = 1000
+
+
+class ProductCache:
+    """Read-through cache of product name -> (id, quantity, warehouse_id).
+
+    Entries expire after `ttl` seconds and the least recently used one is
+    evicted beyond `max_entries`. Before every lookup the cache asks SQLite
+    for PRAGMA data_version on its own connection, which only changes when
+    another connection commits. If it did, the product rows added to
+    change_feed since the last check (every insert, delete and change of a
+    cached column, see migrations 12 and 17) name the products written,
+    and only those are evicted, by id and by name. Writes from any process
+    or worker are therefore seen on the next lookup. The whole cache is
+    emptied only when it fell more than FEED_BATCH rows behind, or the
+    rows it needed were already trimmed.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60.0, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn = open_connection(db_path or database_path())
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # product id -> key of its entry, to evict renamed products
+        self._keys = {}
+        self._data_version = None
+        self._feed_id = self._conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM change_feed"
+        ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        rows = self._conn.execute(
+            "SELECT id, kind, json_extract(data, '$.id'), "
+            "json_extract(data, '$.name') "
+            "FROM change_feed WHERE id > ? ORDER BY id LIMIT ?",
+            (self._feed_id, FEED_BATCH + 1),
+        ).fetchall()
+        if not rows:
+            return
+        if len(rows) > FEED_BATCH or rows[0][0] != self._feed_id + 1:
+            self._feed_id = self._conn.execute(
+                "SELECT MAX(id) FROM change_feed"
+            ).fetchone()[0]
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._keys.clear()
+            return
+        self._feed_id = rows[-1][0]
+        for _, kind, product_id, name in rows:
+            if kind == "product":
+                self._evict(self._keys.get(product_id))
+                if name is not None:
+                    self._evict(name.lower())
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[1] is not None:
+            self._keys.pop(entry[1][0], None)
+        return entry
+
+    def _evict(self, key):
+        if self._drop(key) is not None:
+            self.invalidations += 1
+
+    def get(self, name):
+        """Return (id, quantity, warehouse_id) for a product, or None."""
+        key = name.lower()
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            value = self._conn.execute(
+                "SELECT id, quantity, warehouse_id FROM products WHERE name = ?",
+                (name,),
+            ).fetchone()
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            if value is not None:
+                self._keys[value[0]] = key
+            while len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                if evicted is not None:
+                    self._keys.pop(evicted[0], None)
+                self.evictions += 1
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _reset_cache():
+    # The cache's connection must not cross a fork
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_cache)
+
+
+def get_product_cache():
+    """The per-process cache, sized by PRODUCT_CACHE_SIZE / PRODUCT_CACHE_TTL."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProductCache(
+                max_entries=int(os.environ.get("PRODUCT_CACHE_SIZE", "10000")),
+                ttl=float(os.environ.get("PRODUCT_CACHE_TTL", "60")),
+            )
+        return _cache
@@ -0,0 +1,128 @@
+import _thread
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+slow_query_log = logging.getLogger("python_warehouse.slow_query")
+
+# Statements EXPLAIN QUERY PLAN can describe
+EXPLAINABLE = {"select", "insert", "update", "delete", "replace", "with"}
+
+
+def slow_query_threshold():
+    """SLOW_QUERY_MS as seconds, or None when the slow-query log is off."""
+    value = os.environ.get("SLOW_QUERY_MS")
+    return float(value) / 1000 if value else None
+
+
+def log_slow_query(conn, kind, sql, parameters, seconds):
+    """Log a statement that took `seconds`, with its query plan.
+
+    The plan is fetched on the same connection but through the plain
+    sqlite3 method, so it is neither timed nor logged itself. Pass
+    parameters=None to log without a plan.
+    """
+    plan = ""
+    if kind in EXPLAINABLE and parameters is not None:
+        try:
+            rows = sqlite3.Connection.execute(
+                conn, f"EXPLAIN QUERY PLAN {sql}", parameters
+            ).fetchall()
+            plan = "".join(f"\n    {row[3]}" for row in rows)
+        except sqlite3.Error as exc:
+            plan = f"\n    (no plan: {exc})"
+    slow_query_log.warning(
+        "%.1f ms: %s%s", seconds * 1000, " ".join(sql.split()), plan
+    )
+
+
+def _os_threads():
+    """(start_new_thread, get_ident, allocate_lock, sleep) working on OS
+    threads, even after gevent's monkey.patch_all().
+
+    Patched, they would make the sampler a greenlet, which only runs when
+    the sampled code yields, and key it by a greenlet id that
+    sys._current_frames() does not know.
+    """
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return (
+            *monkey.get_original(
+                "_thread", ["start_new_thread", "get_ident", "allocate_lock"]
+            ),
+            monkey.get_original("time", "sleep"),
+        )
+    return (_thread.start_new_thread, _thread.get_ident, _thread.allocate_lock,
+            time.sleep)
+
+
+class StackSampler:
+    """Samples one OS thread's Python stack every `interval` seconds.
+
+    Samples are kept as collapsed stacks, root first, which is the input
+    format of flamegraph.pl and speedscope. Only stacks that run through
+    `root_code` (the profiler's own caller) are kept, without the frames
+    above it; under gevent this drops the samples taken while another
+    greenlet had the thread.
+    """
+
+    def __init__(self, thread_id, interval=0.002, root_code=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_code = root_code
+        self.samples = Counter()
+        self._stopping = False
+        self._done = None
+
+    def start(self):
+        start_new_thread, _, allocate_lock, _ = _os_threads()
+        self._done = allocate_lock()
+        self._done.acquire()
+        start_new_thread(self._run, ())
+        return self
+
+    def stop(self):
+        self._stopping = True
+        self._done.acquire()
+
+    def _run(self):
+        sleep = _os_threads()[3]
+        try:
+            while not self._stopping:
+                sleep(self.interval)
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is None:
+                    return
+                stack = []
+                while frame is not None and frame.f_code is not self.root_code:
+                    code = frame.f_code
+                    module = frame.f_globals.get("__name__", "?")
+                    stack.append(f"{module}:{code.co_qualname}")
+                    frame = frame.f_back
+                if stack and (frame is not None or self.root_code is None):
+                    self.samples[";".join(reversed(stack))] += 1
+        finally:
+            self._done.release()
+
+    def collapsed(self):
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+
+def sample(fn, interval=0.002):
+    """Run fn() while sampling the current thread; return (result,
+    collapsed stacks, seconds)."""
+    sampler = StackSampler(
+        _os_threads()[1](), interval, root_code=sample.__code__
+    ).start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+    return result, sampler.collapsed(), elapsed
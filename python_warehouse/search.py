@@ -0,0 +1,42 @@
+import re
+
+# Ranking sorts every match, which is wasted work when a one- or two-letter
+# prefix matches much of the catalog; such queries are returned in id order
+# straight off the prefix index (see migration 10)
+RANK_MIN_CHARS = 3
+WORD = re.compile(r"\w+")
+
+
+def match_expression(text, operator="AND"):
+    """Turn free text into an FTS5 query matching each word as a prefix.
+
+    Words are quoted, so FTS5 syntax typed by a user (NEAR, -, ^, ...) is
+    searched for literally rather than interpreted.
+    """
+    words = WORD.findall(text)
+    return f" {operator} ".join(f'"{word}"*' for word in words), words
+
+
+def search_products(conn, text, limit=10):
+    """Return up to `limit` (id, name, quantity) rows whose name matches.
+
+    Every word of `text` has to start a word of the name, in any order
+    ("blue wid" finds "Widget, Blue"). If nothing matches all the words,
+    products matching any of them are returned instead, so a typo in one
+    word still gives suggestions.
+    """
+    for operator in ("AND", "OR"):
+        expression, words = match_expression(text, operator)
+        if not expression:
+            return []
+        ranked = operator == "AND" and min(map(len, words)) >= RANK_MIN_CHARS
+        order = "ORDER BY rank " if ranked else ""
+        rows = conn.execute(
+            "SELECT p.id, p.name, p.quantity FROM products_fts "
+            "JOIN products p ON p.id = products_fts.rowid "
+            f"WHERE products_fts MATCH ? {order}LIMIT ?",
+            (expression, limit),
+        ).fetchall()
+        if rows or len(words) == 1:
+            return rows
+    return rows
@@ -0,0 +1,139 @@
+from array import array
+from collections.abc import Mapping
+
+RELOAD_BATCH = 10000
+
+
+class _Column(Mapping):
+    """Read-only name -> value view over one column of a StockIndex.
+
+    Behaves like the dicts Inventory used to hand out without copying the
+    index; dict(view) makes a real copy when one is needed.
+    """
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[self._index._slots[name]]
+
+    def __iter__(self):
+        return iter(self._index._slots)
+
+    def __len__(self):
+        return len(self._index._slots)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class StockIndex:
+    """Product name -> (product id, quantity) in a compact layout.
+
+    Each name is stored once, as the key of a dict mapping it to an integer
+    slot; product ids and quantities live at that slot in two typed int64
+    arrays. (The dict is the intern table: sys.intern would add a second
+    dict entry per name.) That is one dict entry and 16 bytes of payload per
+    product, instead of the two dicts and boxed ints of the old
+    HashTable/product_list pair.
+
+    Unknown names read as quantity 0. set() and increment() on an unknown
+    name add it with product id 0, as HashTable did.
+    """
+
+    def __init__(self):
+        self._slots = {}
+        self._ids = array("q")
+        self._quantities = array("q")
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self._ids)
+            self._ids.append(0)
+            self._quantities.append(0)
+        return slot
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, key, product_id, quantity=0):
+        slot = self._slot(key)
+        self._ids[slot] = product_id
+        self._quantities[slot] = quantity
+
+    def product_id(self, key):
+        slot = self._slots.get(key)
+        return None if slot is None else self._ids[slot]
+
+    # Overrides the inventory with a set amount
+    def set(self, key, value):
+        self._quantities[self._slot(key)] = value
+
+    def get(self, key):
+        slot = self._slots.get(key)
+        return 0 if slot is None else self._quantities[slot]
+
+    # Restocking
+    def increment(self, key, amount=1):
+        self._quantities[self._slot(key)] += amount
+
+    def remove_stock(self, key, quantity):
+        self._quantities[self._slot(key)] -= quantity
+
+    def bulk_increment(self, keys, amounts):
+        """Add amounts[i] to keys[i] for every i; repeated keys accumulate.
+
+        A plain loop: the name lookups are nearly all of the cost, and a
+        NumPy scatter-add after them measured no faster on a million
+        products (benchmarks/bench_stock_index.py).
+        """
+        slot, quantities = self._slot, self._quantities
+        for key, amount in zip(keys, amounts):
+            quantities[slot(key)] += amount
+
+    def max_id(self):
+        return max(self._ids, default=0)
+
+    def ids(self):
+        return _Column(self, self._ids)
+
+    def quantities(self):
+        return _Column(self, self._quantities)
+
+    def clear(self):
+        self._slots = {}
+        self._ids = array("q")
+        self._quantities = array("q")
+
+    def reload(self, conn, batch_size=RELOAD_BATCH):
+        """Replace the contents with the products table.
+
+        Rows are streamed with fetchmany, so peak memory is the new index
+        plus one batch rather than a list of every row. Names are
+        lowercased, as Inventory has always keyed them.
+        """
+        slots = {}
+        ids = array("q")
+        quantities = array("q")
+        add_id, add_quantity = ids.append, quantities.append
+        cursor = conn.execute("SELECT id, name, quantity FROM products")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for product_id, name, quantity in rows:
+                name = name.lower()
+                slot = slots.get(name)
+                if slot is None:
+                    slots[name] = len(ids)
+                    add_id(product_id)
+                    add_quantity(quantity)
+                else:
+                    ids[slot] = product_id
+                    quantities[slot] = quantity
+        self._slots, self._ids, self._quantities = slots, ids, quantities
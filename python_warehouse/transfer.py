@@ -0,0 +1,220 @@
+"""Streaming CSV / NDJSON import and export of products.
+
+    python transfer.py import products.csv [--batch-size 1000] [--resume]
+    python transfer.py export products.ndjson
+
+Rows have the fields name, quantity and (optionally) warehouse_id. Imports
+upsert on product name, so re-running an import is harmless. A row without
+a warehouse_id leaves an existing product where it is; one with a new
+warehouse_id moves the product's stock there (see logistics.rehome).
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+try:
+    from python_warehouse.db import connect_db, immediate
+    from python_warehouse.logistics import MovementError, rehome
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import connect_db, immediate
+    from logistics import MovementError, rehome
+
+FIELDS = ("name", "quantity", "warehouse_id")
+FORMATS = ("csv", "ndjson")
+
+# New products without a warehouse_id go to warehouse 1; existing ones
+# keep theirs
+UPSERT = (
+    "INSERT INTO products (name, quantity, warehouse_id) "
+    "VALUES (?1, ?2, COALESCE(?3, 1)) "
+    "ON CONFLICT (name) DO UPDATE SET quantity = excluded.quantity, "
+    "warehouse_id = COALESCE(?3, warehouse_id)"
+)
+
+
+def format_for(path):
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def read_rows(fp, fmt):
+    """Yield (name, quantity, warehouse_id) tuples from a text stream;
+    warehouse_id is None when the row has none."""
+    if fmt == "csv":
+        records = csv.DictReader(fp)
+    else:
+        records = (json.loads(line) for line in fp if line.strip())
+    for line_no, record in enumerate(records, start=1):
+        try:
+            name = str(record["name"]).strip()
+            quantity = int(record["quantity"])
+            warehouse_id = record.get("warehouse_id")
+            if warehouse_id not in (None, ""):
+                warehouse_id = int(warehouse_id)
+            else:
+                warehouse_id = None
+        except (KeyError, TypeError, ValueError) as exc:
+            raise ValueError(f"Bad row {line_no}: {record!r}") from exc
+        if not name:
+            raise ValueError(f"Bad row {line_no}: empty product name")
+        if quantity < 0:
+            raise ValueError(f"Bad row {line_no}: negative quantity")
+        yield name, quantity, warehouse_id
+
+
+def _rehome(conn, batch):
+    """Move the stock of existing products whose row names a new warehouse."""
+    for name, _, warehouse_id in batch:
+        if warehouse_id is None:
+            continue
+        row = conn.execute(
+            "SELECT id FROM products WHERE name = ? AND COALESCE(warehouse_id, 1) != ?",
+            (name, warehouse_id),
+        ).fetchone()
+        if row is not None:
+            try:
+                rehome(conn, row[0], warehouse_id)
+            except MovementError as exc:
+                raise ValueError(f"Cannot move {name!r}: {exc}") from None
+
+
+def import_products(rows, source, batch_size=1000, resume=False, progress=None):
+    """Upsert rows into products, one transaction per batch.
+
+    The number of rows committed so far is stored under `source` in the
+    same transaction as each batch, so with resume=True an interrupted
+    import skips exactly the rows that already made it in. Only one batch
+    is ever held in memory. Returns the number of rows written and the
+    rate.
+    """
+    conn = connect_db()
+    try:
+        done = 0
+        if resume:
+            row = conn.execute(
+                "SELECT rows_done, finished FROM import_progress WHERE source = ?",
+                (source,),
+            ).fetchone()
+            if row and row[1]:
+                return {"rows": 0, "skipped": row[0], "seconds": 0.0,
+                        "rows_per_sec": 0.0}
+            done = row[0] if row else 0
+        skipped = done
+        rows = islice(rows, done, None)
+
+        start = time.perf_counter()
+        written = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            with immediate(conn):
+                if batch:
+                    _rehome(conn, batch)
+                    conn.executemany(UPSERT, batch)
+                conn.execute(
+                    "INSERT INTO import_progress (source, rows_done, finished, "
+                    "updated_at) VALUES (?, ?, ?, datetime('now')) "
+                    "ON CONFLICT (source) DO UPDATE SET rows_done = "
+                    "excluded.rows_done, finished = excluded.finished, "
+                    "updated_at = excluded.updated_at",
+                    (source, done + len(batch), int(len(batch) < batch_size)),
+                )
+            done += len(batch)
+            written += len(batch)
+            if progress:
+                progress(written, time.perf_counter() - start)
+            if len(batch) < batch_size:
+                break
+    finally:
+        conn.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "rows": written,
+        "skipped": skipped,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(written / seconds, 1) if seconds else 0.0,
+    }
+
+
+def export_products(fmt, batch_size=5000):
+    """Yield the products table as CSV or NDJSON text, batch by batch.
+
+    Reads with a keyset cursor on id, so memory stays flat however large
+    the table is. Suitable as a streaming HTTP response body.
+    """
+    conn = connect_db()
+    try:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(FIELDS)
+        last_id = -1
+        while True:
+            rows = conn.execute(
+                "SELECT id, name, quantity, warehouse_id FROM products "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            if fmt == "csv":
+                writer.writerows(row[1:] for row in rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                yield "".join(
+                    json.dumps(dict(zip(FIELDS, row[1:]))) + "\n" for row in rows
+                )
+        if fmt == "csv" and buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="Upsert products from a file")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=FORMATS)
+    imp.add_argument("--batch-size", type=int, default=1000)
+    imp.add_argument("--resume", action="store_true",
+                     help="Skip rows committed by an earlier run of this file")
+    exp = sub.add_parser("export", help="Write all products to a file ('-' for stdout)")
+    exp.add_argument("path")
+    exp.add_argument("--format", choices=FORMATS)
+    args = parser.parse_args(argv)
+    fmt = args.format or format_for(args.path)
+
+    if args.command == "import":
+        def progress(rows, seconds):
+            print(f"\r{rows} rows, {rows / seconds if seconds else 0:.0f} rows/sec",
+                  end="", file=sys.stderr)
+
+        with open(args.path, newline="", encoding="utf-8") as fp:
+            stats = import_products(
+                read_rows(fp, fmt), source=args.path,
+                batch_size=args.batch_size, resume=args.resume,
+                progress=progress,
+            )
+        print(file=sys.stderr)
+        print(f"Imported {stats['rows']} rows ({stats['skipped']} skipped) in "
+              f"{stats['seconds']}s - {stats['rows_per_sec']} rows/sec")
+    else:
+        out = sys.stdout if args.path == "-" else open(
+            args.path, "w", newline="", encoding="utf-8")
+        try:
+            for chunk in export_products(fmt):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
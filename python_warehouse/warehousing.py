@@ -1,23 +1,26 @@
+from contextlib import closing
+
 from db import connect_db
-import pandas as pd
+
 
 def space_optimization_report():
-    with connect_db() as conn:
-        df = pd.read_sql_query(
-            "SELECT location_name, max_capacity, used_capacity FROM warehouse WHERE id = 1",
-            conn
-        )
+    # pandas takes a while to import; only pay for it when a report is run
+    from analytics import space_report
+
+    with closing(connect_db()) as conn:
+        report = space_report(conn)
 
-        print("\n--- Warehouse Space Report ---")
-        if not df.empty:
-            df["utilization_pct"] = (df["used_capacity"] / df["max_capacity"]) * 100
-            df["status"] = df["utilization_pct"].apply(lambda pct:
-               "Low Utilization" if pct < 50 else
-               "Efficient" if pct < 90 else
-               "Near Capacity"
-               )
+    df = report["warehouses"]
+    print("\n--- Warehouse Space Report ---")
+    if not df.empty:
+        print(df[["location_name", "used_capacity", "max_capacity",
+                  "utilization_pct", "status", "on_hand", "turnover",
+                  "days_of_cover"]].to_string(index=False))
+    else:
+        print("No warehouse found.")
 
-            print(df[["location_name", "used_capacity", "max_capacity",
-                      "utilization_pct", "status"]].to_string(index=False))
-        else:
-            print("No warehouse found.")
+    at_risk = report["at_risk"]
+    if not at_risk.empty:
+        print("\n--- Lowest Days of Cover ---")
+        print(at_risk[["product", "warehouse_id", "on_hand", "daily_demand",
+                       "days_of_cover"]].to_string(index=False))
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+try:
+    from python_warehouse.db import database_path, immediate, open_connection
+except ImportError:  # running the CLI from inside python_warehouse/
+    from db import database_path, immediate, open_connection
+
+RESTOCK = (
+    "INSERT INTO products (name, quantity, warehouse_id) VALUES (?, ?, 1) "
+    "ON CONFLICT (name) DO UPDATE SET quantity = quantity + excluded.quantity"
+)
+
+
+class WriteBatcher:
+    """Group commit for small, independent writes.
+
+    execute() and restock() queue a write and return a Future. A background
+    thread applies everything queued in one IMMEDIATE transaction; writes
+    that arrive while it commits wait and form the next batch, so concurrent
+    callers share one commit instead of paying for one each. max_delay
+    optionally holds the first write of a batch back for company, until
+    max_batch writes are waiting. Restocks of the same product within a
+    batch are merged into a single upsert.
+
+    A future resolves with the statement's rowcount once the transaction has
+    committed. If the batch fails, its writes are retried one transaction
+    each, so only the offending write's future gets the exception.
+    Statements run in the order they were queued; merged restocks run after
+    them, which is safe because adding quantities commutes.
+    """
+
+    def __init__(self, max_delay=0.0, max_batch=256, db_path=None):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._conn = open_connection(db_path or database_path())
+        self._cond = threading.Condition()
+        self._statements = []
+        # product name -> [total quantity, futures]
+        self._restocks = {}
+        self._size = 0
+        self._first_at = None
+        self._closed = False
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(
+            target=self._run, name="write-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def _queue(self, add):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WriteBatcher is closed")
+            add(future)
+            self._size += 1
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            self._cond.notify()
+        return future
+
+    def execute(self, sql, params=()):
+        return self._queue(
+            lambda future: self._statements.append((sql, params, [future]))
+        )
+
+    def restock(self, name, quantity):
+        """Add quantity to a product, creating it in warehouse 1 if new."""
+        def add(future):
+            entry = self._restocks.setdefault(name, [0, []])
+            entry[0] += quantity
+            entry[1].append(future)
+        return self._queue(add)
+
+    def close(self):
+        """Flush what is queued and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        sqlite3.Connection.close(self._conn)
+
+    def _take(self):
+        with self._cond:
+            while True:
+                if self._size:
+                    due = self._first_at + self.max_delay
+                    wait = due - time.monotonic()
+                    if wait <= 0 or self._size >= self.max_batch or self._closed:
+                        break
+                    self._cond.wait(wait)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+            batch = [
+                *self._statements,
+                *((RESTOCK, (name, total), futures)
+                  for name, (total, futures) in self._restocks.items()),
+            ]
+            self._statements = []
+            self._restocks = {}
+            self._size = 0
+            self._first_at = None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            try:
+                self._apply(batch)
+            except Exception as exc:
+                traceback.print_exc()
+                # Never leave a caller waiting on a write that will not run
+                for _, _, futures in batch:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(exc)
+
+    def _apply(self, batch):
+        try:
+            with immediate(self._conn):
+                counts = [
+                    self._conn.execute(sql, params).rowcount
+                    for sql, params, _ in batch
+                ]
+        except sqlite3.Error:
+            # Find the write(s) at fault by applying them one at a time
+            for write in batch:
+                self._apply_one(*write)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, _, futures), count in zip(batch, counts):
+            for future in futures:
+                future.set_result(count)
+
+    def _apply_one(self, sql, params, futures):
+        try:
+            with immediate(self._conn):
+                count = self._conn.execute(sql, params).rowcount
+        except sqlite3.Error as exc:
+            for future in futures:
+                future.set_exception(exc)
+            return
+        self.batches += 1
+        self.writes += 1
+        for future in futures:
+            future.set_result(count)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def _reset_batcher():
+    # The flush thread and its connection do not survive a fork
+    global _batcher, _batcher_lock
+    _batcher = None
+    _batcher_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_batcher)
+
+
+def get_write_batcher():
+    """The per-process batcher, or None when WRITE_BATCHING is 0.
+
+    WRITE_BATCH_MS (default 0) is how long the first write of a batch may
+    wait for company; WRITE_BATCH_SIZE (default 256) flushes early.
+    Lingering only pays off when commits are slow compared to the rate of
+    writes, since every caller waits for it.
+    """
+    global _batcher
+    if os.environ.get("WRITE_BATCHING", "1") == "0":
+        return None
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = WriteBatcher(
+                max_delay=float(os.environ.get("WRITE_BATCH_MS", "0")) / 1000,
+                max_batch=int(os.environ.get("WRITE_BATCH_SIZE", "256")),
+            )
+        return _batcher
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+from werkzeug.http import http_date
+
+from flask_db import get_db
+
+
+def data_versions(conn, tables):
+    """Write counters of `tables` as a tuple, read in one query."""
+    rows = dict(conn.execute(
+        f"SELECT name, version FROM table_versions "
+        f"WHERE name IN ({', '.join('?' for _ in tables)})",
+        tables,
+    ).fetchall())
+    return tuple(rows.get(table, 0) for table in tables)
+
+
+class RenderCache:
+    """Per-worker LRU of rendered pages keyed on URL and data versions.
+
+    Because the key includes the write counters of every table the page
+    reads, a stale entry is simply never looked up again and ages out.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        # (tables, versions) -> unix time they were first seen, used as
+        # Last-Modified
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def modified(self, tables, versions):
+        key = (tables, versions)
+        with self._lock:
+            if key not in self._seen:
+                self._seen[key] = time.time()
+                while len(self._seen) > max(self.max_entries, 1):
+                    self._seen.popitem(last=False)
+            return self._seen[key]
+
+    def get(self, key):
+        with self._lock:
+            html = self._pages.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._pages[key] = html
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+
+render_cache = RenderCache(int(os.environ.get("RENDER_CACHE_SIZE", "256")))
+
+
+def cached_page(*tables):
+    """Serve a GET view from the render cache and answer conditional GETs.
+
+    `tables` must list every table the page reads. The ETag is derived from
+    their write counters, so a matching If-None-Match is answered with 304
+    after a single table_versions lookup, without running the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+
+            versions = data_versions(get_db(), tables)
+            key = (request.full_path, versions)
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()
+            modified = render_cache.modified(tables, versions)
+
+            html = None
+            if etag not in request.if_none_match:
+                html = render_cache.get(key)
+                if html is None:
+                    html = view(*args, **kwargs)
+                    if not isinstance(html, str):
+                        return html
+                    render_cache.put(key, html)
+
+            response = make_response(html or "")
+            response.set_etag(etag)
+            response.headers["Last-Modified"] = http_date(modified)
+            # Browsers may keep the page but must revalidate it every time
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator